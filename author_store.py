@@ -0,0 +1,124 @@
+"""Author_store.py.
+
+Persistent store of author death years, shared across runs.
+
+Authors are kept in an SQLite database (.cache/authors.sqlite) keyed by their
+normalized name ("Dickens, Charles, 1812-1870" and "Charles Dickens" are the
+same author), with per source (Wikidata, Wikipedia, Open Library) death year,
+resolved identifier (Wikidata ID, Open Library author key) and fetch time.
+Lookups are answered from the store unless the entry is stale: resolved death
+years are kept longer than unresolved ones, which are retried sooner.
+"""
+
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+import unicodedata
+
+from book_cache import DEFAULT_CACHE_DIR
+
+
+logger = logging.getLogger("pg-authors")
+
+SOURCES = ('wikidata', 'wikipedia', 'open_library')
+UNRESOLVED = 'N/A'
+DEFAULT_TTL = 180 * 24 * 60 * 60
+DEFAULT_UNRESOLVED_TTL = 7 * 24 * 60 * 60
+
+# birth/death years and parenthesized notes of catalog names, e.g. "Twain, Mark, 1835-1910", "Doyle, Arthur Conan (Sir)"
+NAME_NOTES_PATTERN = re.compile(r'\([^)]*\)|\b\d{1,4}\??(?:\s*(?:BCE?|AD)\b)?')
+# hyphens left over from year ranges, not inside names
+NAME_DASH_PATTERN = re.compile(r'(?<!\w)-|-(?!\w)')
+NAME_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+
+_author_store = None
+
+
+def display_author_name(author_name):
+    """Returns author name in "First Last" order without years and notes, e.g. "Dickens, Charles, 1812-1870" -> "Charles Dickens"."""
+    name = NAME_DASH_PATTERN.sub(' ', NAME_NOTES_PATTERN.sub(' ', author_name or ''))
+    parts = [part.strip() for part in name.split(',') if part.strip()]
+    if len(parts) == 2:
+        parts = [parts[1], parts[0]]
+    return ' '.join(' '.join(parts).split())
+
+
+def normalize_author_name(author_name):
+    """Returns the store key of an author name: display_author_name without accents, punctuation and case."""
+    name = unicodedata.normalize('NFKD', display_author_name(author_name))
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    return ' '.join(NAME_PUNCTUATION_PATTERN.sub(' ', name).casefold().split())
+
+
+class AuthorStore:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, unresolved_ttl=DEFAULT_UNRESOLVED_TTL):
+        self.ttl = ttl
+        self.unresolved_ttl = unresolved_ttl
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'authors.sqlite'), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS authors (name TEXT, source TEXT, death_year TEXT, ref TEXT, fetched REAL, PRIMARY KEY (name, source))"
+        )
+        self._db.commit()
+
+    def _fresh(self, death_year, fetched):
+        return time.time() - fetched < (self.unresolved_ttl if death_year == UNRESOLVED else self.ttl)
+
+    def get(self, author_name, source, ref=None):
+        """
+        Returns stored (death_year, ref) of the author from source, or None if it is missing or stale.
+
+        With `ref` the entry is only used when it was resolved to that same identifier.
+        """
+        name = normalize_author_name(author_name)
+        with self._lock:
+            row = self._db.execute("SELECT death_year, ref, fetched FROM authors WHERE name = ? AND source = ?", (name, source)).fetchone()
+            if row and self._fresh(row[0], row[2]) and (ref is None or row[1] == ref):
+                self.hits += 1
+                return row[0], row[1]
+            self.misses += 1
+        return None
+
+    def ref(self, author_name, source):
+        """Returns identifier the author was resolved to by source, even if the death year is stale."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT ref FROM authors WHERE name = ? AND source = ?", (normalize_author_name(author_name), source)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, author_name, source, death_year, ref=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO authors VALUES (?, ?, ?, ?, ?)", (normalize_author_name(author_name), source, death_year, ref, time.time())
+            )
+            self._db.commit()
+
+    def summary(self):
+        total = self.hits + self.misses
+        return f"Author store: {self.hits} hits, {self.misses} misses" + (f" ({self.hits / total:.0%} hit rate)" if total else "")
+
+
+def get_author_store():
+    global _author_store
+    if _author_store is None:
+        _author_store = AuthorStore()
+    return _author_store
+
+
+def configure_author_store(cache_dir=None, ttl=None, unresolved_ttl=None, enabled=True):
+    """Replaces process wide author store, `enabled=False` bypasses it."""
+    global _author_store
+    kwargs = {}
+    if cache_dir:
+        kwargs['cache_dir'] = cache_dir
+    if ttl:
+        kwargs['ttl'] = ttl
+    if unresolved_ttl:
+        kwargs['unresolved_ttl'] = unresolved_ttl
+    _author_store = AuthorStore(**kwargs) if enabled else False
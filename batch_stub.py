@@ -0,0 +1,87 @@
+"""Batch_stub.py.
+
+usage: python3 batch_stub.py [options] requests results
+
+Local stand-in of the OpenAI Batch API: turns a batch input file into a batch output file
+
+positional arguments:
+  requests              Batch API input file (JSONL) written by guttenberg2.py --batch-prepare
+  results               Batch API output file (JSONL) to write, ingested by guttenberg2.py --batch-results
+
+options:
+  -h, --help            show this help message and exit
+  --fail-every FAIL_EVERY
+                        fail every n-th request, 0 never fails (default: 0)
+
+Completions follow the requested JSON schema when there is one, so structured
+metadata requests validate; plain completions return a fixed text.
+"""
+
+import json
+import time
+import argparse
+
+from llm_batch import iter_batch_file
+
+
+# string values of schema properties which are validated against a format
+STUB_VALUES = {'bisac_codes': 'FIC000000'}
+
+
+def stub_value(schema, name='value'):
+    if schema.get('type') == 'object':
+        return {key: stub_value(value, key) for key, value in schema.get('properties', {}).items()}
+    if schema.get('type') == 'array':
+        return [stub_value(schema.get('items', {}), name) for _ in range(max(1, schema.get('minItems', 1)))]
+    if schema.get('type') in ('integer', 'number'):
+        return 0
+    if schema.get('type') == 'boolean':
+        return False
+    return STUB_VALUES.get(name, f'stub {name}')
+
+
+def stub_completion(n, body):
+    response_format = body.get('response_format') or {}
+    if response_format.get('type') == 'json_schema':
+        content = json.dumps(stub_value(response_format['json_schema']['schema']))
+    else:
+        content = 'Stub completion.'
+    return {
+        'id': f'chatcmpl-stub-{n}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content, 'refusal': None}, 'logprobs': None, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+    }
+
+
+def run_batch(requests_fname, results_fname, fail_every=0):
+    n = 0
+    with open(results_fname, 'w', encoding='utf-8') as f:
+        for request in iter_batch_file(requests_fname):
+            n += 1
+            result = {'id': f'batch_req_stub_{n}', 'custom_id': request['custom_id'], 'response': None, 'error': None}
+            if fail_every and n % fail_every == 0:
+                result['error'] = {'code': 'server_error', 'message': 'Stub failure'}
+            else:
+                result['response'] = {'status_code': 200, 'request_id': f'stub-{n}', 'body': stub_completion(n, request['body'])}
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+    return n
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='batch_stub.py',
+        usage='python3 %(prog)s [options] requests results',
+        description='Local stand-in of the OpenAI Batch API: turns a batch input file into a batch output file',
+    )
+    parser.add_argument('requests', type=str, help='Batch API input file (JSONL) written by guttenberg2.py --batch-prepare')
+    parser.add_argument('results', type=str, help='Batch API output file (JSONL) to write, ingested by guttenberg2.py --batch-results')
+    parser.add_argument('--fail-every', type=int, default=0, help='fail every n-th request, 0 never fails (default: 0)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    print(f"{run_batch(args.requests, args.results, args.fail_every)} requests processed")
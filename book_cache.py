@@ -0,0 +1,131 @@
+"""Book_cache.py.
+
+Persistent on-disk cache for raw Project Gutenberg book texts.
+
+Book bodies are stored gzip-compressed and content-addressed (by sha256 of the
+raw bytes), while a small SQLite manifest maps each book index to its blob along
+with the HTTP validators (ETag / Last-Modified) needed for conditional
+revalidation, the blob size and the last access time used for LRU eviction
+once the cache grows over its size cap.
+"""
+
+import os
+import gzip
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+
+logger = logging.getLogger("pg-cache")
+
+DEFAULT_CACHE_DIR = os.environ.get('PG_CACHE_DIR', '.cache')
+DEFAULT_MAX_BYTES = int(os.environ.get('PG_BOOK_CACHE_MAX_MB', '4096')) * 1024 * 1024
+# entries younger than this are served without revalidation
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+
+class BookCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.root = os.path.join(cache_dir, 'books')
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.root, 'manifest.sqlite'), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS books ("
+            "book_index TEXT PRIMARY KEY, sha256 TEXT, size INTEGER, etag TEXT, last_modified TEXT, fetched REAL, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS books_accessed ON books (accessed)")
+        self._db.commit()
+
+    def _blob_fname(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.gz")
+
+    def entry(self, index):
+        """Returns manifest entry for the book index, or None if it is not cached."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256, etag, last_modified, fetched FROM books WHERE book_index = ?", (str(index),)
+            ).fetchone()
+        if not row:
+            return None
+        return {'sha256': row[0], 'etag': row[1], 'last_modified': row[2], 'fetched': row[3]}
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry['fetched'] < self.max_age
+
+    def validators(self, entry):
+        """Returns conditional request headers for a cached entry."""
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def get(self, index):
+        """Returns cached raw book bytes, or None if the book is not cached."""
+        entry = self.entry(index)
+        if not entry:
+            return None
+        try:
+            with gzip.open(self._blob_fname(entry['sha256']), 'rb') as f:
+                content = f.read()
+        except (OSError, EOFError):
+            with self._lock:
+                self._db.execute("DELETE FROM books WHERE book_index = ?", (str(index),))
+                self._db.commit()
+            return None
+        with self._lock:
+            self._db.execute("UPDATE books SET accessed = ? WHERE book_index = ?", (time.time(), str(index)))
+            self._db.commit()
+        return content
+
+    def revalidated(self, index):
+        """Marks cached entry as fresh after a 304 Not Modified response."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("UPDATE books SET fetched = ?, accessed = ? WHERE book_index = ?", (now, now, str(index)))
+            self._db.commit()
+
+    def put(self, index, content, etag=None, last_modified=None):
+        digest = hashlib.sha256(content).hexdigest()
+        blob_fname = self._blob_fname(digest)
+        with self._lock:
+            if not os.path.exists(blob_fname):
+                os.makedirs(os.path.dirname(blob_fname), exist_ok=True)
+                tmp_fname = f"{blob_fname}.{threading.get_ident()}.tmp"
+                with gzip.open(tmp_fname, 'wb', compresslevel=6) as f:
+                    f.write(content)
+                os.replace(tmp_fname, blob_fname)
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(index), digest, os.path.getsize(blob_fname), etag, last_modified, now, now)
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # blobs may be shared between indexes, so account each blob once
+        total = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, size FROM books)"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        blobs = self._db.execute(
+            "SELECT sha256, MAX(size), MAX(accessed) FROM books GROUP BY sha256 ORDER BY MAX(accessed)"
+        ).fetchall()
+        for digest, size, _ in blobs:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM books WHERE sha256 = ?", (digest,))
+            try:
+                os.remove(self._blob_fname(digest))
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.debug(f"Evicted cached book blob {digest}")
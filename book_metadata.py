@@ -0,0 +1,102 @@
+"""Book_metadata.py.
+
+Description, keywords and BISAC codes of a book in a single structured completion.
+
+The completion is constrained by a JSON schema and validated before use:
+exactly 7 keywords and 1 to 3 BISAC codes in the official format (e.g.
+FIC019000). Callers fall back to the separate description, keywords and BISAC
+queries when the request fails or its result is invalid.
+"""
+
+import re
+import json
+import logging
+
+from llm_cache import chat_completion
+
+
+logger = logging.getLogger("pg-metadata")
+
+KEYWORDS_NUM = 7
+BISAC_CODES_MAX = 3
+BISAC_CODE_PATTERN = re.compile(r'[A-Z]{3}\d{6}')
+
+METADATA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "description": {"type": "string"},
+        "keywords": {"type": "array", "items": {"type": "string"}, "minItems": KEYWORDS_NUM, "maxItems": KEYWORDS_NUM},
+        "bisac_codes": {"type": "array", "items": {"type": "string"}, "minItems": 1, "maxItems": BISAC_CODES_MAX},
+    },
+    "required": ["description", "keywords", "bisac_codes"],
+    "additionalProperties": False,
+}
+
+
+def metadata_query(title, author, language):
+    query = f'For the classic book "{title}"'
+    if author:
+        query += f' by Author and Writer {author}'
+    query += (
+        ', provide:\n'
+        '1. "description": a 150 words description of the book.'
+    )
+    if language:
+        query += f' Write the review in this language: {language}'
+    query += (
+        f'\n2. "keywords": {KEYWORDS_NUM} keywords (only the keywords, no numbers nor introductory words) that accurately reflect the main themes and genre of the book. '
+        'Keywords must not be subjective claims about its quality, time-sensitive statments and must not include the word "book". '
+        'Keywords must also not contain words included on the book the title, author nor contained on the description.\n'
+        f'3. "bisac_codes": up to {BISAC_CODES_MAX} BISAC codes for its correct classification, only the code in the official format, not its description and not numbered, e.g. FIC019000.'
+    )
+    return query
+
+
+def validate_metadata(metadata):
+    """Returns (description, keywords, bisac_codes) strings formatted as the separate queries return them, or None if invalid."""
+    try:
+        description = metadata["description"].strip()
+        keywords = [keyword.strip() for keyword in metadata["keywords"]]
+        bisac_codes = [code.strip() for code in metadata["bisac_codes"]]
+    except (KeyError, TypeError, AttributeError):
+        return None
+    if not description or len(keywords) != KEYWORDS_NUM or not all(keywords):
+        return None
+    if not 1 <= len(bisac_codes) <= BISAC_CODES_MAX or not all(BISAC_CODE_PATTERN.fullmatch(code) for code in bisac_codes):
+        return None
+    return description, '; '.join(keywords), '; '.join(bisac_codes)
+
+
+def metadata_request(title, author, language, model="gpt-4o-mini"):
+    """Returns the structured completion request of the book metadata, as passed to chat_completion."""
+    return dict(
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": metadata_query(title, author, language)
+            },
+        ],
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "book_metadata", "strict": True, "schema": METADATA_SCHEMA},
+        }
+    )
+
+
+def request_book_metadata(title, author, language, model="gpt-4o-mini"):
+    """
+    Returns (description, keywords, bisac_codes) of the book from a single structured completion.
+
+    Returns:
+        tuple: validated metadata, or None when the request fails or the result does not validate.
+    """
+    try:
+        completion = chat_completion(cache=True, **metadata_request(title, author, language, model))
+        metadata = validate_metadata(json.loads(completion.choices[0].message.content))
+    except Exception as e:
+        logger.warning(f"Structured metadata request failed: {e}")
+        return None
+    if metadata is None:
+        logger.warning(f"Structured metadata of '{title}' failed validation")
+    return metadata
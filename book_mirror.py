@@ -0,0 +1,113 @@
+"""Book_mirror.py.
+
+Offline source of raw book texts: a local Project Gutenberg mirror directory
+or a bulk zip archive of book texts.
+
+Both the regular mirror tree layout (1/2/3/12345/12345-0.txt), the generated
+cache layout (cache/epub/12345/pg12345.txt) and flat folders (12345.txt) are
+supported, as well as zipped book files (12345-0.zip). Plain text files are
+memory-mapped and decoded straight from the mapping.
+"""
+
+import os
+import mmap
+import logging
+import zipfile
+import threading
+
+
+logger = logging.getLogger("pg-mirror")
+
+# file name suffixes in order of preference, with encodings used by gutenberg.org
+VARIANTS = (
+    ('-0', ('utf-8',)),
+    ('', ('utf-8', 'latin-1')),
+    ('-8', ('latin-1',)),
+)
+
+
+def tree_dir(index):
+    """Returns relative mirror folder of the book, e.g. 12345 -> 1/2/3/4/12345."""
+    digits = str(index)
+    if len(digits) == 1:
+        return os.path.join('0', digits)
+    return os.path.join(*digits[:-1], digits)
+
+
+def _decode(content, encodings):
+    for encoding in encodings[:-1]:
+        try:
+            return str(content, encoding)
+        except UnicodeDecodeError:
+            pass
+    return str(content, encodings[-1])
+
+
+class BookMirror:
+    def __init__(self, source):
+        self.source = source
+        self._archive = None
+        self._archive_names = None
+        self._lock = threading.Lock()
+        if os.path.isfile(source):
+            if not zipfile.is_zipfile(source):
+                raise ValueError(f"Book source {source} is neither a folder nor a zip archive")
+            self._archive = zipfile.ZipFile(source)
+            # basename -> archive member, archives keep books in arbitrary folders
+            self._archive_names = {os.path.basename(name): name for name in self._archive.namelist() if not name.endswith('/')}
+        elif not os.path.isdir(source):
+            raise ValueError(f"Book source {source} does not exist")
+
+    def _candidates(self, index):
+        folders = (tree_dir(index), os.path.join('cache', 'epub', str(index)), '')
+        for suffix, encodings in VARIANTS:
+            for folder in folders:
+                yield os.path.join(folder, f"{index}{suffix}"), encodings
+        for folder in folders:
+            yield os.path.join(folder, f"pg{index}"), ('utf-8',)
+
+    def read_text(self, index):
+        """Returns decoded book text, or None if the book is not in the mirror."""
+        for path, encodings in self._candidates(index):
+            if self._archive is not None:
+                text = self._read_archive_member(os.path.basename(path), encodings)
+            else:
+                text = self._read_file(os.path.join(self.source, path), encodings)
+            if text is not None:
+                logger.debug(f"Book {index} read from {path}")
+                return text
+        return None
+
+    def _read_file(self, fname, encodings):
+        try:
+            with open(f"{fname}.txt", 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return ''
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return _decode(mapped, encodings)
+        except FileNotFoundError:
+            pass
+        try:
+            with zipfile.ZipFile(f"{fname}.zip") as archive:
+                return self._read_zip_text(archive, os.path.basename(fname), encodings)
+        except (FileNotFoundError, zipfile.BadZipFile):
+            return None
+
+    @staticmethod
+    def _read_zip_text(archive, name, encodings):
+        # zipped book files hold the text either at the root or under the book folder
+        members = [member for member in archive.namelist() if os.path.basename(member) == f"{name}.txt"]
+        if not members:
+            return None
+        return _decode(archive.read(members[0]), encodings)
+
+    def _read_archive_member(self, name, encodings):
+        member = self._archive_names.get(f"{name}.txt")
+        with self._lock:
+            if member:
+                return _decode(self._archive.read(member), encodings)
+            member = self._archive_names.get(f"{name}.zip")
+            if not member:
+                return None
+            with self._archive.open(member) as nested_file, zipfile.ZipFile(nested_file) as nested:
+                return self._read_zip_text(nested, name, encodings)
@@ -0,0 +1,197 @@
+"""Book_prefetch.py.
+
+Asynchronous prefetch stage for ranges of Project Gutenberg books.
+
+Upcoming books are downloaded with httpx on a background asyncio loop with
+bounded concurrency and a polite minimal interval between requests, decoded,
+and handed to the (synchronous) downstream stages through a bounded queue in
+the original index order, so downloads overlap with parsing, LLM calls and
+PDF rendering of the previous books. Reads and writes of the raw books cache
+run in the loop's default executor, so they never stall the other downloads.
+"""
+
+import time
+import queue
+import asyncio
+import logging
+import threading
+import collections
+
+import http_client
+from book_source import (
+    CHUNK_SIZE, HEADER_END_BYTES, HEADER_PROBE_BYTES, book_url, cached_book_content, fetch_book_text, get_book_mirror,
+    header_rejects, probe_book_header, request_headers, revalidated_book_content, store_book_content
+)
+
+
+logger = logging.getLogger("pg-prefetch")
+
+DEFAULT_CONCURRENCY = 8
+# minimal interval between two requests to gutenberg.org, seconds
+DEFAULT_REQUEST_INTERVAL = 0.25
+DEFAULT_QUEUE_SIZE = 16
+
+_DONE = object()
+
+
+class BookPrefetcher:
+    """
+    Iterates over (index, book_text, error) tuples in the order of `indexes`.
+
+    `book_text` is None when the book is not available (non 200 response)
+    or, with `probe=True`, when the streamed header shows that the book is
+    rejected by the get_books filter - the download is aborted then.
+    `error` holds the exception raised while fetching the book, if any.
+    """
+
+    def __init__(self, indexes, concurrency=DEFAULT_CONCURRENCY, request_interval=DEFAULT_REQUEST_INTERVAL, queue_size=DEFAULT_QUEUE_SIZE, probe=False):
+        self.indexes = indexes
+        self.probe = probe
+        self.concurrency = max(1, concurrency)
+        self.request_interval = request_interval
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="book-prefetch", daemon=True)
+        self._next_request_at = 0.0
+
+    def __iter__(self):
+        self._thread.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        self._stopped.set()
+
+    def _run(self):
+        try:
+            asyncio.run(self._produce())
+        finally:
+            self._put(_DONE, force=True)
+
+    def _put(self, item, force=False):
+        while True:
+            if self._stopped.is_set() and not force:
+                return False
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                if force and self._stopped.is_set():
+                    return False
+
+    async def _produce(self):
+        import httpx
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        timeout = httpx.Timeout(http_client.DEFAULT_TIMEOUT[1], connect=http_client.DEFAULT_TIMEOUT[0])
+        self._rate_lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+            # sliding window of in-flight downloads, emitted in index order
+            pending = collections.deque()
+            for index in self.indexes:
+                if self._stopped.is_set():
+                    break
+                pending.append(asyncio.ensure_future(self._fetch(client, semaphore, index)))
+                if len(pending) >= self.concurrency + self.queue.maxsize:
+                    if not await loop.run_in_executor(None, self._put, await pending.popleft()):
+                        break
+            while pending and not self._stopped.is_set():
+                if not await loop.run_in_executor(None, self._put, await pending.popleft()):
+                    break
+            for task in pending:
+                task.cancel()
+
+    async def _wait_turn(self):
+        async with self._rate_lock:
+            delay = self._next_request_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_request_at = time.monotonic() + self.request_interval
+
+    async def _get(self, client, url, headers):
+        from httpx import TransportError
+        for attempt in range(http_client.DEFAULT_RETRIES + 1):
+            await self._wait_turn()
+            try:
+                response = await client.send(client.build_request('GET', url, headers=headers), stream=True)
+            except TransportError as e:
+                if attempt == http_client.DEFAULT_RETRIES:
+                    raise
+                delay = http_client.backoff_delay(attempt)
+                logger.warning(f"GET {url} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            if response.status_code not in http_client.RETRY_STATUSES or attempt == http_client.DEFAULT_RETRIES:
+                return response
+            delay = http_client.backoff_delay(attempt, http_client.retry_after(response))
+            logger.warning(f"GET {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+    async def _fetch(self, client, semaphore, index):
+        try:
+            # cache lookups (sqlite manifest, gzip blobs) block, they run in the default executor
+            content, entry = await asyncio.get_running_loop().run_in_executor(None, cached_book_content, index)
+            if content is None:
+                async with semaphore:
+                    content = await self._download(client, index, entry)
+            return index, content.decode('utf-8') if content is not None else None, None
+        except Exception as e:
+            return index, None, e
+
+    async def _download(self, client, index, entry):
+        logger.debug(f"Prefetching book {index}")
+        response = await self._get(client, book_url(index), request_headers(entry))
+        if response.status_code == 304 and entry:
+            await response.aclose()
+            content = await asyncio.get_running_loop().run_in_executor(None, revalidated_book_content, index)
+            if content is not None:
+                return content
+            response = await self._get(client, book_url(index), request_headers())
+        try:
+            if response.status_code != 200:
+                logger.error(f"Error fetching book text: {response.status_code}")
+                return None
+            chunks = response.aiter_bytes(CHUNK_SIZE)
+            head = b''
+            async for chunk in chunks:
+                head += chunk
+                if HEADER_END_BYTES in head or len(head) >= HEADER_PROBE_BYTES:
+                    break
+            if self.probe and header_rejects(probe_book_header(head.decode('utf-8', errors='ignore'))):
+                logger.debug(f"Book {index} rejected by header probe")
+                return None
+            content = head + b''.join([chunk async for chunk in chunks])
+        finally:
+            await response.aclose()
+        await asyncio.get_running_loop().run_in_executor(
+            None, store_book_content, index, content, response.headers.get('ETag'), response.headers.get('Last-Modified')
+        )
+        return content
+
+
+def iter_books(indexes, prefetch=DEFAULT_CONCURRENCY, request_interval=DEFAULT_REQUEST_INTERVAL, probe=False):
+    """
+    Yields (index, book_text, error) for each index, prefetching `prefetch` books concurrently.
+
+    With `probe=True` downloads of books rejected by their header are aborted
+    early and yielded with None text.
+
+    With `prefetch=0`, or when books are read from a local mirror, books are
+    fetched sequentially on the calling thread.
+    """
+    if prefetch and get_book_mirror() is None:
+        yield from BookPrefetcher(indexes, concurrency=prefetch, request_interval=request_interval, probe=probe)
+        return
+    for index in indexes:
+        try:
+            yield index, fetch_book_text(index, probe), None
+        except Exception as e:
+            yield index, None, e
@@ -0,0 +1,228 @@
+"""Book_source.py.
+
+Shared loader of raw Project Gutenberg book texts used by both guttenberg2.py
+and guttenberg_bundles.py. Books are served from the on-disk BookCache when
+present and only (re)downloaded from gutenberg.org when missing or stale,
+or read from a local mirror / bulk archive when one is configured.
+"""
+
+import re
+import logging
+
+import http_client
+from book_cache import BookCache
+from book_mirror import BookMirror
+from text_cleaning import find_header_fields
+
+
+logger = logging.getLogger("pg-source")
+
+USER_AGENT = 'Mozilla/5.0 (Windows; U; Windows NT 6.1; zh-CN) AppleWebKit/533+ (KHTML, like Gecko)'
+
+CHUNK_SIZE = 16 * 1024
+# header block is looked for in the first bytes only, books are never rejected past that
+HEADER_PROBE_BYTES = 64 * 1024
+HEADER_END_BYTES = b'*** START OF'
+HEADER_END_PATTERN = re.compile(r"\*\*\* START OF")
+
+_book_cache = None
+_book_mirror = None
+
+
+def book_url(index):
+    return f'https://www.gutenberg.org/ebooks/{index}.txt.utf-8'
+
+
+def get_book_cache():
+    global _book_cache
+    if _book_cache is None:
+        _book_cache = BookCache()
+    return _book_cache
+
+
+def configure_book_cache(cache_dir=None, max_bytes=None, enabled=True):
+    """Replaces process wide book cache, `enabled=False` disables caching."""
+    global _book_cache
+    kwargs = {}
+    if cache_dir:
+        kwargs['cache_dir'] = cache_dir
+    if max_bytes:
+        kwargs['max_bytes'] = max_bytes
+    _book_cache = BookCache(**kwargs) if enabled else False
+
+
+def cached_book_content(index):
+    """
+    Looks the book up in the raw books cache.
+
+    Returns:
+        tuple: (content, entry) - content is set only for fresh entries,
+               entry is the stale manifest entry to revalidate, if any.
+    """
+    cache = get_book_cache()
+    entry = cache.entry(index) if cache else None
+    if entry and cache.is_fresh(entry):
+        content = cache.get(index)
+        if content is not None:
+            logger.debug(f"Book {index} served from cache")
+            return content, None
+        entry = None
+    return None, entry
+
+
+def request_headers(entry=None):
+    headers = {'User-Agent': USER_AGENT}
+    if entry:
+        headers.update(get_book_cache().validators(entry))
+    return headers
+
+
+def store_book_content(index, content, etag=None, last_modified=None):
+    cache = get_book_cache()
+    if cache:
+        cache.put(index, content, etag, last_modified)
+
+
+def revalidated_book_content(index):
+    """Returns cached content after a 304 Not Modified response, or None if the blob is gone."""
+    cache = get_book_cache()
+    cache.revalidated(index)
+    return cache.get(index)
+
+
+def configure_book_source(source=None):
+    """Reads books from a local mirror folder or zip archive instead of gutenberg.org when `source` is set."""
+    global _book_mirror
+    _book_mirror = BookMirror(source) if source else None
+
+
+def get_book_mirror():
+    return _book_mirror
+
+
+def probe_book_header(text):
+    """
+    Parses Gutenberg header fields of a (possibly partial) book text.
+
+    Only the part before the "*** START OF" marker is considered when the marker
+    is present, fields missing from the header are returned as None.
+
+    Returns:
+        dict: Title, Author, Language, Translator and Illustrator raw values, and
+              "Complete" telling whether the whole header block was seen.
+    """
+    start_search = HEADER_END_PATTERN.search(text)
+    header = find_header_fields(text[:start_search.start()] if start_search else text)
+    header['Complete'] = bool(start_search)
+    return header
+
+
+def header_rejects(header):
+    """
+    Tells whether the book is certainly rejected by the get_books filter.
+
+    Only fields present in a complete header are trusted, as the full text
+    filter could still find a missing field further in the book.
+    """
+    if not header['Complete']:
+        return False
+    return bool(
+        (header['Language'] is not None and "english" not in header['Language'].lower()) or
+        (header['Title'] is not None and ("illustrations" in header['Title'].lower() or "pictures" in header['Title'].lower())) or
+        header['Translator'] or
+        header['Illustrator']
+    )
+
+
+def read_header_chunks(chunks):
+    """Reads chunks until the end of the header block (or HEADER_PROBE_BYTES), returns bytes read."""
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if HEADER_END_BYTES in head or len(head) >= HEADER_PROBE_BYTES:
+            break
+    return head
+
+
+class BookStream:
+    """
+    Lazily loaded book: header metadata is available right away, while the
+    body is only downloaded by read_text(). Closing the stream before reading
+    aborts the download.
+    """
+
+    def __init__(self, index, head=b'', chunks=None, response=None, text=None):
+        self.index = index
+        self._head = head
+        self._chunks = chunks
+        self._response = response
+        self._text = text
+        self.header = probe_book_header(text if text is not None else head.decode('utf-8', errors='ignore'))
+        if text is not None:
+            self.header['Complete'] = True
+
+    def read_text(self):
+        if self._text is None:
+            content = self._head + b''.join(self._chunks or ())
+            if self._response is not None:
+                store_book_content(self.index, content, self._response.headers.get('ETag'), self._response.headers.get('Last-Modified'))
+                self.close()
+            self._text = content.decode('utf-8')
+        return self._text
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+
+def open_book(index):
+    """
+    Opens the book for the given Gutenberg index.
+
+    Books come from the local mirror when configured, otherwise fresh cache
+    entries are used without touching the network and stale ones are
+    revalidated with a conditional request; downloads are streamed.
+
+    Returns:
+        BookStream: opened book, or None if the book could not be fetched.
+    """
+    if _book_mirror is not None:
+        text = _book_mirror.read_text(index)
+        if text is None:
+            logger.error(f"Book {index} not found in {_book_mirror.source}")
+            return None
+        return BookStream(index, text=text)
+    content, entry = cached_book_content(index)
+    if content is not None:
+        return BookStream(index, text=content.decode('utf-8'))
+    response = http_client.get(book_url(index), headers=request_headers(entry), stream=True)
+    if response.status_code == 304 and entry:
+        response.close()
+        content = revalidated_book_content(index)
+        if content is not None:
+            return BookStream(index, text=content.decode('utf-8'))
+        response = http_client.get(book_url(index), headers=request_headers(), stream=True)
+    if response.status_code != 200:
+        logger.error(f"Error fetching book text: {response.status_code}")
+        response.close()
+        return None
+    chunks = response.iter_content(CHUNK_SIZE)
+    return BookStream(index, read_header_chunks(chunks), chunks, response)
+
+
+def fetch_book_text(index, probe=False):
+    """
+    Returns book text, or None if the book could not be fetched.
+
+    With `probe=True` the download is aborted as soon as the header shows
+    that the book is rejected by the get_books filter, None is returned then.
+    """
+    book = open_book(index)
+    if book is None:
+        return None
+    if probe and header_rejects(book.header):
+        book.close()
+        logger.debug(f"Book {index} rejected by header probe")
+        return None
+    return book.read_text()
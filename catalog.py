@@ -0,0 +1,211 @@
+"""Catalog.py.
+
+Local index of the Project Gutenberg catalog used to filter books before
+they are downloaded.
+
+The catalog is read from a local copy of either the CSV catalog
+(pg_catalog.csv) or the RDF catalog (rdf-files.tar.bz2 / .zip or an extracted
+folder of pg{id}.rdf files) and stored in an SQLite database of the cache
+folder (.cache/catalog), named after the source path and modification time,
+so a changed source file gets a new database and the stale one is removed.
+"""
+
+import os
+import re
+import csv
+import glob
+import sqlite3
+import hashlib
+import logging
+import tarfile
+import zipfile
+import xml.etree.ElementTree as ET
+
+from book_cache import DEFAULT_CACHE_DIR
+
+
+logger = logging.getLogger("pg-catalog")
+
+NS = {
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'dcterms': 'http://purl.org/dc/terms/',
+    'pgterms': 'http://www.gutenberg.org/2009/pgterms/',
+    'marcrel': 'http://id.loc.gov/vocabulary/relators/',
+}
+SCHEMA_VERSION = 1
+LIST_SEPARATOR = ';'
+
+
+def _join(values):
+    # values are stored as ";a;b;" so that single values can be matched with LIKE '%;a;%'
+    values = [value.strip().replace(LIST_SEPARATOR, ',') for value in values if value and value.strip()]
+    return f"{LIST_SEPARATOR}{LIST_SEPARATOR.join(values)}{LIST_SEPARATOR}" if values else ''
+
+
+def _split(value):
+    return [item for item in (value or '').split(LIST_SEPARATOR) if item]
+
+
+def parse_csv_authors(value):
+    """Splits pg_catalog.csv Authors field into (name, role) pairs, e.g. "Doe, John, 1800-1870 [Illustrator]"."""
+    authors = []
+    for author in (value or '').split('; '):
+        author = author.strip()
+        if not author:
+            continue
+        role_search = re.search(r'\s*\[([^\]]+)\]$', author)
+        role = role_search.group(1).lower() if role_search else 'author'
+        name = author[:role_search.start()] if role_search else author
+        authors.append((name.strip(), role))
+    return authors
+
+
+def iter_csv_records(fname):
+    with open(fname, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                index = int(row['Text#'])
+            except (KeyError, ValueError):
+                continue
+            authors = parse_csv_authors(row.get('Authors'))
+            yield (
+                index,
+                row.get('Type', ''),
+                row.get('Title', ''),
+                _join(language.strip() for language in row.get('Language', '').split(';')),
+                _join(name for name, role in authors if role in ('author', 'creator')),
+                _join(name for name, role in authors if role == 'editor'),
+                _join(name for name, role in authors if role == 'translator'),
+                _join(name for name, role in authors if role == 'illustrator'),
+            )
+
+
+def parse_rdf(content):
+    root = ET.fromstring(content)
+    ebook = root.find('pgterms:ebook', NS)
+    if ebook is None:
+        return None
+    about = ebook.get(f"{{{NS['rdf']}}}about", '')
+    try:
+        index = int(about.rsplit('/', 1)[-1])
+    except ValueError:
+        return None
+
+    def agent_names(tag):
+        return [name.text for name in ebook.findall(f'{tag}/pgterms:agent/pgterms:name', NS)]
+
+    return (
+        index,
+        ' '.join(value.text or '' for value in ebook.findall('dcterms:type/rdf:Description/rdf:value', NS)),
+        ebook.findtext('dcterms:title', '', NS),
+        _join(value.text for value in ebook.findall('dcterms:language/rdf:Description/rdf:value', NS)),
+        _join(agent_names('dcterms:creator') + agent_names('marcrel:aut')),
+        _join(agent_names('marcrel:edt')),
+        _join(agent_names('marcrel:trl')),
+        _join(agent_names('marcrel:ill')),
+    )
+
+
+def iter_rdf_records(source):
+    if os.path.isdir(source):
+        for folder, _, fnames in os.walk(source):
+            for fname in fnames:
+                if fname.endswith('.rdf'):
+                    with open(os.path.join(folder, fname), 'rb') as f:
+                        record = parse_rdf(f.read())
+                    if record:
+                        yield record
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for name in archive.namelist():
+                if name.endswith('.rdf'):
+                    record = parse_rdf(archive.read(name))
+                    if record:
+                        yield record
+    else:
+        with tarfile.open(source, 'r:*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith('.rdf'):
+                    record = parse_rdf(archive.extractfile(member).read())
+                    if record:
+                        yield record
+
+
+def catalog_db_fname(source, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the index database of the source in the cache folder: <name>-<path hash>-<mtime>.sqlite."""
+    source = os.path.abspath(source.rstrip(os.sep))
+    path_hash = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'catalog', f"{os.path.basename(source)}-{path_hash}-{os.stat(source).st_mtime_ns}.sqlite")
+
+
+class Catalog:
+    def __init__(self, source, db_fname=None, cache_dir=None):
+        self.source = source
+        if db_fname:
+            self.db_fname = db_fname
+        else:
+            self.db_fname = catalog_db_fname(source, cache_dir or DEFAULT_CACHE_DIR)
+            os.makedirs(os.path.dirname(self.db_fname), exist_ok=True)
+            # databases of earlier versions of the same source file
+            for fname in glob.glob(f"{glob.escape(self.db_fname.rsplit('-', 1)[0])}-*.sqlite"):
+                if fname != self.db_fname:
+                    logger.info(f"Removing stale catalog index {fname}")
+                    os.remove(fname)
+        self.db = sqlite3.connect(self.db_fname, check_same_thread=False)
+        stamp = f"{SCHEMA_VERSION}:{os.path.getmtime(source)}:{os.path.getsize(source)}"
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+        if not row or row[0] != stamp:
+            self._build(stamp)
+
+    def _build(self, stamp):
+        logger.info(f"Building catalog index {self.db_fname} from {self.source}")
+        records = iter_csv_records(self.source) if self.source.lower().endswith('.csv') else iter_rdf_records(self.source)
+        self.db.execute("DROP TABLE IF EXISTS books")
+        self.db.execute(
+            "CREATE TABLE books (id INTEGER PRIMARY KEY, type TEXT, title TEXT, languages TEXT, "
+            "authors TEXT, editors TEXT, translators TEXT, illustrators TEXT)"
+        )
+        self.db.executemany("INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('stamp', ?)", (stamp,))
+        self.db.commit()
+
+    def get(self, index):
+        row = self.db.execute(
+            "SELECT id, type, title, languages, authors, editors, translators, illustrators FROM books WHERE id = ?", (int(index),)
+        ).fetchone()
+        if not row:
+            return None
+        return {
+            'id': row[0],
+            'type': row[1],
+            'title': row[2],
+            'languages': _split(row[3]),
+            'authors': _split(row[4]),
+            'editors': _split(row[5]),
+            'translators': _split(row[6]),
+            'illustrators': _split(row[7]),
+        }
+
+    def rejected_indexes(self, first, last):
+        """
+        Returns ids between first and last which must not be processed: non text items,
+        books not in English, with a translator or illustrator, without author or editor,
+        or with "illustrations" / "pictures" in the title.
+        """
+        rows = self.db.execute(
+            "SELECT id FROM books WHERE id BETWEEN ? AND ? AND ("
+            "type NOT LIKE '%Text%' OR languages NOT LIKE '%;en;%' OR translators != '' OR illustrators != '' "
+            "OR (authors = '' AND editors = '') OR title LIKE '%illustrations%' OR title LIKE '%pictures%')",
+            (first, last)
+        )
+        return {row[0] for row in rows}
+
+    def filter_indexes(self, indexes):
+        """Returns indexes that pass the catalog filter, ids missing from the catalog are kept."""
+        indexes = list(indexes)
+        if not indexes:
+            return indexes
+        numbers = [int(index) for index in indexes]
+        rejected = self.rejected_indexes(min(numbers), max(numbers))
+        return [index for index, number in zip(indexes, numbers) if number not in rejected]
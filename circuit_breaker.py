@@ -0,0 +1,119 @@
+"""Circuit_breaker.py.
+
+Per service circuit breakers of the metadata sources.
+
+A breaker opens after a number of consecutive failed requests to its service
+(connection errors, timeouts, 429 and 5xx responses left after retries):
+requests are then skipped right away, the lookups reporting 'N/A', instead of
+every book paying the full timeout of a degraded service. Once the cool-down
+period is over the breaker half-opens and lets a single probe request through,
+which closes it again on success or reopens it for another cool-down.
+"""
+
+import os
+import time
+import logging
+import threading
+import collections
+
+
+logger = logging.getLogger("pg-breaker")
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+DEFAULT_FAILURE_THRESHOLD = int(os.environ.get('PG_BREAKER_FAILURES', '5'))
+DEFAULT_COOLDOWN = float(os.environ.get('PG_BREAKER_COOLDOWN', '120'))
+
+_breakers = {}
+_settings = {'failure_threshold': DEFAULT_FAILURE_THRESHOLD, 'cooldown': DEFAULT_COOLDOWN, 'enabled': True}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to a service whose breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = self.skips = 0
+        # state -> times the breaker went to it
+        self.transitions = collections.Counter()
+        self._opened = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.state = state
+        self.transitions[state] += 1
+
+    def allow(self):
+        """Returns whether a request may be sent, counting the skipped ones; a half-open breaker lets one probe through."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened >= self.cooldown:
+                self._transition(HALF_OPEN)
+                logger.info(f"Circuit breaker {self.name} half-open, probing")
+            if self.state == CLOSED or (self.state == HALF_OPEN and not self._probing):
+                self._probing = self.state == HALF_OPEN
+                return True
+            self.skips += 1
+            return False
+
+    def is_open(self):
+        with self._lock:
+            return self.state == OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+                logger.info(f"Circuit breaker {self.name} closed")
+
+    def release(self):
+        """Gives up an allowed request without outcome, e.g. its deadline passed before it was sent."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            probe_failed = self.state == HALF_OPEN and self._probing
+            self._probing = False
+            if probe_failed or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._transition(OPEN)
+                self._opened = time.monotonic()
+                logger.warning(f"Circuit breaker {self.name} opened after {self.failures} consecutive failures, skipping it for {self.cooldown:g}s")
+
+    def summary(self):
+        with self._lock:
+            transitions = ', '.join(f"{self.transitions[state]} {state}" for state in (OPEN, HALF_OPEN, CLOSED) if self.transitions[state])
+            return f"{self.name} {self.state}" + (f" ({transitions})" if transitions else "") + f", {self.skips} skipped"
+
+
+def get_circuit_breaker(name):
+    """Returns process wide breaker of the service, or None when breakers are disabled."""
+    with _breakers_lock:
+        if not _settings['enabled']:
+            return None
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, _settings['failure_threshold'], _settings['cooldown'])
+        return _breakers[name]
+
+
+def configure_circuit_breakers(failure_threshold=None, cooldown=None, enabled=True):
+    """Replaces process wide breakers, unset options keep their defaults; `enabled=False` never skips requests."""
+    with _breakers_lock:
+        _breakers.clear()
+        _settings['failure_threshold'] = failure_threshold or DEFAULT_FAILURE_THRESHOLD
+        _settings['cooldown'] = DEFAULT_COOLDOWN if cooldown is None else cooldown
+        _settings['enabled'] = enabled
+
+
+def circuit_breakers_summary():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return "Circuit breakers: " + ("; ".join(breaker.summary() for breaker in breakers) if breakers else "no requests")
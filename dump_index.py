@@ -0,0 +1,361 @@
+"""Dump_index.py.
+
+usage: python3 dump_index.py [options] index
+
+Builds the offline author and book index from local Wikidata and Open Library dumps:
+
+positional arguments:
+  index                 index database to write (e.g. .cache/dumps.sqlite, used by guttenberg2.py when present)
+
+options:
+  -h, --help            show this help message and exit
+  --wikidata WIKIDATA   Wikidata JSON dump (latest-all.json.gz or .bz2)
+  --ol-authors OL_AUTHORS
+                        Open Library authors dump (ol_dump_authors_latest.txt.gz)
+  --ol-works OL_WORKS   Open Library works dump (ol_dump_works_latest.txt.gz), requires --ol-authors
+
+Dumps are streamed line by line (plain, .gz or .bz2). The index keeps the
+death years of the people found on Wikidata (also used for the Wikipedia
+column when they have an English Wikipedia article) and of the Open Library
+authors, keyed by normalized author name, and the first publication years of
+the Open Library works keyed by normalized (title, author). Author names are
+matched exactly first, then through an FTS index of the names, so catalog
+forms like "Wells, H. G. (Herbert George)" still find "Herbert George Wells".
+Anything the index does not know is looked up online as before.
+"""
+
+import os
+import re
+import bz2
+import gzip
+import json
+import sqlite3
+import logging
+import argparse
+import itertools
+import threading
+import unicodedata
+
+from author_store import normalize_author_name
+from book_cache import DEFAULT_CACHE_DIR
+from wikidata_resolver import DATE_OF_DEATH, claims_death_year
+
+
+logger = logging.getLogger("pg-dumps")
+
+INDEX_FNAME = 'dumps.sqlite'
+SCHEMA_VERSION = 1
+HUMAN = 'Q5'
+INSTANCE_OF = 'P31'
+NAME_LANGUAGES = ('en', 'mul')
+YEAR_PATTERN = re.compile(r'\b\d{3,4}\b')
+TITLE_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+# "Frankenstein; Or, The Modern Prometheus" is listed as "Frankenstein"
+SUBTITLE_PATTERN = re.compile(r'\s*[;:]\s*|\s+or,\s+', re.IGNORECASE)
+# candidates of the fuzzy name match, and the share of name words both names have to share
+NAME_CANDIDATES = 50
+MIN_NAME_SIMILARITY = 0.8
+# words of a name searched for, longer names are cut
+MAX_NAME_WORDS = 8
+PROGRESS_EVERY = 1000000
+
+_dump_index = None
+_dump_index_lock = threading.Lock()
+
+
+def normalize_title(title):
+    """Returns the index key of a title: without accents, punctuation and case."""
+    title = unicodedata.normalize('NFKD', title or '')
+    title = ''.join(char for char in title if not unicodedata.combining(char))
+    return ' '.join(TITLE_PUNCTUATION_PATTERN.sub(' ', title).casefold().split())
+
+
+def dump_year(date):
+    """Returns the year of a free form dump date ("9 June 1870", "1870-06-09", "c. 1600"), or None."""
+    years = YEAR_PATTERN.findall(date or '')
+    return years[-1] if years else None
+
+
+def name_similarity(words, candidate_words):
+    """Returns the share of words of both names matched to each other, initials matching the words they abbreviate."""
+    unmatched = list(candidate_words)
+    matched = 0
+    for word in words:
+        for candidate_word in unmatched:
+            if word == candidate_word or (len(word) == 1 or len(candidate_word) == 1) and word[0] == candidate_word[0]:
+                unmatched.remove(candidate_word)
+                matched += 1
+                break
+    return 2 * matched / (len(words) + len(candidate_words)) if words else 0.0
+
+
+def name_query(words):
+    """Returns FTS query of the names sharing enough words with `words` to reach MIN_NAME_SIMILARITY."""
+    # k shared words of n and at least k candidate words score at most 2k / (n + k)
+    terms = sorted({f'{word}*' if len(word) == 1 else f'"{word}"' for word in words[:MAX_NAME_WORDS]})
+    shared = max(1, -(-len(terms) * 2 // 3))
+    return ' OR '.join(f"({' AND '.join(combination)})" for combination in itertools.combinations(terms, shared))
+
+
+def open_dump(fname):
+    """Opens a dump file for reading bytes, decompressing .gz and .bz2 dumps on the fly."""
+    if fname.endswith('.gz'):
+        return gzip.open(fname, 'rb')
+    if fname.endswith('.bz2'):
+        return bz2.open(fname, 'rb')
+    return open(fname, 'rb')
+
+
+def iter_wikidata_people(fname):
+    """Yields (names, death year, Wikidata ID, English Wikipedia title, sitelinks count) of the people with a date of death."""
+    marker = f'"{DATE_OF_DEATH}"'.encode()
+    with open_dump(fname) as f:
+        for n, line in enumerate(f, 1):
+            if n % PROGRESS_EVERY == 0:
+                print(f'Wikidata: {n} entities read')
+            # one entity per line of a JSON array, entities without a date of death are skipped unparsed
+            if marker not in line:
+                continue
+            try:
+                entity = json.loads(line.rstrip().rstrip(b','))
+            except ValueError:
+                continue
+            claims = entity.get('claims') or {}
+            instances = [((statement.get('mainsnak', {}).get('datavalue') or {}).get('value') or {}).get('id') for statement in claims.get(INSTANCE_OF, [])]
+            if HUMAN not in instances:
+                continue
+            death_year = claims_death_year(claims)
+            if not death_year.isdigit():
+                continue
+            labels, aliases = entity.get('labels') or {}, entity.get('aliases') or {}
+            names = [labels[language]['value'] for language in NAME_LANGUAGES if language in labels]
+            names += [alias['value'] for language in NAME_LANGUAGES for alias in aliases.get(language, [])]
+            sitelinks = entity.get('sitelinks') or {}
+            yield names, death_year, entity['id'], (sitelinks.get('enwiki') or {}).get('title'), len(sitelinks)
+
+
+def iter_open_library(fname, record_type):
+    """Yields the JSON records of record_type ("/type/author", "/type/work") of an Open Library dump."""
+    prefix = record_type.encode() + b'\t'
+    with open_dump(fname) as f:
+        for n, line in enumerate(f, 1):
+            if n % PROGRESS_EVERY == 0:
+                print(f'Open Library {record_type}: {n} records read')
+            if not line.startswith(prefix):
+                continue
+            # type, key, revision, last modified, JSON
+            try:
+                yield json.loads(line.split(b'\t', 4)[4])
+            except (IndexError, ValueError):
+                continue
+
+
+def _create_schema(db):
+    db.executescript(f"""
+        PRAGMA user_version = {SCHEMA_VERSION};
+        CREATE TABLE authors (name TEXT, source TEXT, death_year TEXT, ref TEXT, rank INTEGER, PRIMARY KEY (name, source)) WITHOUT ROWID;
+        CREATE TABLE works (title TEXT, author TEXT, year INTEGER, PRIMARY KEY (title, author)) WITHOUT ROWID;
+        CREATE TABLE names (name TEXT PRIMARY KEY) WITHOUT ROWID;
+        CREATE VIRTUAL TABLE author_names USING fts5(name);
+        CREATE TEMP TABLE ol_authors (key TEXT PRIMARY KEY, name TEXT, death_year TEXT) WITHOUT ROWID;
+        CREATE TEMP TABLE ol_works (title TEXT, key TEXT, year INTEGER);
+    """)
+
+
+# people sharing a name are told apart by notability: the better known one is kept
+UPSERT_AUTHOR = (
+    "INSERT INTO authors VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (name, source) DO UPDATE SET death_year = excluded.death_year, ref = excluded.ref, rank = excluded.rank "
+    "WHERE excluded.rank > authors.rank"
+)
+
+
+def _add_wikidata(db, fname):
+    people = 0
+    for names, death_year, entity_id, wikipedia_title, sitelinks in iter_wikidata_people(fname):
+        people += 1
+        for i, name in enumerate(names):
+            name = normalize_author_name(name)
+            if not name:
+                continue
+            # the label outranks aliases of equally known people
+            rank = sitelinks * 2 + (i == 0)
+            db.execute(UPSERT_AUTHOR, (name, 'wikidata', death_year, entity_id, rank))
+            if wikipedia_title:
+                db.execute(UPSERT_AUTHOR, (name, 'wikipedia', death_year, wikipedia_title, rank))
+    print(f'Wikidata: {people} people with a date of death')
+
+
+def _add_open_library(db, authors_fname, works_fname=None):
+    authors = 0
+    for record in iter_open_library(authors_fname, '/type/author'):
+        name = normalize_author_name(record.get('name') or record.get('personal_name'))
+        if name and record.get('key'):
+            authors += 1
+            db.execute("INSERT OR REPLACE INTO ol_authors VALUES (?, ?, ?)", (record['key'].rsplit('/', 1)[-1], name, dump_year(record.get('death_date'))))
+    print(f'Open Library: {authors} authors')
+    works = 0
+    for record in iter_open_library(works_fname, '/type/work') if works_fname else []:
+        title, year = normalize_title(record.get('title')), dump_year(record.get('first_publish_date'))
+        if not (title and year):
+            continue
+        works += 1
+        for author in record.get('authors') or []:
+            # {"author": {"key": "/authors/OL23919A"}}, older records {"author": "/authors/OL23919A"}
+            key = author.get('author') if isinstance(author, dict) else None
+            key = key.get('key') if isinstance(key, dict) else key
+            if isinstance(key, str):
+                db.execute("INSERT INTO ol_works VALUES (?, ?, ?)", (title, key.rsplit('/', 1)[-1], int(year)))
+    if works_fname:
+        print(f'Open Library: {works} works with a first publication date')
+    db.execute("CREATE INDEX temp.ol_works_key ON ol_works (key)")
+    # authors with the most works are kept among namesakes, as Open Library search ranks them first
+    db.execute(
+        "INSERT INTO authors SELECT a.name, 'open_library', a.death_year, a.key, COUNT(w.key) FROM ol_authors a "
+        "LEFT JOIN ol_works w ON w.key = a.key WHERE a.death_year IS NOT NULL GROUP BY a.key ORDER BY COUNT(w.key) "
+        "ON CONFLICT (name, source) DO UPDATE SET death_year = excluded.death_year, ref = excluded.ref, rank = excluded.rank "
+        "WHERE excluded.rank > authors.rank"
+    )
+    db.execute(
+        "INSERT INTO works SELECT w.title, a.name, MIN(w.year) FROM ol_works w JOIN ol_authors a ON a.key = w.key GROUP BY w.title, a.name"
+    )
+
+
+def build_dump_index(index_fname, wikidata_fname=None, ol_authors_fname=None, ol_works_fname=None):
+    """Builds the index from the given dumps, replacing index_fname once complete."""
+    tmp_fname = f'{index_fname}.tmp'
+    if os.path.exists(tmp_fname):
+        os.remove(tmp_fname)
+    os.makedirs(os.path.dirname(os.path.abspath(index_fname)), exist_ok=True)
+    db = sqlite3.connect(tmp_fname)
+    try:
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        _create_schema(db)
+        if wikidata_fname:
+            _add_wikidata(db, wikidata_fname)
+        if ol_authors_fname:
+            _add_open_library(db, ol_authors_fname, ol_works_fname)
+        # names of the authors and of the authors of works, matched by lookups
+        db.execute("INSERT OR IGNORE INTO names SELECT name FROM authors UNION SELECT author FROM works")
+        db.execute("INSERT INTO author_names SELECT name FROM names")
+        db.execute("INSERT INTO author_names (author_names) VALUES ('optimize')")
+        db.commit()
+        authors, works = (db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ('authors', 'works'))
+        db.execute("DROP TABLE ol_authors")
+        db.execute("DROP TABLE ol_works")
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    os.replace(tmp_fname, index_fname)
+    return authors, works
+
+
+class DumpIndex:
+    def __init__(self, fname):
+        if not os.path.exists(fname):
+            raise FileNotFoundError(f"Dump index {fname} not found, build it with dump_index.py")
+        self.fname = fname
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(f'file:{fname}?mode=ro', uri=True, check_same_thread=False)
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            raise ValueError(f"Dump index {fname} has schema version {version}, rebuild it with dump_index.py")
+        # author name -> index name, or None when nothing is close enough
+        self._names = {}
+
+    def _match_name(self, author_name):
+        """Returns the index name of the author: the same normalized name, else the closest one of the FTS candidates."""
+        name = normalize_author_name(author_name)
+        if name in self._names:
+            return self._names[name]
+        match = None
+        if name and self._db.execute("SELECT 1 FROM names WHERE name = ?", (name,)).fetchone():
+            match = name
+        elif name:
+            words = name.split()
+            candidates = self._db.execute(
+                "SELECT name FROM author_names WHERE author_names MATCH ? ORDER BY rank LIMIT ?", (name_query(words), NAME_CANDIDATES)
+            ).fetchall()
+            best = max(((name_similarity(words, candidate.split()), candidate) for candidate, in candidates), default=None, key=lambda scored: scored[0])
+            if best and best[0] >= MIN_NAME_SIMILARITY:
+                match = best[1]
+        self._names[name] = match
+        return match
+
+    def _count(self, found):
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def death_year(self, author_name, source):
+        """Returns (death_year, ref) of the author from source, or None if the dumps do not know it."""
+        with self._lock:
+            name = self._match_name(author_name)
+            row = self._db.execute("SELECT death_year, ref FROM authors WHERE name = ? AND source = ?", (name, source)).fetchone() if name else None
+            self._count(row)
+        return tuple(row) if row else None
+
+    def publication_year(self, title, author_name):
+        """Returns first publication year of the book on Open Library, also trying the title without its subtitle, or None."""
+        titles = [normalize_title(title), normalize_title(SUBTITLE_PATTERN.split(title or '', 1)[0])]
+        with self._lock:
+            name = self._match_name(author_name)
+            row = None
+            for key in dict.fromkeys(titles) if name else []:
+                row = self._db.execute("SELECT year FROM works WHERE title = ? AND author = ?", (key, name)).fetchone()
+                if row:
+                    break
+            self._count(row)
+        return row[0] if row else None
+
+    def summary(self):
+        total = self.hits + self.misses
+        return f"Dump index: {self.hits} hits, {self.misses} misses" + (f" ({self.hits / total:.0%} hit rate)" if total else "")
+
+
+def get_dump_index():
+    """Returns process wide dump index, the one of the default cache folder if it was built, else False."""
+    global _dump_index
+    with _dump_index_lock:
+        if _dump_index is None:
+            fname = os.path.join(DEFAULT_CACHE_DIR, INDEX_FNAME)
+            _dump_index = DumpIndex(fname) if os.path.exists(fname) else False
+        return _dump_index
+
+
+def configure_dump_index(fname=None, cache_dir=None, enabled=True):
+    """Replaces process wide dump index; without fname the index of the cache folder is used when it was built."""
+    global _dump_index
+    with _dump_index_lock:
+        if fname:
+            _dump_index = DumpIndex(fname) if enabled else False
+        else:
+            fname = os.path.join(cache_dir or DEFAULT_CACHE_DIR, INDEX_FNAME)
+            _dump_index = DumpIndex(fname) if enabled and os.path.exists(fname) else False
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='dump_index.py',
+        usage='python3 %(prog)s [options] index',
+        description='Builds the offline author and book index from local Wikidata and Open Library dumps:',
+    )
+    parser.add_argument('index', type=str, help='index database to write (e.g. .cache/dumps.sqlite, used by guttenberg2.py when present)')
+    parser.add_argument('--wikidata', type=str, default=None, help='Wikidata JSON dump (latest-all.json.gz or .bz2)')
+    parser.add_argument('--ol-authors', type=str, default=None, help='Open Library authors dump (ol_dump_authors_latest.txt.gz)')
+    parser.add_argument('--ol-works', type=str, default=None, help='Open Library works dump (ol_dump_works_latest.txt.gz), requires --ol-authors')
+    args = parser.parse_args()
+    if not (args.wikidata or args.ol_authors):
+        parser.error('at least one of --wikidata and --ol-authors is required')
+    if args.ol_works and not args.ol_authors:
+        parser.error('--ol-works requires --ol-authors, works are indexed by author name')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    authors, works = build_dump_index(args.index, args.wikidata, args.ol_authors, args.ol_works)
+    print(f"{args.index}: {authors} author entries, {works} works")
@@ -0,0 +1,110 @@
+"""Enrichment.py.
+
+Concurrent metadata enrichment of books from several sources.
+
+Sources are injected as EnrichmentSource(name, fetch, timeout), fetch(title,
+author) returning a dict of fields. Every source of a book runs at once in a
+thread pool, so a book costs its slowest source instead of the sum of all of
+them, and enrichments are submitted in the background while the caller goes
+on with the next book. The result holds the fields of the sources finished
+within their own timeout and the enrichment deadline, both counted from
+submission; sources still running by then are left out of the result, and
+their HTTP requests stop at that same time (http_client.deadline) instead of
+retrying on in threads the next books need.
+"""
+
+import time
+import logging
+import threading
+import collections
+import concurrent.futures
+
+import http_client
+
+logger = logging.getLogger("pg-enrichment")
+
+DEFAULT_DEADLINE = 30.0
+# books enriched at once, with one thread per source each
+DEFAULT_BOOKS_IN_FLIGHT = 4
+
+EnrichmentSource = collections.namedtuple('EnrichmentSource', 'name fetch timeout', defaults=(None,))
+
+
+class Enrichment:
+    """Pending enrichment of a book, see Enricher.submit."""
+
+    def __init__(self, enricher, futures, started):
+        self.enricher = enricher
+        self.futures = futures
+        self.started = started
+        self._result = None
+
+    def _due(self, source):
+        return self.enricher._due(source, self.started)
+
+    def done(self):
+        """Returns whether result() would not block."""
+        now = time.monotonic()
+        return self._result is not None or all(future.done() or now >= self._due(source) for source, future in self.futures)
+
+    def result(self):
+        """Returns fields of the sources finished in time, waiting until the deadline at most."""
+        if self._result is not None:
+            return self._result
+        fields = {}
+        for source, future in self.futures:
+            try:
+                fields.update(future.result(timeout=max(0.0, self._due(source) - time.monotonic())))
+                self.enricher._count(source, 'done')
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                logger.debug(f"Enrichment source {source.name} timed out")
+                self.enricher._count(source, 'timed out')
+            except Exception as e:
+                logger.warning(f"Enrichment source {source.name} failed: {e}")
+                self.enricher._count(source, 'failed')
+        self._result = fields
+        return fields
+
+
+class Enricher:
+    def __init__(self, sources, deadline=DEFAULT_DEADLINE, books_in_flight=DEFAULT_BOOKS_IN_FLIGHT):
+        self.sources = list(sources)
+        self.deadline = deadline
+        self.stats = {source.name: collections.Counter() for source in self.sources}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, len(self.sources) * books_in_flight), thread_name_prefix="enrichment"
+        )
+
+    def _due(self, source, started):
+        return started + (self.deadline if source.timeout is None else min(source.timeout, self.deadline))
+
+    @staticmethod
+    def _fetch(source, due, title, author):
+        with http_client.deadline(due):
+            return source.fetch(title, author)
+
+    def _count(self, source, outcome):
+        with self._lock:
+            self.stats[source.name][outcome] += 1
+
+    def submit(self, title, author):
+        """Starts all sources of the book, returns its Enrichment."""
+        started = time.monotonic()
+        futures = [(source, self._executor.submit(self._fetch, source, self._due(source, started), title, author)) for source in self.sources]
+        return Enrichment(self, futures, started)
+
+    def enrich(self, title, author):
+        return self.submit(title, author).result()
+
+    def shutdown(self):
+        # sources still running are not waited for
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def summary(self):
+        with self._lock:
+            sources = [
+                f"{name} {stats['done']} done, {stats['timed out']} timed out, {stats['failed']} failed" for name, stats in self.stats.items()
+            ]
+        return "Enrichment: " + "; ".join(sources)
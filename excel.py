@@ -1,50 +1,194 @@
+"""Excel.py.
+
+usage: python3 excel.py [options]
+
+Published year and author year of death lookup of the books of a spreadsheet:
+
+options:
+  -h, --help            show this help message and exit
+  -i INPUT, --input INPUT
+                        books spreadsheet, reference_id, title and author columns first (default: ExtraData.xlsx)
+  -o OUTPUT, --output OUTPUT
+                        output spreadsheet (default: Guttenberg-22.05.xlsx)
+  --journal JOURNAL     completed rows journal, a rerun resumes after its last row (default: OUTPUT.journal)
+  --restart             ignore the journal and look all rows up again
+  --lookahead LOOKAHEAD
+                        number of rows whose lookups are sent ahead of the row being written (default: 64)
+  --cache-dir CACHE_DIR
+                        LLM responses cache folder (default: .cache)
+  --no-llm-cache        always query OpenAI, bypassing the LLM responses cache
+  --llm-rpm LLM_RPM     OpenAI requests per minute limit (default: PG_OPENAI_RPM or 500)
+  --llm-tpm LLM_TPM     OpenAI tokens per minute limit (default: PG_OPENAI_TPM or 200000)
+
+Published years are looked up once per distinct (title, author) and years of
+death once per distinct author, concurrently through the LLM dispatcher. Rows
+are written in input order to a write-only workbook and checkpointed to the
+journal as they complete; the journal is removed once all rows are written.
+"""
+
+import os
+import json
+import argparse
+
 import openpyxl
 import pandas as pd
-from openai import OpenAI
-
-
-client = OpenAI()
-
-df = pd.read_excel('ExtraData.xlsx')
-
-wb = openpyxl.Workbook()
-ws = wb['Sheet']
-ws.append(['reference_id', 'title', 'author', 'published_year', 'author_year_of_death'])
-
-try:
-    for i, record in enumerate(df.values):
-        print(i)
-        _id, title, author, published_year, author_year_of_death = record
-        #
-        if i >= 0:
-            published_year_query = f'Return only the year "{title}" by {author} was published, or "XXXX" if unknown.'
-            published_year_completion = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": published_year_query
-                    },
-                ]
-            )
-            published_year = published_year_completion.choices[0].message.content
-            #
-            if author not in ['Anonymous', 'Various', '#N/A', '']:
-                author_year_of_death_query = f'Provide only the year of death for {author}, author of {title}. If the author is still alive, return "2025", if you do not know it return "YYYY".'
-                author_year_of_death_completion = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": author_year_of_death_query
-                        },
-                    ]
-                )
-                author_year_of_death = author_year_of_death_completion.choices[0].message.content
-            else:
-                author_year_of_death = '----'
-        ws.append([_id, title, author, published_year, author_year_of_death])
-except Exception as e:
-    print(str(e))
-
-wb.save('Guttenberg-22.05.xlsx')
+
+from llm_cache import configure_llm_cache, get_llm_cache, submit_chat_completion
+from llm_dispatcher import configure_llm_dispatcher, get_llm_dispatcher
+
+
+HEADER = ['reference_id', 'title', 'author', 'published_year', 'author_year_of_death']
+UNKNOWN_AUTHORS = ['Anonymous', 'Various', '#N/A', '']
+DEFAULT_LOOKAHEAD = 64
+PROGRESS_EVERY = 100
+
+
+def published_year_request(title, author):
+    published_year_query = f'Return only the year "{title}" by {author} was published, or "XXXX" if unknown.'
+    return submit_chat_completion(
+        cache=True,
+        model="gpt-3.5-turbo",
+        messages=[
+            {
+                "role": "system",
+                "content": published_year_query
+            },
+        ]
+    )
+
+
+def author_year_of_death_request(author, title):
+    author_year_of_death_query = f'Provide only the year of death for {author}, author of {title}. If the author is still alive, return "2025", if you do not know it return "YYYY".'
+    return submit_chat_completion(
+        cache=True,
+        model="gpt-3.5-turbo",
+        messages=[
+            {
+                "role": "system",
+                "content": author_year_of_death_query
+            },
+        ]
+    )
+
+
+class Lookups:
+    """Deduplicated lookups: one published year request per (title, author), one year of death request per author."""
+
+    def __init__(self):
+        self.published_years = {}
+        self.years_of_death = {}
+
+    def submit(self, title, author):
+        if (title, author) not in self.published_years:
+            self.published_years[(title, author)] = published_year_request(title, author)
+        # the year of death prompt names the first title seen of the author
+        if author not in UNKNOWN_AUTHORS and author not in self.years_of_death:
+            self.years_of_death[author] = author_year_of_death_request(author, title)
+
+    def result(self, title, author):
+        """Returns (published_year, author_year_of_death) of a submitted row, waiting for its requests."""
+        published_year = self.published_years[(title, author)].result().choices[0].message.content
+        if author in UNKNOWN_AUTHORS:
+            return published_year, '----'
+        return published_year, self.years_of_death[author].result().choices[0].message.content
+
+
+def read_rows(fname):
+    """Returns (reference_id, title, author) rows of the spreadsheet, empty cells as ''."""
+    df = pd.read_excel(fname)
+    return [tuple('' if pd.isna(value) else value for value in record[:3]) for record in df.values]
+
+
+def load_journal(fname, rows):
+    """Returns (published_year, author_year_of_death) of the leading rows recorded in the journal."""
+    done = []
+    try:
+        with open(fname, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn last line of an interrupted run
+                    break
+                i = len(done)
+                if i >= len(rows) or entry.get('row') != i or entry.get('reference_id') != str(rows[i][0]):
+                    print(f'Journal does not match the input from row {i} on, resuming from there')
+                    break
+                done.append((entry['published_year'], entry['author_year_of_death']))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def journal_entry(i, row, values):
+    return json.dumps({'row': i, 'reference_id': str(row[0]), 'published_year': values[0], 'author_year_of_death': values[1]}, ensure_ascii=False) + '\n'
+
+
+def run(input_fname, output_fname, journal_fname, restart=False, lookahead=DEFAULT_LOOKAHEAD):
+    rows = read_rows(input_fname)
+    done = [] if restart else load_journal(journal_fname, rows)
+    print(
+        f'{len(rows)} rows, {len({row[1:] for row in rows})} distinct books, {len({row[2] for row in rows})} distinct authors, '
+        f'{len(done)} rows resumed from journal'
+    )
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet')
+    ws.append(HEADER)
+    # journal is rewritten with the rows it resumes, dropping any torn or mismatching tail
+    journal = open(journal_fname, 'w', encoding='utf-8')
+    for i, (row, values) in enumerate(zip(rows, done)):
+        ws.append([*row, *values])
+        journal.write(journal_entry(i, row, values))
+    journal.flush()
+    lookups = Lookups()
+    completed = submitted = len(done)
+    try:
+        for i in range(completed, len(rows)):
+            while submitted < min(len(rows), i + lookahead):
+                lookups.submit(*rows[submitted][1:])
+                submitted += 1
+            values = lookups.result(*rows[i][1:])
+            ws.append([*rows[i], *values])
+            journal.write(journal_entry(i, rows[i], values))
+            journal.flush()
+            completed += 1
+            if completed % PROGRESS_EVERY == 0:
+                print(f'{completed} of {len(rows)} rows, {get_llm_dispatcher().summary()}')
+    except (Exception, KeyboardInterrupt) as e:
+        print(f'Stopped at row {completed}: {e!r}, rerun to resume')
+    finally:
+        journal.close()
+        wb.save(output_fname)
+        if get_llm_cache():
+            print(get_llm_cache().summary())
+        print(get_llm_dispatcher().summary())
+    if completed == len(rows):
+        os.remove(journal_fname)
+    return completed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='excel.py',
+        usage='python3 %(prog)s [options]',
+        description='Published year and author year of death lookup of the books of a spreadsheet:',
+    )
+    parser.add_argument('-i', '--input', type=str, default='ExtraData.xlsx',
+                        help='books spreadsheet, reference_id, title and author columns first (default: ExtraData.xlsx)')
+    parser.add_argument('-o', '--output', type=str, default='Guttenberg-22.05.xlsx', help='output spreadsheet (default: Guttenberg-22.05.xlsx)')
+    parser.add_argument('--journal', type=str, default=None, help='completed rows journal, a rerun resumes after its last row (default: OUTPUT.journal)')
+    parser.add_argument('--restart', action='store_true', help='ignore the journal and look all rows up again')
+    parser.add_argument('--lookahead', type=int, default=DEFAULT_LOOKAHEAD,
+                        help=f'number of rows whose lookups are sent ahead of the row being written (default: {DEFAULT_LOOKAHEAD})')
+    parser.add_argument('--cache-dir', type=str, default=None, help='LLM responses cache folder (default: .cache)')
+    parser.add_argument('--no-llm-cache', action='store_true', help='always query OpenAI, bypassing the LLM responses cache')
+    parser.add_argument('--llm-rpm', type=int, default=None, help='OpenAI requests per minute limit (default: PG_OPENAI_RPM or 500)')
+    parser.add_argument('--llm-tpm', type=int, default=None, help='OpenAI tokens per minute limit (default: PG_OPENAI_TPM or 200000)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    configure_llm_cache(args.cache_dir, enabled=not args.no_llm_cache)
+    configure_llm_dispatcher(args.llm_rpm, args.llm_tpm)
+    run(args.input, args.output, args.journal or f'{args.output}.journal', args.restart, max(1, args.lookahead))
@@ -10,10 +10,40 @@ options:
                         books indexes to process, comma separated
   -s START, --start START
                         start index of the program
-  -e END, --end END     end index of the program
+  -e END, --end END     end index of the program (default: latest published book index)
   -w, --word            generate Word documents
   -c, --cover           generate PDF covers
   --interior            generate PDF interior only
+  --cache-dir CACHE_DIR
+                        raw and parsed books, LLM responses and authors cache
+                        folder (default: .cache)
+  --no-cache            always download and parse books, bypassing the raw and
+                        parsed books caches
+  --no-llm-cache        always query OpenAI, bypassing the LLM responses cache
+  --no-author-store     always query author death years, bypassing the author store
+  --dump-index DUMP_INDEX
+                        offline author and book index built by dump_index.py, looked up before the online sources
+                        (default: CACHE_DIR/dumps.sqlite when present)
+  --source SOURCE       local Gutenberg mirror folder or zip archive to read books from instead of gutenberg.org
+  --catalog CATALOG     local Gutenberg catalog (pg_catalog.csv or rdf-files.tar.bz2) used to skip books before downloading
+  --prefetch PREFETCH   number of books downloaded concurrently ahead of processing, 0 disables prefetching (default: 8)
+  --llm-rpm LLM_RPM     OpenAI requests per minute limit (default: PG_OPENAI_RPM or 500)
+  --llm-tpm LLM_TPM     OpenAI tokens per minute limit (default: PG_OPENAI_TPM or 200000)
+  --structured-metadata
+                        request description, keywords and BISAC codes in a single structured completion,
+                        with separate queries as fallback
+  --parse-workers PARSE_WORKERS
+                        number of processes parsing books ahead of processing, 0 parses in the main process (default: number of CPUs)
+  --enrichment-deadline ENRICHMENT_DEADLINE
+                        seconds the spreadsheet metadata sources of a book are waited for (default: 30)
+  --breaker-failures BREAKER_FAILURES
+                        consecutive failed requests after which a metadata source is skipped (default: PG_BREAKER_FAILURES or 5)
+  --breaker-cooldown BREAKER_COOLDOWN
+                        seconds a failing metadata source is skipped before it is probed again (default: PG_BREAKER_COOLDOWN or 120)
+  --batch-prepare REQUESTS
+                        batch mode phase one: write the LLM requests of the books to an OpenAI Batch API input file and exit
+  --batch-results RESULTS [RESULTS ...]
+                        batch mode phase two: load OpenAI Batch API output files into the LLM cache, then process the books
 
 Script will create output folder named as datestamp, and also maintain last processed book index and Excel file with each run spreadsheet
 """
@@ -21,34 +51,51 @@ Script will create output folder named as datestamp, and also maintain last proc
 import os
 import re
 import sys
+import json
+import time
 import argparse
 import pathlib
+import functools
 import traceback
+import collections
 
-import requests
-import fpdf
-import docx
-import openpyxl
 from time import sleep
 from datetime import datetime
 from random import randint
-from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from PIL import Image
-from pdf2image import convert_from_path
-from bs4 import BeautifulSoup
-from openai import OpenAI
 
+import http_client
+from author_store import configure_author_store, get_author_store
+from book_source import book_url as source_book_url, configure_book_cache, configure_book_source
+from book_prefetch import DEFAULT_CONCURRENCY as DEFAULT_PREFETCH, iter_books
+from circuit_breaker import CircuitOpenError, circuit_breakers_summary, configure_circuit_breakers
+from dump_index import configure_dump_index, get_dump_index
+from enrichment import DEFAULT_BOOKS_IN_FLIGHT, DEFAULT_DEADLINE as DEFAULT_ENRICHMENT_DEADLINE, Enricher, EnrichmentSource
+from llm_cache import chat_completion, configure_llm_cache, get_llm_cache, submit_chat_completion
+from parse_cache import configure_parse_cache
+from parse_pool import DEFAULT_WORKERS as DEFAULT_PARSE_WORKERS, configure_parse_pool, parse_workers, shutdown_parse_pool, submit_parse
+from text_cleaning import parse_book_header
+from toc_formatter import format_contents, get_toc_formatter
+from wikidata_resolver import get_wikidata_resolver
 
-client = OpenAI()
+
+# latest published book index lookup is cached for this long, seconds
+LATEST_INDEX_TTL = 60 * 60
+LATEST_INDEX_CACHE_FNAME = '.cache/latest_index.json'
 
 
 def search_open_library(title, author_name):
     base_url = 'http://openlibrary.org/search.json'
     params = {'title': title, 'author': author_name}
+    store = get_author_store()
+    dump_index = get_dump_index()
+    pub_year = dump_index.publication_year(title, author_name) if dump_index else None
+    if pub_year:
+        # books found in the dumps are not looked up online, their authors without a death year there have none on Open Library
+        dumped_author = dump_index.death_year(author_name, 'open_library')
+        return {'open_library_publication_year': pub_year, 'open_library_death_year': dumped_author[0] if dumped_author else 'N/A'}
 
     try:
-        response = requests.get(base_url, params=params)
+        response = http_client.get(base_url, params=params)
         if response.status_code == 200:
             data = response.json()
             if 'docs' in data and len(data['docs']) > 0:
@@ -60,9 +107,13 @@ def search_open_library(title, author_name):
                 # Extract author key to get death year
                 author_key = book_data['author_key'][0] if 'author_key' in book_data and book_data['author_key'] else None
                 death_year = 'N/A'
-                if author_key:
+                # authors already resolved to the same key are served from the author store
+                stored = store.get(author_name, 'open_library', author_key) if store and author_key else None
+                if stored:
+                    death_year = stored[0]
+                elif author_key:
                     author_url = f"http://openlibrary.org/authors/{author_key}.json"
-                    author_response = requests.get(author_url)
+                    author_response = http_client.get(author_url)
                     if author_response.status_code == 200:
                         author_data = author_response.json()
                         death_date = author_data.get('death_date', None)
@@ -73,6 +124,8 @@ def search_open_library(title, author_name):
                                     death_year = 'N/A'
                             except:
                                 death_year = 'N/A'
+                        if store:
+                            store.put(author_name, 'open_library', death_year, author_key)
 
                 return {'open_library_publication_year': pub_year, 'open_library_death_year': death_year}
             else:
@@ -80,6 +133,9 @@ def search_open_library(title, author_name):
                 return {'open_library_publication_year': 'N/A', 'open_library_death_year': 'N/A'}
         else:
             print(f"Failed to fetch Open Library data for {title} by {author_name}")
+    except (CircuitOpenError, http_client.DeadlineExceeded):
+        # skipped while Open Library is degraded, or past the book enrichment deadline
+        pass
     except Exception as e:
         print(f"Error fetching data for {title} by {author_name} from Open Library: {e}")
 
@@ -87,27 +143,39 @@ def search_open_library(title, author_name):
 
 
 def search_wikipedia_author(author_name):
+    dump_index = get_dump_index()
+    dumped = dump_index.death_year(author_name, 'wikipedia') if dump_index else None
+    if dumped:
+        return dumped[0]
+    store = get_author_store()
+    stored = store.get(author_name, 'wikipedia') if store else None
+    if stored:
+        return stored[0]
     try:
         search_url = "https://en.wikipedia.org/w/api.php"
         headers = {'User-Agent': 'Mozilla/5.0 (Windows; U; Windows NT 6.1; zh-CN) AppleWebKit/533+ (KHTML, like Gecko)'}
         search_params = {'action': 'query', 'format': 'json', 'list': 'search', 'srsearch': author_name}
-        response = requests.get(search_url, headers=headers, params=search_params)
+        response = http_client.get(search_url, headers=headers, params=search_params)
         data = response.json()
 
+        death_year, page_title = 'N/A', None
         if 'query' in data and 'search' in data['query'] and data['query']['search']:
             page_title = data['query']['search'][0]['title']
             content_url = f"https://en.wikipedia.org/w/api.php"
             content_params = {"action": "parse", "format": "json", "page": page_title}
-            response = requests.get(content_url, headers=headers, params=content_params)
+            response = http_client.get(content_url, headers=headers, params=content_params)
             data = response.json()
             page_text = data['parse']['text']['*']
 
-            death_year = 'N/A'
             death_match = re.search(r'\b(?:died|death)\s*(?:on|in)?\s*(\d{4})', page_text, re.IGNORECASE)
             if death_match:
                 death_year = death_match.group(1)
-                return death_year
+        if store:
+            store.put(author_name, 'wikipedia', death_year, page_title)
+        return death_year
 
+    except (CircuitOpenError, http_client.DeadlineExceeded):
+        pass
     except Exception as e:
         print(f"Error fetching data for {author_name} from Wikipedia: {e}")
 
@@ -120,7 +188,7 @@ def search_google_books(title, author_name, retries=3):
 
     for attempt in range(retries):
         try:
-            response = requests.get(base_url, params=params)
+            response = http_client.get(base_url, params=params)
             if response.status_code == 200:
                 data = response.json()
                 if 'items' in data and data['totalItems'] > 0:
@@ -136,7 +204,11 @@ def search_google_books(title, author_name, retries=3):
                     return {'google_books_publication_year': 'N/A'}
             else:
                 print(f"Failed to fetch Google Books data for {title} by {author_name}, attempt {attempt+1}")
-                sleep(1)
+                # never waits past the book enrichment deadline, the next attempt then gives up
+                left = http_client.remaining()
+                sleep(1 if left is None else max(0.0, min(1, left)))
+        except (CircuitOpenError, http_client.DeadlineExceeded):
+            return {'google_books_publication_year': 'N/A'}
         except Exception as e:
             print(f"Error fetching data for {title} by {author_name} from Google Books: {e}")
 
@@ -145,54 +217,84 @@ def search_google_books(title, author_name, retries=3):
 
 
 def search_wikidata(author_name):
-    base_url = 'https://www.wikidata.org/w/api.php'
-    params = {'action': 'wbsearchentities', 'format': 'json', 'language': 'en', 'search': author_name, 'type': 'item'}
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows; U; Windows NT 6.1; zh-CN) AppleWebKit/533+ (KHTML, like Gecko)'}
+    dump_index = get_dump_index()
+    dumped = dump_index.death_year(author_name, 'wikidata') if dump_index else None
+    if dumped:
+        return dumped[0]
+    # resolved in batches with the other authors pending, see wikidata_resolver; waited for until the enrichment deadline at most
     try:
-        response = requests.get(base_url, params=params, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            if 'search' in data and len(data['search']) > 0:
-                author_id = data['search'][0]['id']
-                author_url = f"https://www.wikidata.org/wiki/Special:EntityData/{author_id}.json"
-                author_response = requests.get(author_url, headers=headers)
-                if author_response.status_code == 200:
-                    author_data = author_response.json()
-                    entities = author_data.get('entities', {})
-                    author_info = entities.get(author_id, {})
-                    claims = author_info.get('claims', {})
-                    death_date = claims.get('P570', [{}])[0].get('mainsnak', {}).get('datavalue', {}).get('value', {}).get('time', None)
-                    if death_date:
-                        death_year = death_date[1:5]
-                        return death_year
-            else:
-                print(f"No data found on Wikidata for {author_name}")
-        else:
-            print(f"Failed to fetch Wikidata data for {author_name}")
+        return get_wikidata_resolver().death_year(author_name, due=http_client.current_deadline())
     except Exception as e:
         print(f"Error fetching data for {author_name} from Wikidata: {e}")
 
     return 'N/A'
 
 
-class PDF(fpdf.FPDF):
-    def footer(self):
-        if self.page_no() != 1:
-            # Go to 1.5 cm from bottom
-            self.set_y(-15)
-            self.add_font("dejavu-sans", style="", fname="assets/DejaVuSans.ttf")
-            self.set_font("dejavu-sans", size=8)
-            # Print centered page number
-            self.cell(0, 10, f"{self.page_no()}", 0, 0, 'C')
-
-
-def get_latest_published_book_index():
+# spreadsheet extended metadata sources, looked up concurrently; seconds each source is waited for
+ENRICHMENT_SOURCES = [
+    EnrichmentSource('google_books', search_google_books, 30),
+    EnrichmentSource('open_library', search_open_library, 30),
+    EnrichmentSource('wikipedia', lambda title, author: {'wikipedia_author_year_of_death': search_wikipedia_author(author)}, 20),
+    EnrichmentSource('wikidata', lambda title, author: {'wikidata_author_year_of_death': search_wikidata(author)}, 20),
+]
+# enrichment fields in spreadsheet column order
+ENRICHMENT_COLUMNS = [
+    'google_books_publication_year',
+    'open_library_publication_year',
+    'wikidata_author_year_of_death',
+    'wikipedia_author_year_of_death',
+    'open_library_death_year',
+]
+
+
+def write_enriched_rows(ws, pending_rows, keep=0):
+    """Appends (row, enrichment) rows whose enrichment finished to ws in order, waiting for the oldest while more than `keep` are pending."""
+    while pending_rows and (len(pending_rows) > keep or pending_rows[0][1].done()):
+        row, enrichment = pending_rows.popleft()
+        fields = enrichment.result()
+        ws.append(row + [fields.get(column, 'N / A') for column in ENRICHMENT_COLUMNS])
+
+
+@functools.lru_cache(maxsize=None)
+def pdf_class():
+    # fpdf and the font registry are imported on first use only, so that -h and non PDF runs start fast
+    import fpdf
+    from pdf_fonts import add_font
+
+    class PDF(fpdf.FPDF):
+        def footer(self):
+            if self.page_no() != 1:
+                # Go to 1.5 cm from bottom
+                self.set_y(-15)
+                add_font(self, "dejavu-sans", "assets/DejaVuSans.ttf")
+                self.set_font("dejavu-sans", size=8)
+                # Print centered page number
+                self.cell(0, 10, f"{self.page_no()}", 0, 0, 'C')
+
+    return PDF
+
+
+def get_latest_published_book_index(max_age=LATEST_INDEX_TTL):
+    try:
+        with open(LATEST_INDEX_CACHE_FNAME) as f:
+            cached = json.load(f)
+        if time.time() - cached['fetched'] < max_age:
+            return int(cached['index'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    from bs4 import BeautifulSoup
     url = 'https://www.gutenberg.org/ebooks/search/?sort_order=release_date'
-    response = requests.get(url, timeout=60)
+    response = http_client.get(url)
     html = BeautifulSoup(response.content, features="html.parser")
     latest_book = html.body.find('li', attrs={'class': 'booklink'})
-    index = latest_book.a.attrs['href'].split('/')[-1]
-    return int(index)
+    index = int(latest_book.a.attrs['href'].split('/')[-1])
+    try:
+        pathlib.Path(LATEST_INDEX_CACHE_FNAME).parent.mkdir(parents=True, exist_ok=True)
+        with open(LATEST_INDEX_CACHE_FNAME, 'w') as f:
+            json.dump({'index': index, 'fetched': time.time()}, f)
+    except OSError:
+        pass
+    return index
 
 
 def update_last_index(index):
@@ -207,15 +309,12 @@ def get_previous_last_index():
         return 1
 
 
-def format_contents_with_openai(book_contents):
+def contents_format_request(book_contents):
     """
-    Formats the raw contents section using OpenAI API.
+    Returns the chat completion request formatting the raw contents section, as passed to chat_completion.
 
     Args:
-        raw_contents (str): The unformatted "Contents" section.
-
-    Returns:
-        str: The formatted "Contents" section.
+        book_contents (str): The unformatted "Contents" section.
     """
     prompt = f"""
     The following text is a raw Contents section from a book. Please format it into a clean and structured "Contents" section while adhering to these guidelines:
@@ -232,15 +331,28 @@ def format_contents_with_openai(book_contents):
 
     Please return the formatted Contents section.
     """
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant for formatting a Contents section text from a book."},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0  # For consistent formatting
+    )
+
+
+def format_contents_with_openai(book_contents):
+    """
+    Formats the raw contents section using OpenAI API.
+
+    Args:
+        raw_contents (str): The unformatted "Contents" section.
+
+    Returns:
+        str: The formatted "Contents" section.
+    """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant for formatting a Contents section text from a book."},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0  # For consistent formatting
-        )
+        response = chat_completion(**contents_format_request(book_contents))
         book_contents = response.choices[0].message.content
         #print(response)
 
@@ -260,9 +372,11 @@ def generate_book_pdfs(folder, _id, title, author, description, notes, contents,
         f"{folder}/imgs/{_id}.png",
         f"{folder}/imgs/{_id}.webp"
     )
+    import fpdf
+    from pdf_fonts import add_font
     #print ("Contents passed to function pdf creation",contents)
-    pdf = PDF(format=(152.4, 228.6))
-    pdf.add_font("dejavu-sans", style="", fname="assets/DejaVuSans.ttf")
+    pdf = pdf_class()(format=(152.4, 228.6))
+    add_font(pdf, "dejavu-sans", "assets/DejaVuSans.ttf")
     # TITLE
     pdf.add_page()
     pdf.set_font("dejavu-sans", size=24)
@@ -301,7 +415,7 @@ def generate_book_pdfs(folder, _id, title, author, description, notes, contents,
         # FRONT COVER
         cover_width, cover_height = 152.4 + 3.175, 234.95
         pdf = fpdf.FPDF(format=(cover_width, cover_height))
-        pdf.add_font('dejavu-sans', style="", fname="assets/DejaVuSans.ttf")
+        add_font(pdf, "dejavu-sans", "assets/DejaVuSans.ttf")
         pdf.add_page()
         pdf.set_fill_color(r=250, g=249, b=222)
         pdf.rect(h=pdf.h, w=pdf.w, x=0, y=0, style="DF")
@@ -314,8 +428,9 @@ def generate_book_pdfs(folder, _id, title, author, description, notes, contents,
         if include_cover_img:
             try:
                 prompt = f"Generate an image to be featured in a book cover. Exclude any depictions of books, book covers or written text. Meeting the criteria mentioned before, the image needs to be based on the following description: {description}"
-                img_url = client.images.generate(model='dall-e-3', prompt=prompt, n=1, quality="standard").data[0].url
-                response = requests.get(img_url)
+                from llm_dispatcher import get_llm_dispatcher
+                img_url = get_llm_dispatcher().image(model='dall-e-3', prompt=prompt, n=1, quality="standard").data[0].url
+                response = http_client.get(img_url)
                 with open(dalle_cover_img_png, 'wb') as img:
                     img.write(response.content)
                 pdf.image(dalle_cover_img_png, x=(152.4 - 100 + 6.35) / 2,
@@ -324,6 +439,8 @@ def generate_book_pdfs(folder, _id, title, author, description, notes, contents,
                 pass
         pdf.output(front_cover_pdf_fname)
         try:
+            from PIL import Image
+            from pdf2image import convert_from_path
             front_cover_pages = convert_from_path(front_cover_pdf_fname)
             front_cover_pages[0].save(front_cover_image_tmp_fname, "PNG")
             cover_webp = Image.open(front_cover_image_tmp_fname)
@@ -342,7 +459,7 @@ def generate_book_pdfs(folder, _id, title, author, description, notes, contents,
         # Full cover
         cover_width, cover_height = 152.4 * 2 + pages * 0.05720 + 3.175 * 2, 234.95
         pdf = fpdf.FPDF(format=(cover_width, cover_height))
-        pdf.add_font('dejavu-sans', style="", fname="assets/DejaVuSans.ttf")
+        add_font(pdf, "dejavu-sans", "assets/DejaVuSans.ttf")
         pdf.add_page()
         pdf.set_fill_color(r=250,g=249,b=222)
         pdf.rect(h=pdf.h, w=pdf.w, x=0, y=0, style="DF")
@@ -399,6 +516,9 @@ def generate_book_pdfs(folder, _id, title, author, description, notes, contents,
 
 
 def generate_book_docx(folder, _id, title, author, description, book_publisher_notes, preface, contents, text):
+    import docx
+    import docx.shared
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
     doc = docx.Document("assets/template.docx")
     currentYear, currentMonth = datetime.now().year, datetime.now().month
     title_paragraph = doc.add_paragraph()
@@ -440,10 +560,105 @@ def generate_book_docx(folder, _id, title, author, description, book_publisher_n
     doc.save(f"{folder}/word/{_id}_paperback_interior.docx")
 
 
-def get_books(run_folder, start, end, interior_only=False, cover_only=False, word_only=False, indexes=None):
+def book_filter_rejects(book_header):
+    book_title, book_author, book_language, book_translator, book_illustrator = (
+        book_header["Title"], book_header["Author"], book_header["Language"], book_header["Translator"], book_header["Illustrator"]
+    )
+    #
+    #if "hungarian" in book_language.lower() or \
+    #   "romanian" in book_language.lower() or \
+    #   "esperanto" in book_language.lower() or \
+    #   "latin" in book_language.lower() or \
+    #   "greek" in book_language.lower() or \
+    #   "tagalog" in book_language.lower() or \
+    #   "japanese" in book_language.lower() or \
+    #  "slovenian" in book_language.lower() or \
+    #   "telugu" in book_language.lower() or \
+    #   "gaelic, scottish" in book_language.lower() or \
+    #   "french, dutch" in book_language.lower() or \
+    #   "english, spanish" in book_language.lower() or \
+    #   "ojibwa" in book_language.lower() or \
+    #   "english, french" in book_language.lower() or \
+    #   "chinese" in book_language.lower() or \
+
+    # For Only english, excluding title keywords, no translator or illustrator
+
+    return not "english" in book_language.lower() or "illustrations" in book_title.lower() or "pictures" in book_title.lower() or not book_author or book_translator or book_illustrator
+
+
+def iter_parsed_books(sequence, prefetch=DEFAULT_PREFETCH, probe=False):
+    """
+    Yields (index, book_header, book_parse, fetch_error) in the order of sequence.
+
+    Books passing the filter are parsed in the parse pool, up to one book per parsing
+    process ahead of the caller; book_parse is the future of the parsed book, None for
+    missing or rejected books.
+    """
+    pending = collections.deque()
+    parsing = 0
+    for i, book_txt, fetch_error in iter_books(sequence, prefetch, probe=probe):
+        book_header = parse_book_header(book_txt) if book_txt is not None else None
+        book_parse = None
+        if book_header and not book_filter_rejects(book_header):
+            book_parse = submit_parse(book_txt)
+            parsing += 1
+        pending.append((i, book_header, book_parse, fetch_error))
+        while parsing > parse_workers():
+            item = pending.popleft()
+            parsing -= item[2] is not None
+            yield item
+    while pending:
+        yield pending.popleft()
+
+
+def books_sequence(start, end, indexes=None, catalog=None):
+    sequence = indexes if indexes else range(start, end + 1)
+    if catalog:
+        scheduled = catalog.filter_indexes(sequence)
+        print(f'Catalog filter: {len(sequence) - len(scheduled)} of {len(sequence)} books skipped')
+        sequence = scheduled
+    return sequence
+
+
+def prepare_batch(batch_fname, start, end, indexes=None, prefetch=DEFAULT_PREFETCH, catalog=None):
+    """
+    Batch mode phase one: writes the LLM requests of the books to an OpenAI Batch API input file.
+
+    Each book gets its structured metadata request (description, keywords and BISAC codes) and,
+    when it has a Contents section the rule based formatter is not confident about, its contents
+    formatting request. Requests already in the LLM cache are left out.
+    """
+    from book_metadata import metadata_request
+    from llm_batch import BatchWriter
+    books = 0
+    with BatchWriter(batch_fname, get_llm_cache()) as batch:
+        for i, book_header, book_parse, fetch_error in iter_parsed_books(books_sequence(start, end, indexes, catalog), prefetch, probe=not catalog):
+            print(f'Processing index: {i}')
+            if fetch_error:
+                print(f'Skipping index {i}: {fetch_error}')
+                continue
+            if book_parse is None:
+                continue
+            book_contents = book_parse.result()["Contents"]
+            batch.add(metadata_request(book_header["Title"], book_header["Author"], book_header["Language"]))
+            if book_contents and get_toc_formatter().needs_llm(format_contents(book_contents)[1]):
+                batch.add(contents_format_request(book_contents))
+            books += 1
+    print(f'{books} books prepared')
+    print(batch.summary())
+
+
+def get_books(run_folder, start, end, interior_only=False, cover_only=False, word_only=False, indexes=None, prefetch=DEFAULT_PREFETCH, catalog=None,
+              structured_metadata=False, enrichment_deadline=DEFAULT_ENRICHMENT_DEADLINE):
+    from book_metadata import request_book_metadata
+    from llm_dispatcher import get_llm_dispatcher
     update_index_flag = True
     datestamp = datetime.now().strftime('%Y-%B-%d %H_%M')
+    # spreadsheet rows waiting for their enrichment, in book order
+    pending_rows = collections.deque()
     if not (interior_only or cover_only or word_only):
+        enricher = Enricher(ENRICHMENT_SOURCES, enrichment_deadline)
+        import openpyxl
         try:
             wb = openpyxl.load_workbook('Project Guttenberg.xlsx')
         except:
@@ -479,211 +694,69 @@ def get_books(run_folder, start, end, interior_only=False, cover_only=False, wor
             ]
         )
     try:
-        sequence = indexes if indexes else range(start, end + 1)
-        for i in sequence:
+        sequence = books_sequence(start, end, indexes, catalog)
+        if catalog and not (interior_only or cover_only or word_only):
+            # authors of the run missing from the dump index are resolved on Wikidata in batches, ahead of their books
+            resolver = get_wikidata_resolver()
+            dump_index = get_dump_index()
+            for index in sequence:
+                record = catalog.get(index)
+                for author in record['authors'] if record else []:
+                    if not (dump_index and dump_index.death_year(author, 'wikidata')):
+                        resolver.submit(author, prefetch=True)
+        # without catalog, downloads of rejected books are aborted as soon as their header is read
+        for i, book_header, book_parse, fetch_error in iter_parsed_books(sequence, prefetch, probe=not catalog):
             print(f'Processing index: {i}')
-            book_url = f'https://www.gutenberg.org/ebooks/{i}.txt.utf-8'
-            response = requests.get(
-                book_url,
-                timeout=60,
-                headers={'User-Agent': 'Mozilla/5.0 (Windows; U; Windows NT 6.1; zh-CN) AppleWebKit/533+ (KHTML, like Gecko)'}
-            )
-            #
-            if response.status_code != 200:
-                print(f"Error fetching book text: {response.status_code}")
+            book_url = source_book_url(i)
+            if fetch_error:
+                raise fetch_error
+            if book_parse is None:
                 continue
             #
-            book_txt = response.content.decode('utf-8')
-            #
-            book_author = re.search(r"(Author|Editor): (.*)\r\n", book_txt, re.IGNORECASE)
-            book_author = book_author.groups()[1] if book_author else ""
-            book_author = book_author.strip().replace('\\', '-').replace('/', '-').replace('&', ' and ')
-            book_language = re.search(r"Language: (.*)\r\n", book_txt, re.IGNORECASE)
-            book_language = book_language.groups()[0] if book_language else ""
-            book_translator = re.search(r"Translator: (.*)\r\n", book_txt, re.IGNORECASE)
-            book_translator = book_translator.groups()[0] if book_translator else ""
-            book_illustrator = re.search(r"Illustrator: (.*)\r\n", book_txt, re.IGNORECASE)
-            book_illustrator = book_illustrator.groups()[0] if book_illustrator else ""
-            book_title = re.search(r"Title: (.*)\r\n", book_txt)
-            book_title = book_title.groups()[0] if book_title else ""
-            book_title = book_title.strip().replace('\\', '-').replace('/', '-').replace('&', ' and ')
-            book_content_start_index = re.search(r"\*\*\* START OF THE PROJECT GUTENBERG .* \*\*\*", book_txt, re.IGNORECASE)
-            book_content_start_index = book_content_start_index.end() if book_content_start_index else 0
-            book_content_end_index = re.search(r"\*\*\* END OF THE PROJECT GUTENBERG .* \*\*\*", book_txt, re.IGNORECASE)
-            book_content_end_index = book_content_end_index.start() if book_content_end_index else -1
-            book_txt = book_txt[book_content_start_index:book_content_end_index]
-            #
-            #if "hungarian" in book_language.lower() or \
-            #   "romanian" in book_language.lower() or \
-            #   "esperanto" in book_language.lower() or \
-            #   "latin" in book_language.lower() or \
-            #   "greek" in book_language.lower() or \
-            #   "tagalog" in book_language.lower() or \
-            #   "japanese" in book_language.lower() or \
-            #  "slovenian" in book_language.lower() or \
-            #   "telugu" in book_language.lower() or \
-            #   "gaelic, scottish" in book_language.lower() or \
-            #   "french, dutch" in book_language.lower() or \
-            #   "english, spanish" in book_language.lower() or \
-            #   "ojibwa" in book_language.lower() or \
-            #   "english, french" in book_language.lower() or \
-            #   "chinese" in book_language.lower() or \
-
-            # For Only english, excluding title keywords, no translator or illustrator
-
-            if not "english" in book_language.lower() or "illustrations" in book_title.lower() or "pictures" in book_title.lower() or not book_author or book_translator or book_illustrator:
-                continue
-            #
-            illustrations_patterns = [
-                re.compile(r'\[(\s+)?Cover Illustration](\r\n){2}', re.IGNORECASE|re.DOTALL),
-                re.compile(r'\[(\s+)?Illustration](\r\n){2}', re.IGNORECASE|re.DOTALL),
-                re.compile(r'\[(\s+)?Illustration.+?](\r\n){2}', re.IGNORECASE|re.DOTALL),
-                re.compile(r'\[(\s+)?Ilustracion.+?](\r\n){2}', re.IGNORECASE|re.DOTALL),
-                re.compile(r'\[(\s+)?Ilustración.+?](\r\n){2}', re.IGNORECASE|re.DOTALL),
-            ]
-            for _pattern in illustrations_patterns:
-                book_txt = re.sub(_pattern, '', book_txt)
-            proofread_patterns = [
-                re.compile(r'Produced(.+?)?(\s+)?at(\s+)?(https://|http://)?(www\.)?pgdp\.net(\s+)?(.+?)?(\r\n){3}', re.IGNORECASE|re.DOTALL),
-                re.compile(r'Produced(.+?)?(\s+)?by(\s+)?(www\.)?ebooksgratuits\.com(\s+)?(.+?)?(\r\n){3}', re.IGNORECASE|re.DOTALL),
-                re.compile(r'(this\s+)?E(-)?(text|book)(\s+)?(is|was)?(\s+)?(produced|prepared)(\s+)?(.+?)?(\r\n){3}', re.IGNORECASE|re.DOTALL),
-            ]
-            for _pattern in proofread_patterns:
-                book_txt = re.sub(_pattern, '', book_txt)
-            produced_by_search = re.search(r'Produced(\s+)?by(\s+)?(.+?)?(\s+)?(.+?)?(\r\n){2}', book_txt[:int(len(book_txt) * 0.05)], re.IGNORECASE|re.DOTALL)
-            if produced_by_search:
-                book_txt = book_txt.replace(produced_by_search.group(0), '', )
-            transcriber_notes_patterns = [
-                re.compile(r'(\[)?(\+)?(-{3,}(\+)?)?(\s+)?(\|)?Transcriber(\'s|’s)?(\s+)?Note(s)?(\s+)?(:)?(\+)?(\s+)?(.+?)?(\r\n){3}', re.IGNORECASE|re.DOTALL),
-                re.compile(r'Notes de transcription:(\s+)?(:)?(\+)?(\s+)?(.+?)?(\r\n){3}', re.IGNORECASE|re.DOTALL),
-                re.compile(r'\[Sidenote(s)?(\s+)?:(\s+)?(.+?)?(\r\n){2}', re.IGNORECASE|re.DOTALL),
-                re.compile(r'\[Note(s)?(\s+)?:(\s+)?(.+?)?(\r\n){2}', re.IGNORECASE|re.DOTALL),
-            ]
-            for _pattern in transcriber_notes_patterns:
-                book_txt = re.sub(_pattern, '', book_txt)
-            start_end_patterns = [
-                re.compile(r'START(\s+)?OF(\s+)?(THE)?(\s+)?PROJECT(\s+)?GUTENBERG.+?(\r\n){2}', re.IGNORECASE|re.DOTALL),
-                re.compile(r'END(\s+)?OF(\s+)?(THE)?(\s+)?PROJECT(\s+)?GUTENBERG.+?(\r\n){2}', re.IGNORECASE|re.DOTALL),
-            ]
-            for _pattern in start_end_patterns:
-                book_txt = re.sub(_pattern, '', book_txt)
+            book_title, book_author, book_language, book_translator, book_illustrator = (
+                book_header["Title"], book_header["Author"], book_header["Language"], book_header["Translator"], book_header["Illustrator"]
+            )
             #
-            book_txt = book_txt.replace('\r\n', '\n')
-            # BOOK PUBLISHER NOTES
-            book_publisher_notes_start_index, book_publisher_notes_end_index = 0, book_txt[100:int(len(book_txt)*0.02)].find('\n\n\n\n')
-            if book_publisher_notes_end_index != -1:
-                book_publisher_notes_end_index += 100
-            else:
-                book_publisher_notes_end_index = 0
-            book_publisher_notes = book_txt[book_publisher_notes_start_index:book_publisher_notes_end_index]
+            book_sections = book_parse.result()
+            book_publisher_notes, book_contents, book_preface, book_txt = (
+                book_sections["Publisher Notes"], book_sections["Contents"], book_sections["Preface"], book_sections["Text"]
+            )
             include_publisher_notes = book_language.lower() not in ['english']
-            # BOOK CONTENTS
-            contents_search = re.search(r"\s+(_)?(table\s+des\s+matières|contenu|liste\s+des\s+matières|contenidos|Índice|Tabla\s+de\s+contenidos|capítulos|list\s+of\s+contents|table\s+of\s+contents|content|contents|contents of volume|contents of volume [IVX]{1,3}|contents of vol|contents of vol(\.)?(\s+[IVX]{1,3})?|chapters|file numbers)(:)?(\.)?(_)?(\n){2,}", book_txt[:int(len(book_txt) * 0.15)], re.IGNORECASE|re.DOTALL)
-            if contents_search and not re.search(r"(content|contents|chapters|file numbers)(:)?(\.)?(\n)+(\s)*of", book_txt[:contents_search.start() + 100], re.IGNORECASE):
-                contents_start_index = contents_search.start()
-                contents_end_index = contents_start_index + len(contents_search.group()) + 5 + book_txt[contents_start_index + len(contents_search.group()) + 5:].find('\n\n\n\n')
-            else:
-                contents_end_index = contents_start_index = 0
-            book_contents = book_txt[contents_start_index:contents_end_index]
-            preface_search = re.search(r'(preface|foreword|prefatory note|préface|vorwort|prólogo|prefacio|prefazione)(\.)?(\n){2}', book_txt[:int(len(book_txt) * 0.15)], re.IGNORECASE)
-            if preface_search:
-                preface_start_index = preface_search.start()
-                preface_end_index = preface_start_index + len(preface_search.group()) + 10 + book_txt[preface_start_index + len(preface_search.group()) + 10:].find('\n\n\n\n')
-                book_preface = book_txt[preface_start_index:preface_end_index]
-            else:
-                preface_end_index = 0
-                book_preface = ""
-            # check if sections are separated by 3 newlines
-            if book_publisher_notes_end_index == contents_end_index == preface_end_index:
-                # BOOK PUBLISHER NOTES
-                book_publisher_notes_start_index, book_publisher_notes_end_index = 0, book_txt[100:int(len(book_txt)*0.02)].rfind('\n\n\n')
-                if book_publisher_notes_end_index != -1:
-                    book_publisher_notes_end_index += 100
-                else:
-                    book_publisher_notes_end_index = 0
-                book_publisher_notes = book_txt[book_publisher_notes_start_index:book_publisher_notes_end_index]
-                # BOOK CONTENTS
-                contents_search = re.search(r"\s+(_)?(table\s+des\s+matières|contenu|liste\s+des\s+matières|contenidos|Índice|Tabla\s+de\s+contenidos|capítulos|list\s+of\s+contents|table\s+of\s+contents|content|contents|contents of volume|contents of volume [IVX]{1,3}|contents of vol|contents of vol(\.)?(\s+[IVX]{1,3})?|chapters|file numbers)(:)?(\.)?(_)?(\n){2,}", book_txt[:int(len(book_txt) * 0.15)], re.IGNORECASE|re.DOTALL)
-                if contents_search and not re.search(r"(content|contents|chapters|file numbers)(:)?(\.)?(\n)+(\s)*of", book_txt[:contents_search.start() + 100], re.IGNORECASE):
-                    contents_start_index = contents_search.start()
-                    contents_end_index = contents_start_index + len(contents_search.group()) + 5 + book_txt[contents_start_index + len(contents_search.group()) + 5:].find('\n\n\n')
-                else:
-                    contents_end_index = contents_start_index = 0
-                book_contents = book_txt[contents_start_index:contents_end_index]
-                preface_search = re.search(r'(_)?(preface|foreword|prefatory note)(\.)?(_)?(\n){2}', book_txt[:int(len(book_txt) * 0.15)], re.IGNORECASE)
-                if preface_search:
-                    preface_start_index = preface_search.start()
-                    preface_end_index = preface_start_index + len(preface_search.group()) + 10 + book_txt[preface_start_index + len(preface_search.group()) + 10:].find('\n\n\n')
-                    book_preface = book_txt[preface_start_index:preface_end_index]
-                else:
-                    preface_end_index = 0
-                    book_preface = ""
-            # BOOK INDEX
-            appendix_search = re.search(r'(_)?(Index)(\.)?(:)?(_)?(\n){2}', book_txt[int(len(book_txt) * 0.8):], re.IGNORECASE)
-            if appendix_search:
-                appendix_start_index = int(len(book_txt) * 0.8) + appendix_search.start()
-                # appendix_end_index = appendix_start_index + len(appendix_search.group()) + 10 + book_txt[appendix_start_index + len(appendix_search.group()) + 10:].find('\n\n\n\n')
-                # book_appendix = book_txt[appendix_start_index:appendix_end_index]
-            else:
-                appendix_start_index = len(book_txt)
-                # book_appendix = ""
-            #
-            book_txt = book_txt[max(book_publisher_notes_end_index, contents_end_index, preface_end_index):appendix_start_index]
-            #
-            illustration_list_search = re.search(r'(LIST OF ILLUSTRATIONS|List [Oo]f [iI]llustrations|ILLUSTRATIONS OF VOLUME|Illustrations [Oo]f [Vv]olume|ILLUSTRATIONS TO VOLUME|Illustrations [Tt]o [Vv]olume|ILLUSTRATIONS OF VOL|Illustrations [Oo]f [Vv]ol|Illustrations [Tt]o [Vv]ol|ILLUSTRATIONS|Illustrations)(\.)?', book_txt[:int(len(book_txt) * 0.15)])
-            if illustration_list_search:
-                illustrations_start_index = illustration_list_search.start()
-                illustrations_end_index = illustrations_start_index + book_txt[illustrations_start_index:].find('\n\n\n\n')
-                book_txt = book_txt[illustrations_end_index:]
-            plates_list_search = re.search(r'(LIST OF PLATES|List [Oo]f [pP]lates|PLATES OF VOLUME|Plates [Oo]f [Vv]olume)(\.)?', book_txt[:int(len(book_txt) * 0.15)])
-            if plates_list_search:
-                plates_start_index = plates_list_search.start()
-                plates_end_index = plates_start_index + book_txt[plates_start_index:].find('\n\n\n\n')
-                book_txt = book_txt[plates_end_index:]
-            if book_contents and book_contents in book_publisher_notes:
-                book_publisher_notes = ""
-            book_publisher_notes = book_publisher_notes.replace('\n\n\n\n', '\n\n').replace('_', '').replace('  ', ' ').replace('--', '-').replace('\n\n', '_____').replace('\n', ' ').replace('_____', '\n\n')
-            book_contents_header_search = re.search(r"(_)?(table\s+des\s+matières|contenu|liste\s+des\s+matières|contenidos|Índice|Tabla\s+de\s+contenidos|capítulos|list\s+of\s+contents|table\s+of\s+contents|contents|content|contents of volume|contents of volume [IVX]{1,3}|contents of vol|contents of vol(\.)?(\s+[IVX]{1,3})?|chapters|file numbers)(:)?(\.)?(_)?(\n{1,})?", book_contents, flags=re.DOTALL | re.IGNORECASE)
-            book_contents_header = book_contents_header_search.group() if book_contents_header_search else ''
-            book_contents = re.sub(r'page(s)?(\n)?', '', book_contents, flags=re.IGNORECASE)
-            book_contents = book_contents.replace(book_contents_header, '').replace('\n\n\n', '\n').replace('\n\n', '\n')
-            book_contents_cleaned = ""
-            for book_contents_line in book_contents.split('\n'):
-                if book_contents_line and not re.search(r'^((\s+)?chapter|part|volume)', book_contents_line, re.IGNORECASE):
-                    book_contents_cleaned += re.sub(r'([IVX]+|\d+)?(\.)?(\s+)?(.+?)(,)?\s+(\d+|[ivx]+(\.)?)$', r'\1\2\3 \4', book_contents_line, flags=re.IGNORECASE|re.DOTALL) + '\n'
-                elif book_contents_line:
-                    book_contents_cleaned += book_contents_line + '\n'
-            book_contents = book_contents_header + book_contents_cleaned.replace('_', '').replace('  ', ' ').replace('--', '-')
-            book_preface = book_preface.replace('\n\n\n\n', '\n\n').replace('_', '').replace('  ', ' ').replace('--', '-').replace('\n\n', '_____').replace('\n', ' ').replace('_____', '\n\n')
-            book_txt = book_txt.replace('\n\n\n\n', '\n\n').replace('_', '').replace('  ', ' ').replace('--', '-').replace('\n\n', '_____').replace('\n', ' ').replace('_____', '\n\n')
-            # book_appendix = book_appendix.replace('\n\n\n\n', '\n\n').replace('_', '').replace('  ', ' ').replace('--', '-').replace('\n\n', '_____').replace('\n', ' ').replace('_____', '\n\n')
             ############################################################################################################
             # Book Metadata
             ############################################################################################################
-            description_query = f"Provide a 150 words description of the classic book {book_title}"
-            if book_author:
-                description_query += f" by Author and Writer {book_author}."
-            if book_language:
-                description_query += f" Write the review in this language: {book_language}"
-            description_completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": description_query
-                    },
-                ]
-            )
-            description = description_completion.choices[0].message.content
-
+            # single structured completion, separate queries when it fails validation
+            book_metadata = request_book_metadata(book_title, book_author, book_language) if structured_metadata else None
+            if book_metadata:
+                description, keywords, bisac_codes = book_metadata
+            else:
+                description_query = f"Provide a 150 words description of the classic book {book_title}"
+                if book_author:
+                    description_query += f" by Author and Writer {book_author}."
+                if book_language:
+                    description_query += f" Write the review in this language: {book_language}"
+                # sent ahead, runs concurrently with the contents formatting
+                description_request = submit_chat_completion(
+                    cache=True,
+                    model="gpt-4o-mini",
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": description_query
+                        },
+                    ]
+                )
             ############################################################################################################
             # Book Contents Formatting with OpenAI API
             ############################################################################################################
 
             if book_contents:
-                book_contents = format_contents_with_openai(book_contents)
+                # rule based formatting, OpenAI API only for contents the rules are not confident about
+                book_contents = get_toc_formatter().format(book_contents, format_contents_with_openai)
             else:
                 print("Warning: No 'Contents' section found for this book.")
+            if not book_metadata:
+                description = description_request.result().choices[0].message.content
 
             #print ("Contents processed in get books function:",book_contents)
 
@@ -700,33 +773,36 @@ def get_books(run_folder, start, end, interior_only=False, cover_only=False, wor
                     )
                 #
                 if 24 <= pages_num <= 828 and not (interior_only or cover_only or word_only):
-                    keywords_query = f'Give me 7 keywords separated by semicolons (only the keywords, no numbers nor introductory words) that accurately reflect the main themes and genre of the classic book "{book_title}" by Author "{book_author}". Keywords must not be subjective claims about its quality, time-sensitive statments and must not include the word "book". Keywords must also not contain words included on the book the title, author nor contained on the following book description: {description}'
-                    keywords_completion = client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {
-                                "role": "system",
-                                "content": keywords_query
-                            },
-                        ]
-                    )
-                    keywords = keywords_completion.choices[0].message.content
-                    #
-                    bisac_codes_query = f'Give me up to 3 BISAC codes separated by semicolons (only the code in the official format, not its description and not numbered) for the book "{book_title}" by Author "{book_author}" with description "{description}", for its correct classification. Output format example would be: FIC019000; FIC031010; FIC014000'
-                    bisac_codes_completion = client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {
-                                "role": "system",
-                                "content": bisac_codes_query
-                            },
-                        ]
-                    )
-                    bisac_codes = bisac_codes_completion.choices[0].message.content
+                    if not book_metadata:
+                        keywords_query = f'Give me 7 keywords separated by semicolons (only the keywords, no numbers nor introductory words) that accurately reflect the main themes and genre of the classic book "{book_title}" by Author "{book_author}". Keywords must not be subjective claims about its quality, time-sensitive statments and must not include the word "book". Keywords must also not contain words included on the book the title, author nor contained on the following book description: {description}'
+                        keywords_request = submit_chat_completion(
+                            cache=True,
+                            model="gpt-4o-mini",
+                            messages=[
+                                {
+                                    "role": "system",
+                                    "content": keywords_query
+                                },
+                            ]
+                        )
+                        #
+                        bisac_codes_query = f'Give me up to 3 BISAC codes separated by semicolons (only the code in the official format, not its description and not numbered) for the book "{book_title}" by Author "{book_author}" with description "{description}", for its correct classification. Output format example would be: FIC019000; FIC031010; FIC014000'
+                        bisac_codes_request = submit_chat_completion(
+                            cache=True,
+                            model="gpt-4o-mini",
+                            messages=[
+                                {
+                                    "role": "system",
+                                    "content": bisac_codes_query
+                                },
+                            ]
+                        )
+                        keywords = keywords_request.result().choices[0].message.content
+                        bisac_codes = bisac_codes_request.result().choices[0].message.content
                     #
                     """
                     published_year_query = f'Please, tell me the year the book {book_title} by {book_author} was published. Provide only the date in the format YYYY.'
-                    published_year_completion = client.chat.completions.create(
+                    published_year_completion = get_client().chat.completions.create(
                         model="gpt-4o-mini",
                         messages=[
                             {
@@ -738,7 +814,7 @@ def get_books(run_folder, start, end, interior_only=False, cover_only=False, wor
                     published_year = published_year_completion.choices[0].message.content
                     #
                     author_year_of_death_query = f'Please, tell me the year of death of {book_author}, the author of the book {book_title}. Provide only the date in the format YYYY. If the author is still alive, please, provide the "XXXX".'
-                    author_year_of_death_completion = client.chat.completions.create(
+                    author_year_of_death_completion = get_client().chat.completions.create(
                         model="gpt-4o-mini",
                         messages=[
                             {
@@ -749,37 +825,32 @@ def get_books(run_folder, start, end, interior_only=False, cover_only=False, wor
                     )
                     author_year_of_death = author_year_of_death_completion.choices[0].message.content
                     """
-                    # Extended Metadata
-                    google_books_search_data = search_google_books(book_title, book_author)
-                    open_library_search_data = search_open_library(book_title, book_author)
-                    wikipedia_author_year_of_death = search_wikipedia_author(book_author)
-                    wikidata_author_year_of_death = search_wikidata(book_author)
-                    #
-                    ws.append(
-                        [
-                            i,
-                            book_url,
-                            book_title,
-                            # published_year,
-                            book_language,
-                            book_author,
-                            # author_year_of_death,
-                            book_translator,
-                            book_illustrator,
-                            description,
-                            keywords,
-                            bisac_codes,
-                            pages_num,
-                            book_fname,
-                            cover_fname,
-                            front_cover_image_fname,
-                            google_books_search_data.get('google_books_publication_year', 'N / A'),
-                            open_library_search_data.get('open_library_publication_year', 'N / A'),
-                            wikidata_author_year_of_death,
-                            wikipedia_author_year_of_death,
-                            open_library_search_data.get('open_library_death_year', 'N / A'),
-                        ]
+                    # Extended Metadata, looked up in the background while the next books render
+                    pending_rows.append(
+                        (
+                            [
+                                i,
+                                book_url,
+                                book_title,
+                                # published_year,
+                                book_language,
+                                book_author,
+                                # author_year_of_death,
+                                book_translator,
+                                book_illustrator,
+                                description,
+                                keywords,
+                                bisac_codes,
+                                pages_num,
+                                book_fname,
+                                cover_fname,
+                                front_cover_image_fname,
+                            ],
+                            enricher.submit(book_title, book_author),
+                        )
                     )
+                if pending_rows:
+                    write_enriched_rows(ws, pending_rows, keep=DEFAULT_BOOKS_IN_FLIGHT)
             except:
                 import traceback
                 print(traceback.format_exc())
@@ -791,9 +862,22 @@ def get_books(run_folder, start, end, interior_only=False, cover_only=False, wor
         update_last_index(i)
     finally:
         if not (interior_only or word_only or cover_only):
+            write_enriched_rows(ws, pending_rows)
+            enricher.shutdown()
+            print(enricher.summary())
+            print(circuit_breakers_summary())
+            print(get_wikidata_resolver().summary())
             wb.save('Project Guttenberg.xlsx')
+        if get_llm_cache():
+            print(get_llm_cache().summary())
+        print(get_llm_dispatcher().summary())
+        print(get_toc_formatter().summary())
+        if get_author_store():
+            print(get_author_store().summary())
+        if get_dump_index():
+            print(get_dump_index().summary())
         # update last published book index
-        if update_index_flag:
+        if update_index_flag and end is not None:
             update_last_index(end)
 
 
@@ -808,16 +892,47 @@ def parse_args():
     parser.add_argument('-i', '--indexes', type=str, dest='indexes', default='', help='books indexes to process, comma separated')
     parser.add_argument('-s', '--start', type=int, dest='start', default=get_previous_last_index(),
                         help='start index of the program')
-    parser.add_argument('-e', '--end', type=int, dest='end', default=get_latest_published_book_index(),
-                        help='end index of the program')
+    parser.add_argument('-e', '--end', type=int, dest='end', default=None,
+                        help='end index of the program (default: latest published book index)')
     parser.add_argument('-w', '--word', action='store_true', help='generate Word documents')
     parser.add_argument('-c', '--cover', action='store_true', help='generate PDF covers')
     parser.add_argument('--interior', action='store_true', help='generate PDF interior only')
+    parser.add_argument('--cache-dir', type=str, default=None, help='raw and parsed books, LLM responses and authors cache folder (default: .cache)')
+    parser.add_argument('--no-cache', action='store_true', help='always download and parse books, bypassing the raw and parsed books caches')
+    parser.add_argument('--no-llm-cache', action='store_true', help='always query OpenAI, bypassing the LLM responses cache')
+    parser.add_argument('--no-author-store', action='store_true', help='always query author death years, bypassing the author store')
+    parser.add_argument('--dump-index', type=str, default=None,
+                        help='offline author and book index built by dump_index.py, looked up before the online sources (default: CACHE_DIR/dumps.sqlite when present)')
+    parser.add_argument('--source', type=str, default=None, help='local Gutenberg mirror folder or zip archive to read books from instead of gutenberg.org')
+    parser.add_argument('--catalog', type=str, default=None,
+                        help='local Gutenberg catalog (pg_catalog.csv or rdf-files.tar.bz2) used to skip books before downloading')
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH,
+                        help=f'number of books downloaded concurrently ahead of processing, 0 disables prefetching (default: {DEFAULT_PREFETCH})')
+    parser.add_argument('--llm-rpm', type=int, default=None, help='OpenAI requests per minute limit (default: PG_OPENAI_RPM or 500)')
+    parser.add_argument('--llm-tpm', type=int, default=None, help='OpenAI tokens per minute limit (default: PG_OPENAI_TPM or 200000)')
+    parser.add_argument('--structured-metadata', action='store_true',
+                        help='request description, keywords and BISAC codes in a single structured completion, with separate queries as fallback')
+    parser.add_argument('--parse-workers', type=int, default=DEFAULT_PARSE_WORKERS,
+                        help=f'number of processes parsing books ahead of processing, 0 parses in the main process (default: {DEFAULT_PARSE_WORKERS})')
+    parser.add_argument('--enrichment-deadline', type=float, default=DEFAULT_ENRICHMENT_DEADLINE,
+                        help=f'seconds the spreadsheet metadata sources of a book are waited for (default: {DEFAULT_ENRICHMENT_DEADLINE:g})')
+    parser.add_argument('--breaker-failures', type=int, default=None,
+                        help='consecutive failed requests after which a metadata source is skipped (default: PG_BREAKER_FAILURES or 5)')
+    parser.add_argument('--breaker-cooldown', type=float, default=None,
+                        help='seconds a failing metadata source is skipped before it is probed again (default: PG_BREAKER_COOLDOWN or 120)')
+    parser.add_argument('--batch-prepare', type=str, default=None, metavar='REQUESTS',
+                        help='batch mode phase one: write the LLM requests of the books to an OpenAI Batch API input file and exit')
+    parser.add_argument('--batch-results', type=str, nargs='+', default=None, metavar='RESULTS',
+                        help='batch mode phase two: load OpenAI Batch API output files into the LLM cache, then process the books')
     #
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.no_llm_cache and (args.batch_prepare or args.batch_results):
+        parser.error('batch mode requires the LLM cache, --no-llm-cache is not allowed')
+    return args
 
 
 if __name__ == '__main__':
+    args = parse_args()
     # create PDFs output folder
     run_folder = datetime.now().strftime('%Y-%B')
     pathlib.Path(f"{run_folder}/imgs").mkdir(parents=True, exist_ok=True)
@@ -826,5 +941,34 @@ if __name__ == '__main__':
     pathlib.Path(f"{run_folder}/word").mkdir(parents=True, exist_ok=True)
     pathlib.Path(f"{run_folder}/pdf").mkdir(parents=True, exist_ok=True)
     #
-    args = parse_args()
-    get_books(run_folder, args.start, args.end, args.interior, args.cover, args.word, args.indexes.split(',') if args.indexes else None)
+    configure_book_cache(args.cache_dir, enabled=not args.no_cache)
+    configure_parse_cache(args.cache_dir, enabled=not args.no_cache)
+    configure_parse_pool(args.parse_workers)
+    configure_llm_cache(args.cache_dir, enabled=not args.no_llm_cache)
+    configure_author_store(args.cache_dir, enabled=not args.no_author_store)
+    configure_dump_index(args.dump_index, args.cache_dir)
+    if not args.batch_prepare:
+        # batch mode phase one sends no OpenAI request
+        from llm_dispatcher import configure_llm_dispatcher
+        configure_llm_dispatcher(args.llm_rpm, args.llm_tpm)
+    configure_circuit_breakers(args.breaker_failures, args.breaker_cooldown)
+    configure_book_source(args.source)
+    # latest published index is only looked up for range runs without explicit end
+    end = args.end if args.end is not None or args.indexes else get_latest_published_book_index()
+    indexes = args.indexes.split(',') if args.indexes else None
+    catalog = None
+    if args.catalog:
+        from catalog import Catalog
+        catalog = Catalog(args.catalog, cache_dir=args.cache_dir)
+    if args.batch_prepare:
+        prepare_batch(args.batch_prepare, args.start, end, indexes, args.prefetch, catalog)
+    else:
+        if args.batch_results:
+            from llm_batch import ingest_batch_results
+        for results_fname in args.batch_results or []:
+            stored, failed = ingest_batch_results(results_fname)
+            print(f'Batch results {results_fname}: {stored} responses stored, {failed} failed')
+        # batch requests carry the structured metadata, failed ones fall back to regular queries
+        get_books(run_folder, args.start, end, args.interior, args.cover, args.word, indexes, args.prefetch,
+                  catalog, args.structured_metadata or bool(args.batch_results), args.enrichment_deadline)
+    shutdown_parse_pool()
@@ -41,12 +41,10 @@ Spreadsheet:
 """
 
 import os
-import re
 import fpdf
 import logging
 import argparse
 import pathlib
-import requests
 import openpyxl
 import traceback
 import pandas as pd
@@ -55,10 +53,17 @@ from PIL import Image
 from time import sleep
 from datetime import datetime
 from tempfile import TemporaryFile
-from openai import OpenAI
 
+import http_client
+import text_cleaning
+from book_source import configure_book_cache, configure_book_source, fetch_book_text
+from llm_cache import chat_completion, configure_llm_cache, get_llm_cache
+from llm_dispatcher import configure_llm_dispatcher, get_llm_dispatcher
+from parse_cache import configure_parse_cache
+from parse_pool import DEFAULT_WORKERS as DEFAULT_PARSE_WORKERS, configure_parse_pool, shutdown_parse_pool, submit_parse
+from pdf_fonts import add_font
+from toc_formatter import get_toc_formatter
 
-client = OpenAI()
 
 logger = logging.getLogger("pg-bundles")
 
@@ -79,22 +84,12 @@ def dump_current_progress(index):
 def fetch_guttenberg_book(index):
     try:
         logger.debug(f"Fetching book {index}")
-        book_url = f'https://www.gutenberg.org/ebooks/{index}.txt.utf-8'
-        response = requests.get(
-            book_url,
-            timeout=60,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows; U; Windows NT 6.1; zh-CN) AppleWebKit/533+ (KHTML, like Gecko)'
-            }
-        )
-        #
-        if response.status_code != 200:
-            logger.error(f"Error fetching book text: {response.status_code}")
+        book_txt = fetch_book_text(index)
+        if book_txt is None:
             return None
         #
         logger.debug(f"Successfully fetched book {index}")
         #
-        book_txt = response.content.decode('utf-8')
         return book_txt
     except:
         return None
@@ -128,7 +123,7 @@ def format_contents_with_openai(raw_contents):
     Please return the formatted Contents section.
     """
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are a helpful assistant for formatting a Contents section text from a book."},
@@ -144,189 +139,19 @@ def format_contents_with_openai(raw_contents):
     return book_contents  # Return raw contents if API call fails
 
 
+def parse_raw_books(*texts):
+    """Parses raw book texts concurrently in the parse pool, contents are formatted with rules or, when they are not confident, OpenAI API."""
+    book_parses = [submit_parse(text, text_cleaning.APPENDIX_LETTERS_PATTERN) for text in texts]
+    books = []
+    for book_parse in book_parses:
+        book = book_parse.result()
+        book["Contents"] = get_toc_formatter().format(book["Contents"], format_contents_with_openai)
+        books.append(book)
+    return books
+
+
 def parse_raw_book(text):
-    book_author = re.search(r"(Author|Editor): (.*)\r\n", text, re.IGNORECASE)
-    book_author = book_author.groups()[1] if book_author else ""
-    book_author = book_author.strip().replace('\\', '-').replace('/', '-').replace('&', ' and ')
-    book_language = re.search(r"Language: (.*)\r\n", text, re.IGNORECASE)
-    book_language = book_language.groups()[0] if book_language else ""
-    book_translator = re.search(r"Translator: (.*)\r\n", text, re.IGNORECASE)
-    book_translator = book_translator.groups()[0] if book_translator else ""
-    book_illustrator = re.search(r"Illustrator: (.*)\r\n", text, re.IGNORECASE)
-    book_illustrator = book_illustrator.groups()[0] if book_illustrator else ""
-    book_title = re.search(r"Title: (.*)\r\n", text)
-    book_title = book_title.groups()[0] if book_title else ""
-    book_title = book_title.strip().replace('\\', '-').replace('/', '-').replace('&', ' and ')
-    book_content_start_index = re.search(r"\*\*\* START OF THE PROJECT GUTENBERG .* \*\*\*", text, re.IGNORECASE)
-    book_content_start_index = book_content_start_index.end() if book_content_start_index else 0
-    book_content_end_index = re.search(r"\*\*\* END OF THE PROJECT GUTENBERG .* \*\*\*", text, re.IGNORECASE)
-    book_content_end_index = book_content_end_index.start() if book_content_end_index else -1
-    text = text[book_content_start_index:book_content_end_index]
-    # Illustrations supporting text removal
-    illustrations_patterns = [
-        re.compile(r'\[(\s+)?Cover Illustration](\r\n){2}', re.IGNORECASE | re.DOTALL),
-        re.compile(r'\[(\s+)?Illustration](\r\n){2}', re.IGNORECASE | re.DOTALL),
-        re.compile(r'\[(\s+)?Illustration.+?](\r\n){2}', re.IGNORECASE | re.DOTALL),
-        re.compile(r'\[(\s+)?Ilustracion.+?](\r\n){2}', re.IGNORECASE | re.DOTALL),
-        re.compile(r'\[(\s+)?Ilustración.+?](\r\n){2}', re.IGNORECASE | re.DOTALL),
-    ]
-    for _pattern in illustrations_patterns:
-        text = re.sub(_pattern, '', text)
-    # Proofread text removal
-    proofread_patterns = [
-        re.compile(r'Produced(.+?)?(\s+)?at(\s+)?(https://|http://)?(www\.)?pgdp\.net(\s+)?(.+?)?(\r\n){3}', re.IGNORECASE | re.DOTALL),
-        re.compile(r'Produced(.+?)?(\s+)?by(\s+)?(www\.)?ebooksgratuits\.com(\s+)?(.+?)?(\r\n){3}', re.IGNORECASE | re.DOTALL),
-        re.compile(r'(this\s+)?E(-)?(text|book)(\s+)?(is|was)?(\s+)?(produced|prepared)(\s+)?(.+?)?(\r\n){3}', re.IGNORECASE | re.DOTALL),
-    ]
-    for _pattern in proofread_patterns:
-        text = re.sub(_pattern, '', text)
-    # Supporting text removal
-    produced_by_search = re.search(r'Produced(\s+)?by(\s+)?(.+?)?(\s+)?(.+?)?(\r\n){2}', text[:int(len(text) * 0.05)], re.IGNORECASE | re.DOTALL)
-    if produced_by_search:
-        text = text.replace(produced_by_search.group(0), '', )
-    # Transcriber notes removal
-    transcriber_notes_patterns = [
-        re.compile(r'(\[)?(\+)?(-{3,}(\+)?)?(\s+)?(\|)?Transcriber(\'s|’s)?(\s+)?Note(s)?(\s+)?(:)?(\+)?(\s+)?(.+?)?(\r\n){3}', re.IGNORECASE | re.DOTALL),
-        re.compile(r'Notes de transcription:(\s+)?(:)?(\+)?(\s+)?(.+?)?(\r\n){3}', re.IGNORECASE | re.DOTALL),
-        re.compile(r'\[Sidenote(s)?(\s+)?:(\s+)?(.+?)?(\r\n){2}', re.IGNORECASE | re.DOTALL),
-        re.compile(r'\[Note(s)?(\s+)?:(\s+)?(.+?)?(\r\n){2}', re.IGNORECASE | re.DOTALL),
-    ]
-    for _pattern in transcriber_notes_patterns:
-        text = re.sub(_pattern, '', text)
-    # Removal of project guttenberg marks
-    start_end_patterns = [
-        re.compile(r'START(\s+)?OF(\s+)?(THE)?(\s+)?PROJECT(\s+)?GUTENBERG.+?(\r\n){2}', re.IGNORECASE | re.DOTALL),
-        re.compile(r'END(\s+)?OF(\s+)?(THE)?(\s+)?PROJECT(\s+)?GUTENBERG.+?(\r\n){2}', re.IGNORECASE | re.DOTALL),
-    ]
-    for _pattern in start_end_patterns:
-        text = re.sub(_pattern, '', text)
-    #
-    text = text.replace('\r\n', '\n')
-    # BOOK PUBLISHER NOTES
-    book_publisher_notes_start_index, book_publisher_notes_end_index = 0, text[100:int(len(text) * 0.02)].find('\n\n\n\n')
-    if book_publisher_notes_end_index != -1:
-        book_publisher_notes_end_index += 100
-    else:
-        book_publisher_notes_end_index = 0
-    book_publisher_notes = text[book_publisher_notes_start_index:book_publisher_notes_end_index]
-    include_publisher_notes = book_language.lower() not in ['english']
-    # BOOK CONTENTS
-    contents_search = re.search(
-        r"\s+(_)?(table\s+des\s+matières|contenu|liste\s+des\s+matières|contenidos|Índice|Tabla\s+de\s+contenidos|capítulos|list\s+of\s+contents|table\s+of\s+contents|content|contents|contents of volume|contents of volume [IVX]{1,3}|contents of vol|contents of vol(\.)?(\s+[IVX]{1,3})?|chapters|file numbers)(:)?(\.)?(_)?(\n){2,}",
-        text[:int(len(text) * 0.15)], re.IGNORECASE | re.DOTALL
-    )
-    if contents_search and not re.search(r"(content|contents|chapters|file numbers)(:)?(\.)?(\n)+(\s)*of", text[:contents_search.start() + 100], re.IGNORECASE):
-        contents_start_index = contents_search.start()
-        contents_end_index = contents_start_index + len(contents_search.group()) + 5 + text[contents_start_index + len(contents_search.group()) + 5:].find('\n\n\n\n')
-    else:
-        contents_end_index = contents_start_index = 0
-    book_contents = text[contents_start_index:contents_end_index]
-    # Book preface
-    preface_search = re.search(
-        r'(preface|foreword|prefatory note|préface|vorwort|prólogo|prefacio|prefazione)(\.)?(\n){2}',
-        text[:int(len(text) * 0.15)], re.IGNORECASE)
-    if preface_search:
-        preface_start_index = preface_search.start()
-        preface_end_index = preface_start_index + len(preface_search.group()) + 10 + text[
-            preface_start_index + len(preface_search.group()) + 10:].find('\n\n\n\n')
-        book_preface = text[preface_start_index:preface_end_index]
-    else:
-        preface_end_index = 0
-        book_preface = ""
-    # check if sections are separated by 3 newlines
-    if book_publisher_notes_end_index == contents_end_index == preface_end_index:
-        # BOOK PUBLISHER NOTES
-        book_publisher_notes_start_index, book_publisher_notes_end_index = 0, text[
-            100:int(len(text) * 0.02)].rfind('\n\n\n')
-        if book_publisher_notes_end_index != -1:
-            book_publisher_notes_end_index += 100
-        else:
-            book_publisher_notes_end_index = 0
-        book_publisher_notes = text[book_publisher_notes_start_index:book_publisher_notes_end_index]
-        # BOOK CONTENTS
-        contents_search = re.search(
-            r"\s+(_)?(table\s+des\s+matières|contenu|liste\s+des\s+matières|contenidos|Índice|Tabla\s+de\s+contenidos|capítulos|list\s+of\s+contents|table\s+of\s+contents|content|contents|contents of volume|contents of volume [IVX]{1,3}|contents of vol|contents of vol(\.)?(\s+[IVX]{1,3})?|chapters|file numbers)(:)?(\.)?(_)?(\n){2,}",
-            text[:int(len(text) * 0.15)], re.IGNORECASE | re.DOTALL
-        )
-        if contents_search and not re.search(r"(content|contents|chapters|file numbers)(:)?(\.)?(\n)+(\s)*of", text[:contents_search.start() + 100], re.IGNORECASE):
-            contents_start_index = contents_search.start()
-            contents_end_index = contents_start_index + len(contents_search.group()) + 5 + text[contents_start_index + len(contents_search.group()) + 5:].find('\n\n\n')
-        else:
-            contents_end_index = contents_start_index = 0
-        book_contents = text[contents_start_index:contents_end_index]
-        preface_search = re.search(r'(_)?(preface|foreword|prefatory note)(\.)?(_)?(\n){2}', text[:int(len(text) * 0.15)], re.IGNORECASE)
-        if preface_search:
-            preface_start_index = preface_search.start()
-            preface_end_index = preface_start_index + len(preface_search.group()) + 10 + text[preface_start_index + len(preface_search.group()) + 10:].find('\n\n\n')
-            book_preface = text[preface_start_index:preface_end_index]
-        else:
-            preface_end_index = 0
-            book_preface = ""
-    # BOOK INDEX
-    appendix_search = re.search(r'(_)?(Index|Index\s+to\s+Letters)(\.)?(:)?(_)?(\n){2}', text[int(len(text) * 0.8):], re.IGNORECASE)
-    if appendix_search:
-        appendix_start_index = int(len(text) * 0.8) + appendix_search.start()
-        # appendix_end_index = appendix_start_index + len(appendix_search.group()) + 10 + text[appendix_start_index + len(appendix_search.group()) + 10:].find('\n\n\n\n')
-        # book_appendix = text[appendix_start_index:appendix_end_index]
-    else:
-        appendix_start_index = len(text)
-        # book_appendix = ""
-    # Clean book body
-    text = text[max(book_publisher_notes_end_index, contents_end_index, preface_end_index):appendix_start_index]
-    # Illustrations list
-    illustration_list_search = re.search(
-        r'(LIST OF ILLUSTRATIONS|List [Oo]f [iI]llustrations|ILLUSTRATIONS OF VOLUME|Illustrations [Oo]f [Vv]olume|ILLUSTRATIONS TO VOLUME|Illustrations [Tt]o [Vv]olume|ILLUSTRATIONS OF VOL|Illustrations [Oo]f [Vv]ol|Illustrations [Tt]o [Vv]ol|ILLUSTRATIONS|Illustrations)(\.)?',
-        text[:int(len(text) * 0.15)]
-    )
-    if illustration_list_search:
-        illustrations_start_index = illustration_list_search.start()
-        illustrations_end_index = illustrations_start_index + text[illustrations_start_index:].find('\n\n\n\n')
-        text = text[illustrations_end_index:]
-    # Plates list
-    plates_list_search = re.search(
-        r'(LIST OF PLATES|List [Oo]f [pP]lates|PLATES OF VOLUME|Plates [Oo]f [Vv]olume)(\.)?',
-        text[:int(len(text) * 0.15)]
-    )
-    if plates_list_search:
-        plates_start_index = plates_list_search.start()
-        plates_end_index = plates_start_index + text[plates_start_index:].find('\n\n\n\n')
-        text = text[plates_end_index:]
-    #
-    if book_contents and book_contents in book_publisher_notes:
-        book_publisher_notes = ""
-    book_publisher_notes = book_publisher_notes.replace('\n\n\n\n', '\n\n').replace('_', '').replace('  ', ' ').replace('--', '-').replace('\n\n', '_____').replace('\n', ' ').replace('_____', '\n\n')
-    #
-    book_contents_header_search = re.search(
-        r"(_)?(table\s+des\s+matières|contenu|liste\s+des\s+matières|contenidos|Índice|Tabla\s+de\s+contenidos|capítulos|list\s+of\s+contents|table\s+of\s+contents|contents|content|contents of volume|contents of volume [IVX]{1,3}|contents of vol|contents of vol(\.)?(\s+[IVX]{1,3})?|chapters|file numbers)(:)?(\.)?(_)?(\n{1,})?",
-        book_contents,
-        flags=re.DOTALL | re.IGNORECASE
-    )
-    book_contents_header = book_contents_header_search.group() if book_contents_header_search else ''
-    book_contents = re.sub(r'page(s)?(\n)?', '', book_contents, flags=re.IGNORECASE)
-    book_contents = book_contents.replace(book_contents_header, '').replace('\n\n\n', '\n').replace('\n\n', '\n')
-    book_contents_cleaned = ""
-    for book_contents_line in book_contents.split('\n'):
-        if book_contents_line and not re.search(r'^((\s+)?chapter|part|volume)', book_contents_line, re.IGNORECASE):
-            book_contents_cleaned += re.sub(
-                r'([IVX]+|\d+)?(\.)?(\s+)?(.+?)(,)?\s+(\d+|[ivx]+(\.)?)$', r'\1\2\3 \4',
-                book_contents_line, flags=re.IGNORECASE | re.DOTALL
-            ) + '\n'
-        elif book_contents_line:
-            book_contents_cleaned += book_contents_line + '\n'
-    book_contents = book_contents_header + book_contents_cleaned.replace('_', '').replace('  ', ' ').replace('--', '-')
-    book_preface = book_preface.replace('\n\n\n\n', '\n\n').replace('_', '').replace('  ', ' ').replace('--', '-').replace('\n\n', '_____').replace('\n', ' ').replace('_____', '\n\n')
-    text = text.replace('\n\n\n\n', '\n\n').replace('_', '').replace('  ', ' ').replace('--', '-').replace('\n\n', '_____').replace('\n', ' ').replace('_____', '\n\n')
-    return {
-        "Title": book_title,
-        "Author": book_author,
-        "Language": book_language,
-        "Translator": book_translator,
-        "Illustrator": book_illustrator,
-        "Publisher Notes": book_publisher_notes,
-        "Contents": format_contents_with_openai(book_contents),
-        "Preface": book_preface,
-        "Text": text
-    }
+    return parse_raw_books(text)[0]
 
 
 class PDF(fpdf.FPDF):
@@ -334,7 +159,7 @@ class PDF(fpdf.FPDF):
         if self.page_no() > 4:
             # Go to 1.5 cm from bottom
             self.set_y(-15)
-            self.add_font("dejavu-sans", style="", fname="assets/DejaVuSans.ttf")
+            add_font(self, "dejavu-sans", "assets/DejaVuSans.ttf")
             self.set_font("dejavu-sans", size=8)
             # Print centered page number
             self.cell(0, 10, f"{self.page_no()}", 0, 0, 'C')
@@ -391,7 +216,7 @@ def generate_bundle_interior_pdf(folder, bundle_id, bundle_title, language_1, la
     interior_pdf_fname = f"{folder}/interior/{bundle_id}_paperback_interior.pdf"
 
     pdf = PDF(format=(152.4, 228.6))
-    pdf.add_font("dejavu-sans", style="", fname="assets/DejaVuSans.ttf")
+    add_font(pdf, "dejavu-sans", "assets/DejaVuSans.ttf")
 
     # Title page
     pdf.add_page()
@@ -412,7 +237,7 @@ def generate_bundle_interior_pdf(folder, bundle_id, bundle_title, language_1, la
     pdf.set_font("dejavu-sans", size=12)
     with TemporaryFile() as book_1_tmp:
         book_1_tmp_pdf = PDF(format=(152.4, 228.6))
-        book_1_tmp_pdf.add_font("dejavu-sans", style="", fname="assets/DejaVuSans.ttf")
+        add_font(book_1_tmp_pdf, "dejavu-sans", "assets/DejaVuSans.ttf")
         featured_text = f"Featured books:\n\n\n\n{title_1}; {author_1} — Page 4\n\n{title_2}; {author_2} — Page {write_book_pdf(book_1_tmp_pdf, title_1, author_1, language_1, text_1, notes_1, contents_1, preface_1) + 6}"
         book_1_tmp_pdf.output(book_1_tmp)
     lines_num = len(pdf.multi_cell(w=0, align='C', padding=(0, 8), text=featured_text, dry_run=True, output="LINES"))
@@ -448,7 +273,7 @@ def generate_bundle_cover_pdf(folder, bundle_id, title, author, description, int
     # Full cover
     cover_width, cover_height = 152.4 * 2 + interior_pages * 0.05720 + 3.175 * 2, 234.95
     pdf = fpdf.FPDF(format=(cover_width, cover_height))
-    pdf.add_font('dejavu-sans', style="", fname="assets/DejaVuSans.ttf")
+    add_font(pdf, "dejavu-sans", "assets/DejaVuSans.ttf")
     pdf.add_page()
     pdf.set_fill_color(r=250,g=249,b=222)
     pdf.rect(h=pdf.h, w=pdf.w, x=0, y=0, style="DF")
@@ -488,8 +313,8 @@ def generate_bundle_cover_pdf(folder, bundle_id, title, author, description, int
             Exclude any depictions of books, book covers or written text on the output image. 
             Meeting the criteria mentioned before, the image needs to be based on the following description: {description}
             """
-            img_url = client.images.generate(model='dall-e-3', prompt=prompt, n=1, quality="standard").data[0].url
-            response = requests.get(img_url)
+            img_url = get_llm_dispatcher().image(model='dall-e-3', prompt=prompt, n=1, quality="standard").data[0].url
+            response = http_client.get(img_url)
             with open(dalle_cover_img_png, 'wb') as img:
                 img.write(response.content)
             pdf.image(dalle_cover_img_png, x=(152.4 + interior_pages * 0.05720 + 3.175) + (152.4 - 100 - 6.35) / 2 + 5, y=(234.95 - 40) / 2, w=100, h=100)
@@ -505,7 +330,7 @@ def generate_bundle_pdfs(folder, bundle_id, index_1, index_2, title_1, title_2,
     if not book_1 or not book_2:
         raise Exception(f"Failed to fetch one or both books for bundle {bundle_id} (books {index_1}, {index_2})")
 
-    book_1_data, book_2_data = parse_raw_book(book_1), parse_raw_book(book_2)
+    book_1_data, book_2_data = parse_raw_books(book_1, book_2)
     interior_pages = generate_bundle_interior_pdf(
         folder,
         bundle_id,
@@ -632,6 +457,10 @@ def main(folder, num_workers):
     wb.save('Project Guttenberg Bundles.xlsx')
     dump_current_progress(final_progress)
     logger.info(f"Finished processing. Total bundles processed in this run: {processed_count}. Final progress: {final_progress}")
+    if get_llm_cache():
+        logger.info(get_llm_cache().summary())
+    logger.info(get_llm_dispatcher().summary())
+    logger.info(get_toc_formatter().summary())
 
 
 def parse_args():
@@ -643,6 +472,14 @@ def parse_args():
         epilog="Script will create output folder named as datestamp, and also maintain last processed bundle index and Excel spreadsheet"
     )
     parser.add_argument('-w', '--workers', type=int, default=4, help='Number of concurrent workers')
+    parser.add_argument('--cache-dir', type=str, default=None, help='raw and parsed books and LLM responses cache folder (default: .cache)')
+    parser.add_argument('--no-cache', action='store_true', help='always download and parse books, bypassing the raw and parsed books caches')
+    parser.add_argument('--no-llm-cache', action='store_true', help='always query OpenAI, bypassing the LLM responses cache')
+    parser.add_argument('--llm-rpm', type=int, default=None, help='OpenAI requests per minute limit (default: PG_OPENAI_RPM or 500)')
+    parser.add_argument('--llm-tpm', type=int, default=None, help='OpenAI tokens per minute limit (default: PG_OPENAI_TPM or 200000)')
+    parser.add_argument('--source', type=str, default=None, help='local Gutenberg mirror folder or zip archive to read books from instead of gutenberg.org')
+    parser.add_argument('--parse-workers', type=int, default=DEFAULT_PARSE_WORKERS,
+                        help=f'number of processes parsing books, 0 parses in the worker threads (default: {DEFAULT_PARSE_WORKERS})')
     return parser.parse_args()
 
 
@@ -660,4 +497,11 @@ if __name__ == '__main__':
     logging.getLogger('fpdf.svg').propagate = False
 
     args = parse_args()
+    configure_book_cache(args.cache_dir, enabled=not args.no_cache)
+    configure_parse_cache(args.cache_dir, enabled=not args.no_cache)
+    configure_parse_pool(args.parse_workers)
+    configure_llm_cache(args.cache_dir, enabled=not args.no_llm_cache)
+    configure_llm_dispatcher(args.llm_rpm, args.llm_tpm)
+    configure_book_source(args.source)
     main(run_folder, args.workers)
+    shutdown_parse_pool()
@@ -0,0 +1,210 @@
+"""Http_client.py.
+
+Shared HTTP client layer for every outbound call made by the scripts.
+
+A single requests.Session keeps keep-alive connection pools per host, every
+request gets default connect/read timeouts, 429 and 5xx responses (as well as
+connection errors) are retried with jittered exponential backoff honouring
+Retry-After, and the number of concurrent requests per host is capped.
+Requests to the metadata services go through their circuit breaker, and
+requests made within deadline() stop retrying, with timeouts shortened, once
+the deadline is reached.
+"""
+
+import time
+import random
+import logging
+import threading
+import contextlib
+from time import sleep
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+from circuit_breaker import CircuitOpenError, get_circuit_breaker
+
+
+logger = logging.getLogger("pg-http")
+
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+POOL_SIZE = 16
+DEFAULT_HOST_CONCURRENCY = 4
+HOST_CONCURRENCY = {
+    'www.gutenberg.org': 4,
+    'www.googleapis.com': 2,
+    'en.wikipedia.org': 4,
+    'www.wikidata.org': 4,
+    'openlibrary.org': 4,
+}
+# host -> service name of its circuit breaker
+CIRCUIT_BREAKER_HOSTS = {
+    'www.googleapis.com': 'google_books',
+    'openlibrary.org': 'open_library',
+    'en.wikipedia.org': 'wikipedia',
+    'www.wikidata.org': 'wikidata',
+}
+
+_session = None
+_session_lock = threading.Lock()
+_host_semaphores = {}
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the deadline() of the calling thread passed before a request was sent, or when it timed out at the deadline."""
+
+
+@contextlib.contextmanager
+def deadline(due):
+    """Requests of the calling thread within the block stop at `due` (time.monotonic() value), None for no deadline."""
+    previous = getattr(_local, 'due', None)
+    _local.due = due if previous is None or due is None else min(due, previous)
+    try:
+        yield
+    finally:
+        _local.due = previous
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            # requests is imported on first use to keep scripts start up fast
+            import requests
+            from requests.adapters import HTTPAdapter
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def _host_semaphore(host):
+    with _session_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY))
+        return _host_semaphores[host]
+
+
+def retry_after(response):
+    """Returns Retry-After header value in seconds, or None if absent/invalid."""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full jitter exponential backoff, never shorter than the server's retry hint."""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, BACKOFF_MAX))
+    return delay
+
+
+def current_deadline():
+    """Returns the deadline() due time of the calling thread, None without deadline."""
+    return getattr(_local, 'due', None)
+
+
+def remaining():
+    """Returns seconds left until the deadline of the calling thread, None without deadline."""
+    due = current_deadline()
+    return None if due is None else due - time.monotonic()
+
+
+def _may_retry(breaker, delay):
+    # retries stop as soon as other requests opened the breaker, or when the deadline would pass while waiting
+    left = remaining()
+    return not (breaker and breaker.is_open()) and (left is None or left > delay)
+
+
+def _send(method, url, retries, breaker, kwargs):
+    import requests
+    timeout = kwargs.pop('timeout', DEFAULT_TIMEOUT)
+    session = get_session()
+    semaphore = _host_semaphore(urlsplit(url).hostname)
+    for attempt in range(retries + 1):
+        attempt_timeout, shortened, left = timeout, False, remaining()
+        if left is not None:
+            if left <= 0:
+                raise DeadlineExceeded(f"{method} {url} not sent, deadline passed")
+            attempt_timeout = tuple(min(value, left) for value in timeout) if isinstance(timeout, tuple) else min(timeout or left, left)
+            shortened = attempt_timeout != timeout
+        try:
+            with semaphore:
+                response = session.request(method, url, timeout=attempt_timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if isinstance(e, requests.Timeout) and shortened and remaining() <= 0:
+                # timed out at the deadline, not after the timeout of the service: no failure of the service
+                raise DeadlineExceeded(f"{method} {url} timed out at the deadline") from e
+            delay = backoff_delay(attempt)
+            if attempt == retries or not _may_retry(breaker, delay):
+                raise
+            logger.warning(f"{method} {url} failed ({e}), retrying in {delay:.1f}s")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            delay = backoff_delay(attempt, retry_after(response))
+            if not _may_retry(breaker, delay):
+                return response
+            logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            response.close()
+        sleep(delay)
+
+
+def request(method, url, retries=DEFAULT_RETRIES, **kwargs):
+    """
+    Sends an HTTP request through the shared session.
+
+    Args:
+        method (str): HTTP method.
+        url (str): request URL.
+        retries (int): retries on connection errors, 429 and 5xx responses, stopped early by an open breaker or the deadline.
+        **kwargs: passed to requests.Session.request, `timeout` defaults to DEFAULT_TIMEOUT.
+
+    Returns:
+        requests.Response: last response received, retryable statuses included once retries are exhausted.
+
+    Raises:
+        CircuitOpenError: the circuit breaker of the service is open, the request was not sent.
+        DeadlineExceeded: the deadline() of the calling thread passed before the request was sent, or the request
+            timed out at the deadline; the circuit breaker does not count it as a failure of the service.
+    """
+    import requests
+    service = CIRCUIT_BREAKER_HOSTS.get(urlsplit(url).hostname)
+    breaker = get_circuit_breaker(service) if service else None
+    if breaker is None:
+        return _send(method, url, retries, None, kwargs)
+    if not breaker.allow():
+        raise CircuitOpenError(f"{method} {url} skipped, circuit breaker {breaker.name} is open")
+    try:
+        response = _send(method, url, retries, breaker, kwargs)
+    except (requests.ConnectionError, requests.Timeout):
+        breaker.record_failure()
+        raise
+    except BaseException:
+        # not sent or cut short by the deadline, no outcome for the breaker
+        breaker.release()
+        raise
+    if response.status_code in RETRY_STATUSES:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
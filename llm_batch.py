@@ -0,0 +1,110 @@
+"""Llm_batch.py.
+
+Offline OpenAI Batch API files.
+
+Chat completion requests are written as Batch API input lines, JSON objects
+with custom_id, method, url and body, the body being exactly the request the
+interactive code would send. The custom_id is the LLM cache key of the
+request, so ingesting a Batch API output file stores each successful response
+in the LLM cache, and a regular run over the same books is then served from
+the cache without querying OpenAI.
+
+Input files are split once they reach the Batch API limit of requests per
+file: requests.jsonl, requests.2.jsonl, ...
+"""
+
+import os
+import json
+import logging
+
+from llm_cache import LLMCache, get_llm_cache
+
+
+logger = logging.getLogger("pg-llm-batch")
+
+BATCH_URL = '/v1/chat/completions'
+BATCH_MAX_REQUESTS = 50000
+
+
+class BatchWriter:
+    """Writes chat completion requests to Batch API input files, skipping duplicates and requests already in `cache`."""
+
+    def __init__(self, fname, cache=None, max_requests=BATCH_MAX_REQUESTS):
+        self.fname = fname
+        self.cache = cache
+        self.max_requests = max_requests
+        self.fnames = []
+        self.written = self.cached = 0
+        self._custom_ids = set()
+        self._file = None
+        self._file_requests = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _next_file(self):
+        self.close()
+        root, ext = os.path.splitext(self.fname)
+        fname = self.fname if not self.fnames else f"{root}.{len(self.fnames) + 1}{ext}"
+        self._file = open(fname, 'w', encoding='utf-8')
+        self._file_requests = 0
+        self.fnames.append(fname)
+
+    def add(self, request):
+        """Adds chat completion request (chat_completion keyword arguments), returns its custom_id."""
+        custom_id = LLMCache.key(request)
+        if custom_id in self._custom_ids:
+            return custom_id
+        self._custom_ids.add(custom_id)
+        if self.cache and self.cache.get(custom_id) is not None:
+            self.cached += 1
+            return custom_id
+        if self._file is None or self._file_requests >= self.max_requests:
+            self._next_file()
+        self._file.write(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': BATCH_URL, 'body': request}, ensure_ascii=False) + '\n')
+        self._file_requests += 1
+        self.written += 1
+        return custom_id
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def summary(self):
+        return f"LLM batch: {self.written} requests written to {', '.join(self.fnames) or 'no file'}, {self.cached} already cached"
+
+
+def iter_batch_file(fname):
+    """Yields JSON objects of a Batch API input or output file."""
+    with open(fname, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def ingest_batch_results(fname, cache=None):
+    """
+    Stores successful responses of a Batch API output file in the LLM cache.
+
+    Returns:
+        tuple: (stored, failed) numbers of responses.
+    """
+    cache = cache or get_llm_cache()
+    if not cache:
+        raise ValueError("LLM cache is disabled, batch results can not be ingested")
+    stored = failed = 0
+    for result in iter_batch_file(fname):
+        response = result.get('response') or {}
+        body = response.get('body')
+        if result.get('error') or response.get('status_code') != 200 or not body:
+            error = result.get('error') or (body or {}).get('error') or response.get('status_code')
+            logger.warning(f"Batch request {result.get('custom_id')} failed: {error}")
+            failed += 1
+            continue
+        cache.put(result['custom_id'], body.get('model'), json.dumps(body, ensure_ascii=False))
+        stored += 1
+    return stored, failed
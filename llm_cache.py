@@ -0,0 +1,148 @@
+"""Llm_cache.py.
+
+Persistent cache of OpenAI chat completions.
+
+Responses are stored in an SQLite database (.cache/llm.sqlite) keyed by the
+sha256 of the request: model, messages, temperature and any other parameter
+affecting the output. Entries expire after a TTL and the least recently used
+ones are evicted once the database grows over its size cap.
+
+Deterministic calls (temperature=0) are cached by default, other calls only
+when the caller opts in with `cache=True`. Cache misses are sent through the
+LLM dispatcher.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import concurrent.futures
+
+from book_cache import DEFAULT_CACHE_DIR
+
+
+logger = logging.getLogger("pg-llm-cache")
+
+DEFAULT_MAX_BYTES = int(os.environ.get('PG_LLM_CACHE_MAX_MB', '256')) * 1024 * 1024
+DEFAULT_TTL = 90 * 24 * 60 * 60
+
+_llm_cache = None
+
+
+class LLMCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'llm.sqlite'), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+        self._db.commit()
+
+    @staticmethod
+    def key(request):
+        return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns cached response JSON, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM completions WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] < self.ttl:
+                self._db.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                self.hits += 1
+                return row[0]
+            if row:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._db.commit()
+            self.misses += 1
+        return None
+
+    def put(self, key, model, response):
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)", (key, model, response, len(response), now, now))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM completions ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+            total -= size
+        logger.debug(f"Evicted cached completions down to {total} bytes")
+
+    def summary(self):
+        total = self.hits + self.misses
+        return f"LLM cache: {self.hits} hits, {self.misses} misses" + (f" ({self.hits / total:.0%} hit rate)" if total else "")
+
+
+def get_llm_cache():
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+
+def configure_llm_cache(cache_dir=None, max_bytes=None, ttl=None, enabled=True):
+    """Replaces process wide LLM cache, `enabled=False` bypasses caching."""
+    global _llm_cache
+    kwargs = {}
+    if cache_dir:
+        kwargs['cache_dir'] = cache_dir
+    if max_bytes:
+        kwargs['max_bytes'] = max_bytes
+    if ttl:
+        kwargs['ttl'] = ttl
+    _llm_cache = LLMCache(**kwargs) if enabled else False
+
+
+def submit_chat_completion(cache=None, **kwargs):
+    """
+    Submits client.chat.completions.create(**kwargs) to the LLM dispatcher, served from the LLM cache when possible.
+
+    Args:
+        cache (bool): True caches the call, False bypasses the cache, None (default) caches
+            deterministic calls only, i.e. with temperature=0.
+
+    Returns:
+        concurrent.futures.Future: future of the chat completion.
+    """
+    # the dispatcher (and the OpenAI client) is only set up by the first request
+    from llm_dispatcher import get_llm_dispatcher
+    if cache is None:
+        cache = kwargs.get('temperature') == 0
+    llm_cache = get_llm_cache() if cache else None
+    if not llm_cache:
+        return get_llm_dispatcher().submit_chat(**kwargs)
+    from openai.types.chat import ChatCompletion
+    key = llm_cache.key(kwargs)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        future = concurrent.futures.Future()
+        future.set_result(ChatCompletion.model_validate_json(cached))
+        return future
+    future = get_llm_dispatcher().submit_chat(**kwargs)
+
+    def store(done):
+        if not done.cancelled() and done.exception() is None:
+            llm_cache.put(key, kwargs.get('model'), done.result().model_dump_json())
+    future.add_done_callback(store)
+    return future
+
+
+def chat_completion(cache=None, **kwargs):
+    """Returns client.chat.completions.create(**kwargs), see submit_chat_completion."""
+    return submit_chat_completion(cache, **kwargs).result()
@@ -0,0 +1,233 @@
+"""Llm_dispatcher.py.
+
+Concurrent dispatcher for OpenAI chat completions and image generations.
+
+Requests are submitted from any thread and run concurrently through the async
+OpenAI client on a background asyncio loop, returning concurrent.futures
+futures. Requests per minute and tokens per minute are capped with token
+buckets, rate limited (429) and transient errors are retried honouring the
+server retry hints (retry-after, retry-after-ms, x-ratelimit-reset-*), and
+queue depth and in-flight counts are exposed for monitoring.
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+
+import http_client
+
+
+logger = logging.getLogger("pg-llm")
+
+DEFAULT_RPM = int(os.environ.get('PG_OPENAI_RPM', '500'))
+DEFAULT_TPM = int(os.environ.get('PG_OPENAI_TPM', '200000'))
+DEFAULT_MAX_IN_FLIGHT = 16
+DEFAULT_RETRIES = 6
+# completion tokens reserved for requests without max_tokens, corrected with actual usage afterwards
+DEFAULT_COMPLETION_TOKENS = 512
+# rough tokens per prompt character
+TOKENS_PER_CHAR = 0.25
+
+DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Bucket of `rate_per_minute` tokens refilled continuously."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.rate = self.capacity / 60
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Returns seconds until `amount` tokens are available, requests larger than the bucket wait for a full one."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        # may go negative, e.g. when actual usage exceeds the reserved estimate
+        self._refill()
+        self.tokens -= amount
+
+
+def parse_duration(value):
+    """Parses OpenAI rate limit reset durations, e.g. "1s", "6m0s", "20ms"."""
+    seconds = sum(float(number) * DURATION_UNITS[unit] for number, unit in DURATION_PATTERN.findall(value or ''))
+    return seconds or None
+
+
+def retry_hint(response):
+    """Returns seconds to wait before retrying a rate limited response, or None if the server gave no hint."""
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    hint = http_client.retry_after(response)
+    if hint is not None:
+        return hint
+    resets = [parse_duration(headers.get(name)) for name in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')]
+    resets = [reset for reset in resets if reset]
+    return max(resets) if resets else None
+
+
+def estimate_tokens(kind, request):
+    if kind != 'chat':
+        return 0
+    prompt_chars = sum(len(message.get('content') or '') for message in request.get('messages', []) if isinstance(message.get('content'), str))
+    completion_tokens = request.get('max_tokens') or request.get('max_completion_tokens') or DEFAULT_COMPLETION_TOKENS
+    return int(prompt_chars * TOKENS_PER_CHAR) + completion_tokens
+
+
+class LLMDispatcher:
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_in_flight=DEFAULT_MAX_IN_FLIGHT, retries=DEFAULT_RETRIES):
+        self.requests_bucket = TokenBucket(rpm)
+        self.tokens_bucket = TokenBucket(tpm)
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.queued = self.in_flight = self.completed = self.failed = self.retried = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._client = None
+
+    def _start(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="llm-dispatcher", daemon=True)
+                self._thread.start()
+        return self._loop
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def submit(self, kind, **request):
+        """Submits a 'chat' or 'image' request, returns concurrent.futures.Future of the response."""
+        loop = self._start()
+        self._count(queued=1)
+        return asyncio.run_coroutine_threadsafe(self._dispatch(kind, request), loop)
+
+    def submit_chat(self, **request):
+        return self.submit('chat', **request)
+
+    def submit_image(self, **request):
+        return self.submit('image', **request)
+
+    def chat(self, **request):
+        """Same as client.chat.completions.create(**request), dispatched through the rate limits."""
+        return self.submit_chat(**request).result()
+
+    def image(self, **request):
+        """Same as client.images.generate(**request), dispatched through the rate limits."""
+        return self.submit_image(**request).result()
+
+    async def _acquire(self, tokens):
+        # one waiter at a time, so requests are served in submission order
+        async with self._acquire_lock:
+            while True:
+                delay = max(self.requests_bucket.wait_time(1), self.tokens_bucket.wait_time(tokens))
+                if not delay:
+                    self.requests_bucket.take(1)
+                    self.tokens_bucket.take(tokens)
+                    return
+                await asyncio.sleep(delay)
+
+    def _setup(self):
+        from openai import AsyncOpenAI
+        # retries are handled by the dispatcher, to honour the rate limits
+        self._client = AsyncOpenAI(max_retries=0)
+        self._acquire_lock = asyncio.Lock()
+        self._in_flight_semaphore = asyncio.Semaphore(self.max_in_flight)
+
+    async def _call(self, kind, request):
+        if kind == 'chat':
+            return await self._client.chat.completions.create(**request)
+        return await self._client.images.generate(**request)
+
+    async def _dispatch(self, kind, request):
+        from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+        if self._client is None:
+            self._setup()
+        tokens = estimate_tokens(kind, request)
+        queued = True
+        try:
+            for attempt in range(self.retries + 1):
+                await self._acquire(tokens)
+                async with self._in_flight_semaphore:
+                    self._count(queued=-1 if queued else 0, in_flight=1)
+                    queued = False
+                    try:
+                        response, error = await self._call(kind, request), None
+                    except (RateLimitError, InternalServerError, APIConnectionError, APITimeoutError) as e:
+                        if attempt == self.retries:
+                            raise
+                        response, error = None, e
+                    finally:
+                        self._count(in_flight=-1)
+                if error is None:
+                    break
+                delay = http_client.backoff_delay(attempt, retry_hint(getattr(error, 'response', None)))
+                logger.warning(f"OpenAI {kind} request failed ({error.__class__.__name__}), retrying in {delay:.1f}s")
+                self._count(retried=1)
+                await asyncio.sleep(delay)
+        except BaseException:
+            self._count(queued=-1 if queued else 0, failed=1)
+            raise
+        usage = getattr(response, 'usage', None)
+        if usage is not None and getattr(usage, 'total_tokens', None):
+            self.tokens_bucket.take(usage.total_tokens - tokens)
+        self._count(completed=1)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self.queued, 'in_flight': self.in_flight, 'completed': self.completed, 'failed': self.failed, 'retried': self.retried}
+
+    def summary(self):
+        stats = self.stats()
+        return (
+            f"LLM dispatcher: {stats['completed']} completed, {stats['failed']} failed, {stats['retried']} retries, "
+            f"{stats['queued']} queued, {stats['in_flight']} in flight"
+        )
+
+
+def get_llm_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = LLMDispatcher()
+        return _dispatcher
+
+
+def configure_llm_dispatcher(rpm=None, tpm=None, max_in_flight=None):
+    """Replaces process wide LLM dispatcher, unset limits keep their defaults."""
+    global _dispatcher
+    kwargs = {}
+    if rpm:
+        kwargs['rpm'] = rpm
+    if tpm:
+        kwargs['tpm'] = tpm
+    if max_in_flight:
+        kwargs['max_in_flight'] = max_in_flight
+    with _dispatcher_lock:
+        _dispatcher = LLMDispatcher(**kwargs)
@@ -0,0 +1,118 @@
+"""Parse_cache.py.
+
+Persistent on-disk cache of parsed books.
+
+The output of text_cleaning.parse_raw_book (header fields and sections) is
+stored marshal-serialized and zlib-compressed, keyed by the sha256 of the raw
+book text and of the appendix pattern. Entries live in a folder named after
+the parser version stamp, a hash of the text_cleaning source, so any change
+of the cleaning rules starts a fresh cache and the folders of other versions
+are removed.
+"""
+
+import os
+import sys
+import zlib
+import shutil
+import marshal
+import hashlib
+import logging
+import functools
+import threading
+
+import text_cleaning
+from book_cache import DEFAULT_CACHE_DIR
+
+
+logger = logging.getLogger("pg-parse-cache")
+
+COMPRESS_LEVEL = 6
+
+_parse_cache = None
+
+
+@functools.lru_cache(maxsize=None)
+def parser_version():
+    """Returns stamp of the cleaning rules and of the serialization format."""
+    digest = hashlib.sha256(f"{sys.version_info[0]}.{sys.version_info[1]}:{marshal.version}:".encode())
+    with open(text_cleaning.__file__, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+class ParseCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.version = parser_version()
+        self.parent = os.path.join(cache_dir, 'parsed')
+        self.root = os.path.join(self.parent, self.version)
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._prune()
+
+    def _prune(self):
+        for name in os.listdir(self.parent):
+            if name != self.version:
+                logger.info(f"Removing parsed books of parser version {name}")
+                shutil.rmtree(os.path.join(self.parent, name), ignore_errors=True)
+
+    @staticmethod
+    def key(text, appendix_pattern):
+        digest = hashlib.sha256(appendix_pattern.pattern.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(text.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def _fname(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.bin")
+
+    def get(self, key):
+        """Returns cached parsed book, or None if it is not cached."""
+        try:
+            with open(self._fname(key), 'rb') as f:
+                book = marshal.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            book = None
+        except (OSError, EOFError, ValueError, TypeError, zlib.error) as e:
+            logger.warning(f"Dropping unreadable parsed book {key}: {e}")
+            book = None
+        with self._lock:
+            if book is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return book
+
+    def put(self, key, book):
+        fname = self._fname(key)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        tmp_fname = f"{fname}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_fname, 'wb') as f:
+            f.write(zlib.compress(marshal.dumps(book), COMPRESS_LEVEL))
+        os.replace(tmp_fname, fname)
+
+
+def get_parse_cache():
+    global _parse_cache
+    if _parse_cache is None:
+        _parse_cache = ParseCache()
+    return _parse_cache
+
+
+def configure_parse_cache(cache_dir=None, enabled=True):
+    """Replaces process wide parsed books cache, `enabled=False` disables caching."""
+    global _parse_cache
+    _parse_cache = (ParseCache(cache_dir) if cache_dir else ParseCache()) if enabled else False
+
+
+def parse_book(text, appendix_pattern=text_cleaning.APPENDIX_PATTERN):
+    """Returns text_cleaning.parse_raw_book(text, appendix_pattern), served from the parsed books cache when possible."""
+    cache = get_parse_cache()
+    if not cache:
+        return text_cleaning.parse_raw_book(text, appendix_pattern)
+    key = cache.key(text, appendix_pattern)
+    book = cache.get(key)
+    if book is None:
+        book = text_cleaning.parse_raw_book(text, appendix_pattern)
+        cache.put(key, book)
+    return book
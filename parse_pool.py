@@ -0,0 +1,102 @@
+"""Parse_pool.py.
+
+Process pool for the CPU bound book parsing stage.
+
+Text cleaning is pure Python regex work holding the GIL, so threads parse on
+a single core. Raw texts are sent to worker processes running
+text_cleaning.parse_raw_book and the parsed sections are sent back, each
+crossing the process boundary once as a pickled str. Parsed books already in
+the parsed books cache are served in the calling process and never reach the
+pool; freshly parsed ones are stored there as their futures complete.
+
+Workers are started from a fork server (spawned where there is none) rather
+than forked from the scripts: the pool is created once prefetch, dispatcher and
+bundle threads are running, and a fork could copy locks they hold (logging,
+SQLite, caches) into the workers and hang them.
+"""
+
+import os
+import logging
+import threading
+import multiprocessing
+import concurrent.futures
+
+import text_cleaning
+from parse_cache import get_parse_cache, parse_book
+
+
+logger = logging.getLogger("pg-parse-pool")
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+_pool = None
+_workers = DEFAULT_WORKERS
+_pool_lock = threading.Lock()
+
+
+def configure_parse_pool(workers=DEFAULT_WORKERS):
+    """Sets number of parsing worker processes, 0 parses books in the calling process."""
+    global _workers
+    shutdown_parse_pool()
+    _workers = max(0, workers)
+
+
+def parse_workers():
+    return _workers
+
+
+def _mp_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # the fork server compiles the cleaning patterns once, for every worker it forks
+        context.set_forkserver_preload(['text_cleaning'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def get_parse_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None and _workers:
+            logger.debug(f"Starting {_workers} parsing processes")
+            _pool = concurrent.futures.ProcessPoolExecutor(max_workers=_workers, mp_context=_mp_context())
+        return _pool
+
+
+def shutdown_parse_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def _completed(result=None, exception=None):
+    future = concurrent.futures.Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+def submit_parse(text, appendix_pattern=text_cleaning.APPENDIX_PATTERN):
+    """Returns a future of text_cleaning.parse_raw_book(text, appendix_pattern)."""
+    pool = get_parse_pool()
+    if pool is None:
+        try:
+            return _completed(parse_book(text, appendix_pattern))
+        except Exception as e:
+            return _completed(exception=e)
+    cache = get_parse_cache()
+    key = cache.key(text, appendix_pattern) if cache else None
+    book = cache.get(key) if cache else None
+    if book is not None:
+        return _completed(book)
+    future = pool.submit(text_cleaning.parse_raw_book, text, appendix_pattern)
+    if cache:
+        def store(done):
+            if not done.cancelled() and done.exception() is None:
+                cache.put(key, done.result())
+        future.add_done_callback(store)
+    return future
@@ -0,0 +1,143 @@
+"""Pdf_fonts.py.
+
+usage: python3 pdf_fonts.py [options]
+
+Micro-benchmark of the PDF font registry against fpdf add_font:
+
+options:
+  -h, --help            show this help message and exit
+  --documents DOCUMENTS
+                        number of documents, each one adding the font (default: 4)
+  --pages PAGES         pages of each document, each footer adding the font again (default: 800)
+
+Process wide registry of the TrueType fonts of the PDFs.
+
+fpdf loads and parses a font file (glyph widths, character map, metrics) for
+every document it is added to. The registry parses each font file once per
+process and shares the result across all documents, which only get their own
+glyph subset, font descriptor and lazily loaded font tables: fpdf subsets the
+tables in place and sets the object id and font stream of the descriptor when a
+document is written, so documents written concurrently (guttenberg_bundles.py
+threads) never share those. Adding a font a document already has costs nothing, so
+the page footers can add it on every page. Relies on fpdf2 2.7 TTFFont
+internals (see requirements.txt).
+"""
+
+import io
+import copy
+import time
+import argparse
+import threading
+
+
+DEJAVU_SANS = 'dejavu-sans'
+DEJAVU_SANS_FNAME = 'assets/DejaVuSans.ttf'
+# TTFFont attributes parsed from the font file, shared by the documents: only read when writing them
+# (the cw defaultdict may get the default width of missing characters added, the same for every document)
+SHARED_ATTRIBUTES = ('type', 'name', 'glyph_ids', 'up', 'ut', 'cw', 'ttffile', 'emphasis', 'scale', 'cmap')
+
+_fonts = {}
+_fonts_lock = threading.Lock()
+
+
+def _parsed_font(fname):
+    """Returns (parsed TTFFont, font file bytes) of the font file, parsed on first use."""
+    with _fonts_lock:
+        if fname not in _fonts:
+            # fpdf is imported on first use only, so that -h and non PDF runs start fast
+            import fpdf
+            from fpdf.fonts import TTFFont
+            with open(fname, 'rb') as f:
+                data = f.read()
+            # parsed for a throwaway document, only the font file attributes are kept
+            font = TTFFont(fpdf.FPDF(), fname, '', '')
+            font.close()
+            _fonts[fname] = font, data
+        return _fonts[fname]
+
+
+def add_font(pdf, family=DEJAVU_SANS, fname=DEJAVU_SANS_FNAME):
+    """Makes the regular style of the font file available to pdf.set_font(family), like FPDF.add_font but parsed once per process."""
+    fontkey = family.lower()
+    if fontkey in pdf.fonts:
+        return
+    from fontTools import ttLib
+    from fpdf.fonts import SubsetMap, TTFFont
+    parsed, data = _parsed_font(fname)
+    font = TTFFont.__new__(TTFFont)
+    for attribute in SHARED_ATTRIBUTES:
+        setattr(font, attribute, getattr(parsed, attribute))
+    font.i = len(pdf.fonts) + 1
+    font.fontkey = fontkey
+    # fpdf sets the font name, font stream and object id of the descriptor when the document is written
+    font.desc = copy.copy(parsed.desc)
+    font.missing_glyphs = []
+    font.ttfont = ttLib.TTFont(io.BytesIO(data), recalcTimestamp=False, fontNumber=0, lazy=True)
+    # same subset reservations as TTFFont: control characters, space, and the page number alias
+    identities = "\x00 \r\n" + (f"0123456789{pdf.str_alias_nb_pages}" if pdf.str_alias_nb_pages else "")
+    font.subset = SubsetMap(font, [ord(char) for char in identities])
+    pdf.fonts[fontkey] = font
+
+
+def _add_fpdf_font(pdf):
+    pdf.add_font(DEJAVU_SANS, style="", fname=DEJAVU_SANS_FNAME)
+
+
+def benchmark(documents, pages, add):
+    """
+    Times adding the font with add(pdf) the way the scripts do.
+
+    Returns:
+        tuple: (seconds per new document adding the font, seconds per page footer adding it again,
+                seconds writing the documents with pages and footers end to end).
+    """
+    import fpdf
+
+    class PDF(fpdf.FPDF):
+        def footer(self):
+            add(self)
+            self.set_font(DEJAVU_SANS, size=8)
+            self.cell(0, 10, f"{self.page_no()}", 0, 0, 'C')
+
+    started = time.perf_counter()
+    for _ in range(documents):
+        add(fpdf.FPDF())
+    per_document = (time.perf_counter() - started) / documents
+    pdf = fpdf.FPDF()
+    add(pdf)
+    started = time.perf_counter()
+    for _ in range(pages):
+        add(pdf)
+    per_page = (time.perf_counter() - started) / pages if pages else 0.0
+    started = time.perf_counter()
+    for _ in range(documents):
+        pdf = PDF(format=(152.4, 228.6))
+        add(pdf)
+        pdf.set_font(DEJAVU_SANS, size=9)
+        for _ in range(pages):
+            pdf.add_page()
+            pdf.cell(0, 10, "Project Gutenberg")
+        pdf.output()
+    return per_document, per_page, time.perf_counter() - started
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='pdf_fonts.py',
+        usage='python3 %(prog)s [options]',
+        description='Micro-benchmark of the PDF font registry against fpdf add_font:',
+    )
+    parser.add_argument('--documents', type=int, default=4, help='number of documents, each one adding the font (default: 4)')
+    parser.add_argument('--pages', type=int, default=800, help='pages of each document, each footer adding the font again (default: 800)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    import warnings
+    args = parse_args()
+    # fpdf warns about the font already added on every page
+    warnings.simplefilter('ignore')
+    for name, add in (('fpdf add_font', _add_fpdf_font), ('font registry', add_font)):
+        per_document, per_page, total = benchmark(args.documents, args.pages, add)
+        print(f"{name}: {per_document * 1000:.2f} ms per document, {per_page * 1e6:.2f} us per page footer, "
+              f"{total:.2f}s for {args.documents} documents of {args.pages} pages")
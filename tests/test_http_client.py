@@ -0,0 +1,66 @@
+"""Deadline shortened requests against a local server answering late: they are no failures of the service."""
+
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import circuit_breaker
+import http_client
+
+
+requests = pytest.importorskip('requests')
+
+SERVICE = 'slow_service'
+# seconds the server waits before answering
+ANSWER_DELAY = 1.0
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(ANSWER_DELAY)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+        except OSError:
+            # the client gave up
+            pass
+
+
+@pytest.fixture
+def url(monkeypatch):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setitem(http_client.CIRCUIT_BREAKER_HOSTS, '127.0.0.1', SERVICE)
+    circuit_breaker.configure_circuit_breakers(failure_threshold=1)
+    yield f'http://127.0.0.1:{httpd.server_port}/'
+    circuit_breaker.configure_circuit_breakers()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_timeout_shortened_by_the_deadline_releases_the_breaker(url):
+    with http_client.deadline(time.monotonic() + 0.2):
+        with pytest.raises(http_client.DeadlineExceeded) as excinfo:
+            http_client.get(url, timeout=(5, 5))
+    assert isinstance(excinfo.value.__cause__, requests.Timeout)
+    breaker = circuit_breaker.get_circuit_breaker(SERVICE)
+    assert (breaker.state, breaker.failures) == (circuit_breaker.CLOSED, 0)
+    # the breaker still lets the next request through
+    assert http_client.get(url, timeout=(5, 5)).status_code == 200
+
+
+def test_timeout_of_the_request_is_a_failure_of_the_service(url):
+    with http_client.deadline(time.monotonic() + 5):
+        with pytest.raises(requests.Timeout):
+            http_client.get(url, retries=0, timeout=(5, 0.2))
+    breaker = circuit_breaker.get_circuit_breaker(SERVICE)
+    assert (breaker.state, breaker.failures) == (circuit_breaker.OPEN, 1)
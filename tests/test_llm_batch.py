@@ -0,0 +1,90 @@
+"""Batch mode round trip: BatchWriter input files, batch_stub.py outputs, ingest_batch_results into the LLM cache."""
+
+import json
+
+import pytest
+
+import llm_cache
+import llm_dispatcher
+from batch_stub import run_batch
+from book_metadata import metadata_request, validate_metadata
+from llm_batch import BatchWriter, ingest_batch_results, iter_batch_file
+from llm_cache import LLMCache
+
+
+BOOKS = [
+    ("Pride and Prejudice", "Austen, Jane", "English"),
+    ("Germinal", "Zola, Émile", "French"),
+    ("The Adventures of Tom Sawyer", "Twain, Mark", "English"),
+]
+
+
+def contents_request(book_contents):
+    return dict(model="gpt-4o-mini", messages=[{"role": "system", "content": f"Format this Contents section:\n{book_contents}"}], temperature=0)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMCache(cache_dir=str(tmp_path / 'cache'))
+
+
+def write_batch(fname, cache, requests, max_requests=2):
+    with BatchWriter(fname, cache, max_requests=max_requests) as batch:
+        custom_ids = [batch.add(request) for request in requests]
+    return batch, custom_ids
+
+
+def test_batch_results_are_ingested_under_the_request_cache_keys(tmp_path, cache):
+    requests = [metadata_request(*book) for book in BOOKS] + [contents_request("I. One 1\nII. Two 9")]
+    batch, custom_ids = write_batch(str(tmp_path / 'requests.jsonl'), cache, requests + requests[:1])
+    assert custom_ids == [LLMCache.key(request) for request in requests + requests[:1]]
+    assert batch.written == 4
+    assert batch.fnames == [str(tmp_path / 'requests.jsonl'), str(tmp_path / 'requests.2.jsonl')]
+    stored = failed = 0
+    for n, fname in enumerate(batch.fnames, 1):
+        results_fname = str(tmp_path / f'results.{n}.jsonl')
+        assert run_batch(fname, results_fname) == 2
+        # the output lines answer the input lines by custom_id, and the bodies are the requests as written
+        assert [result['custom_id'] for result in iter_batch_file(results_fname)] == [line['custom_id'] for line in iter_batch_file(fname)]
+        assert all(LLMCache.key(line['body']) == line['custom_id'] for line in iter_batch_file(fname))
+        file_stored, file_failed = ingest_batch_results(results_fname, cache)
+        stored += file_stored
+        failed += file_failed
+    assert (stored, failed) == (4, 0)
+    for request, custom_id in zip(requests, custom_ids):
+        completion = json.loads(cache.get(custom_id))
+        assert completion['model'] == request['model']
+    metadata = json.loads(json.loads(cache.get(custom_ids[0]))['choices'][0]['message']['content'])
+    assert validate_metadata(metadata) is not None
+
+
+def test_failed_batch_requests_are_not_cached(tmp_path, cache):
+    requests = [metadata_request(*book) for book in BOOKS]
+    batch, custom_ids = write_batch(str(tmp_path / 'requests.jsonl'), cache, requests, max_requests=10)
+    results_fname = str(tmp_path / 'results.jsonl')
+    # the second request fails with an error, the third one with an error response
+    run_batch(batch.fnames[0], results_fname, fail_every=2)
+    results = list(iter_batch_file(results_fname))
+    results[2]['response'] = {'status_code': 429, 'body': {'error': {'message': 'Rate limit reached', 'code': 'rate_limit_exceeded'}}}
+    with open(results_fname, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(result) + '\n' for result in results)
+    assert ingest_batch_results(results_fname, cache) == (1, 2)
+    assert cache.get(custom_ids[0]) is not None
+    assert cache.get(custom_ids[1]) is None
+    assert cache.get(custom_ids[2]) is None
+    # a second batch only carries the requests left out of the cache
+    batch, _ = write_batch(str(tmp_path / 'retry.jsonl'), cache, requests)
+    assert (batch.written, batch.cached) == (2, 1)
+    assert [line['custom_id'] for line in iter_batch_file(batch.fnames[0])] == custom_ids[1:]
+
+
+def test_ingested_completions_are_served_without_openai(tmp_path, cache, monkeypatch):
+    pytest.importorskip('openai')
+    request = metadata_request(*BOOKS[0])
+    batch, _ = write_batch(str(tmp_path / 'requests.jsonl'), cache, [request])
+    run_batch(batch.fnames[0], str(tmp_path / 'results.jsonl'))
+    ingest_batch_results(str(tmp_path / 'results.jsonl'), cache)
+    monkeypatch.setattr(llm_cache, '_llm_cache', cache)
+    monkeypatch.setattr(llm_dispatcher, 'get_llm_dispatcher', lambda: pytest.fail("OpenAI queried for an ingested completion"))
+    completion = llm_cache.chat_completion(cache=True, **request)
+    assert validate_metadata(json.loads(completion.choices[0].message.content)) is not None
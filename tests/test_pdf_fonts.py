@@ -0,0 +1,62 @@
+"""PDF font registry: documents sharing the parsed font are written like with fpdf add_font, also concurrently."""
+
+import os
+import sys
+import datetime
+import warnings
+import concurrent.futures
+
+import pytest
+
+import pdf_fonts
+from conftest import FIXTURES_DIR
+
+
+fpdf = pytest.importorskip('fpdf')
+
+FONT_FNAME = os.path.join(os.path.dirname(FIXTURES_DIR), os.pardir, pdf_fonts.DEJAVU_SANS_FNAME)
+CREATION_DATE = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+# distinct characters per document, so that each one gets its own font subset
+TEXTS = ["Project Gutenberg", "Écrit à Paris, l'été", "Ὅμηρος Ἰλιάς", "Война и мир"]
+PAGES = (1, 4, 20)
+
+
+def write_document(text, pages, registry):
+    pdf = fpdf.FPDF()
+    pdf.set_creation_date(CREATION_DATE)
+    if registry:
+        pdf_fonts.add_font(pdf, pdf_fonts.DEJAVU_SANS, FONT_FNAME)
+    else:
+        pdf.add_font(pdf_fonts.DEJAVU_SANS, style="", fname=FONT_FNAME)
+    pdf.set_font(pdf_fonts.DEJAVU_SANS, size=12)
+    for _ in range(pages):
+        pdf.add_page()
+        pdf.multi_cell(0, 8, text * 20)
+    return bytes(pdf.output())
+
+
+@pytest.fixture(scope='module')
+def expected():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return {(text, pages): write_document(text, pages, registry=False) for text in TEXTS for pages in PAGES}
+
+
+def test_documents_are_written_like_with_fpdf_add_font(expected):
+    for text in TEXTS:
+        assert write_document(text, 20, registry=True) == expected[text, 20]
+
+
+def test_documents_written_concurrently_keep_their_own_font(expected):
+    # documents of different lengths, so that the objects of their fonts get different ids
+    documents = [(text, pages) for text in TEXTS for pages in PAGES] * 5
+    # threads switch often, so that their pdf.output() calls interleave
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            outputs = list(executor.map(lambda document: write_document(*document, registry=True), documents))
+    finally:
+        sys.setswitchinterval(switch_interval)
+    for document, output in zip(documents, outputs):
+        assert output == expected[document]
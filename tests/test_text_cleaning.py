@@ -0,0 +1,47 @@
+"""
+Regression test of text_cleaning.parse_raw_book on the books of fixtures/books.
+
+Each <name>.txt raw book is parsed and compared to its expected <name>.json output, written by
+the parsing code of guttenberg2.py and guttenberg_bundles.py before text_cleaning.py. After an
+intended change of the cleaning output, the expected outputs are rewritten with the following,
+and committed along with the change:
+    python3 tests/test_text_cleaning.py
+"""
+
+import os
+import glob
+import json
+
+import pytest
+
+# first, so that the repository modules are importable when run as a script
+from conftest import FIXTURES_DIR
+import text_cleaning
+
+
+BOOKS_DIR = os.path.join(FIXTURES_DIR, 'books')
+BOOKS = sorted(os.path.splitext(os.path.basename(fname))[0] for fname in glob.glob(os.path.join(BOOKS_DIR, '*.txt')))
+# books parsed the way guttenberg_bundles.py does, others the way guttenberg2.py does
+APPENDIX_PATTERNS = {'letters': text_cleaning.APPENDIX_LETTERS_PATTERN}
+
+
+def parse_book(name):
+    # newline='' keeps the \r\n line endings of Gutenberg texts
+    with open(os.path.join(BOOKS_DIR, name + '.txt'), encoding='utf-8', newline='') as f:
+        text = f.read()
+    return text_cleaning.parse_raw_book(text, APPENDIX_PATTERNS.get(name, text_cleaning.APPENDIX_PATTERN))
+
+
+@pytest.mark.parametrize('name', BOOKS)
+def test_parse_raw_book_output_is_unchanged(name):
+    with open(os.path.join(BOOKS_DIR, name + '.json'), encoding='utf-8') as f:
+        expected = json.load(f)
+    assert parse_book(name) == expected
+
+
+if __name__ == '__main__':
+    for name in BOOKS:
+        with open(os.path.join(BOOKS_DIR, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(parse_book(name), f, ensure_ascii=False, indent=1)
+            f.write('\n')
+        print(f"{name}.json written")
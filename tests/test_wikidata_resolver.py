@@ -0,0 +1,111 @@
+"""Wikidata resolver against a local server replaying fixtures/wikidata responses."""
+
+import os
+import json
+import importlib
+import threading
+import urllib.parse
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import author_store
+from conftest import FIXTURES_DIR
+
+
+with open(os.path.join(FIXTURES_DIR, 'wikidata', 'wbsearchentities.json'), encoding='utf-8') as f:
+    SEARCHES = json.load(f)
+with open(os.path.join(FIXTURES_DIR, 'wikidata', 'wbgetentities.json'), encoding='utf-8') as f:
+    ENTITIES = json.load(f)['entities']
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        self.server.requests.append(params)
+        if params.get('action') == 'wbsearchentities':
+            body = SEARCHES.get(params['search'], {'searchinfo': {'search': params['search']}, 'search': [], 'success': 1})
+        elif params.get('action') == 'wbgetentities':
+            ids = params['ids'].split('|')
+            if len(ids) > 50:
+                self.send_error(400, 'too-many')
+                return
+            # unknown IDs are answered the way the API does
+            body = {'entities': {qid: ENTITIES.get(qid, {'id': qid, 'missing': ''}) for qid in ids}, 'success': 1}
+        else:
+            self.send_error(400)
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def resolver(server, tmp_path, monkeypatch):
+    """Process wide resolver of a wikidata_resolver module loaded with PG_WIKIDATA_API_URL pointing at the server."""
+    monkeypatch.setattr(author_store, '_author_store', None)
+    author_store.configure_author_store(cache_dir=str(tmp_path))
+    monkeypatch.setenv('PG_WIKIDATA_API_URL', f'http://127.0.0.1:{server.server_port}/w/api.php')
+    import wikidata_resolver
+    module = importlib.reload(wikidata_resolver)
+    yield module.get_wikidata_resolver()
+    monkeypatch.undo()
+    importlib.reload(wikidata_resolver)
+
+
+def actions(server):
+    return [params['action'] for params in server.requests]
+
+
+def test_death_years_of_concurrent_lookups_share_a_claims_request(resolver, server):
+    names = ['Dickens, Charles, 1812-1870', 'Twain, Mark, 1835-1910', 'Zola, Émile, 1840-1902', 'Austen, Jane, 1775-1817']
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(names)) as executor:
+        death_years = list(executor.map(resolver.death_year, names))
+    assert death_years == ['1870', '1910', '1902', '1817']
+    assert actions(server).count('wbsearchentities') == 4
+    claims_requests = [params for params in server.requests if params['action'] == 'wbgetentities']
+    assert len(claims_requests) == 1
+    assert sorted(claims_requests[0]['ids'].split('|')) == ['Q36322', 'Q504', 'Q5686', 'Q7245']
+    assert claims_requests[0]['props'] == 'claims'
+
+
+def test_authors_without_death_claim_or_entity_are_unresolved(resolver, server):
+    assert resolver.death_year('Atwood, Margaret, 1939-') == author_store.UNRESOLVED
+    assert resolver.death_year('Nobody Known') == author_store.UNRESOLVED
+    # the search miss needs no claims request
+    assert actions(server) == ['wbsearchentities', 'wbgetentities', 'wbsearchentities']
+
+
+def test_stored_death_years_are_not_requested_again(resolver, server):
+    assert resolver.death_year('Charles Dickens') == '1870'
+    assert resolver.death_year('Dickens, Charles, 1812-1870') == '1870'
+    assert actions(server) == ['wbsearchentities', 'wbgetentities']
+    assert author_store.get_author_store().get('Charles Dickens', 'wikidata') == ('1870', 'Q5686')
+
+
+def test_claims_are_fetched_50_entities_per_request(resolver, server):
+    ids = list(ENTITIES) + [f'Q{900000 + i}' for i in range(115)]
+    death_years = resolver.fetch_death_years(ids)
+    assert [len(params['ids'].split('|')) for params in server.requests] == [50, 50, 20]
+    assert len(death_years) == 120
+    assert death_years['Q5686'] == '1870'
+    assert death_years['Q183492'] == author_store.UNRESOLVED
+    assert death_years['Q900000'] == author_store.UNRESOLVED
@@ -0,0 +1,431 @@
+"""Text_cleaning.py.
+
+Book text cleaning engine shared by guttenberg2.py and guttenberg_bundles.py.
+
+All patterns are compiled once at import time, and every group of removal
+patterns is guarded by one combined alternation of the literals its patterns
+require, so groups that cannot match a given book cost a single scan instead
+of one pass per pattern. Patterns of a group that may match are still applied
+one after another, in the original order.
+
+Removal patterns are matched within a bounded window around the occurrences of
+an anchor literal, under a per pattern time budget, so a stray "[Illustration"
+or "Transcriber's Note" cannot make a lazy DOTALL group run over the rest of
+the book. Books that are slow to clean are logged with per pattern statistics.
+"""
+
+import re
+import time
+import bisect
+import logging
+import functools
+
+
+HEADER_FIELD_PATTERNS = {
+    'Author': re.compile(r"(?:Author|Editor): (.*)\r\n", re.IGNORECASE),
+    'Language': re.compile(r"Language: (.*)\r\n", re.IGNORECASE),
+    'Translator': re.compile(r"Translator: (.*)\r\n", re.IGNORECASE),
+    'Illustrator': re.compile(r"Illustrator: (.*)\r\n", re.IGNORECASE),
+    'Title': re.compile(r"Title: (.*)\r\n"),
+}
+CONTENT_START_PATTERN = re.compile(r"\*\*\* START OF THE PROJECT GUTENBERG .* \*\*\*", re.IGNORECASE)
+CONTENT_END_PATTERN = re.compile(r"\*\*\* END OF THE PROJECT GUTENBERG .* \*\*\*", re.IGNORECASE)
+
+logger = logging.getLogger("pg-cleaning")
+
+# removal patterns are matched in a window of at most MATCH_WINDOW characters after their anchor
+MATCH_WINDOW = 16384
+# time budget of a single removal pattern on a book, seconds; the rest of the book is left as is once spent
+PATTERN_TIME_BUDGET = 2.0
+# books whose cleaning takes longer are logged with the per pattern statistics
+SLOW_CLEANING_SECONDS = 1.0
+
+
+class WindowedPattern:
+    """
+    Removal pattern matched only around occurrences of its anchor.
+
+    The anchor is a cheap regex for a literal every match of the pattern contains,
+    at most `lookback` characters after the match start (at the start itself for
+    lookback=0). For each anchor found, the pattern is only tried at the start
+    positions from `lookback` characters before the anchor to the anchor, and may
+    extend to `lookahead` characters after it, so lazy DOTALL groups cannot run
+    over the whole book and every window is scanned once. Matches are removed left
+    to right without overlapping, like re.sub does.
+    """
+
+    def __init__(self, name, pattern, anchor, lookback=0, lookahead=MATCH_WINDOW, budget=PATTERN_TIME_BUDGET):
+        self.name = name
+        self.pattern = re.compile(pattern, re.IGNORECASE | re.DOTALL)
+        self.anchor = re.compile(anchor, re.IGNORECASE)
+        self.lookback = lookback
+        self.lookahead = lookahead
+        self.budget = budget
+
+    def _match(self, text, anchor, last_end):
+        """Returns the leftmost match starting at most `lookback` characters before the anchor, or None."""
+        endpos = anchor.start() + self.lookahead
+        for pos in range(max(anchor.start() - self.lookback, last_end), anchor.start() + 1):
+            match = self.pattern.match(text, pos, endpos)
+            if match:
+                return match
+        return None
+
+    def sub(self, text, stats=None):
+        started = time.perf_counter()
+        pieces, last_end, anchor_pos, windows, overrun = [], 0, 0, 0, False
+        while True:
+            anchor = self.anchor.search(text, anchor_pos)
+            if not anchor:
+                break
+            windows += 1
+            match = self._match(text, anchor, last_end)
+            if match:
+                pieces.append(text[last_end:match.start()])
+                last_end = anchor_pos = match.end()
+            else:
+                anchor_pos = anchor.start() + 1
+            if time.perf_counter() - started > self.budget:
+                logger.warning(f"Pattern '{self.name}' ran out of its {self.budget}s budget, the rest of the book is left as is")
+                overrun = True
+                break
+        if pieces:
+            pieces.append(text[last_end:])
+            text = ''.join(pieces)
+        record_pattern_stats(stats, self.name, len(pieces) - 1 if pieces else 0, windows, time.perf_counter() - started, overrun)
+        return text
+
+
+def record_pattern_stats(stats, name, matches, windows, elapsed, overrun=False):
+    if stats is None:
+        return
+    entry = stats.setdefault(name, {'matches': 0, 'windows': 0, 'elapsed': 0.0, 'overruns': 0})
+    entry['matches'] += matches
+    entry['windows'] += windows
+    entry['elapsed'] += elapsed
+    entry['overruns'] += overrun
+
+
+def format_pattern_stats(stats, limit=5):
+    """Returns the `limit` most expensive patterns of stats as a single line."""
+    slowest = sorted(stats.items(), key=lambda item: item[1]['elapsed'], reverse=True)[:limit]
+    return ', '.join(f"{name}: {entry['matches']} matches in {entry['windows']} windows, {entry['elapsed']:.3f}s" for name, entry in slowest)
+
+
+# (guard, patterns): patterns are only applied when the guard matches the text
+REMOVAL_PATTERN_GROUPS = [
+    # Illustrations supporting text removal
+    (
+        re.compile(r'\[(\s+)?(Cover Illustration|Illustration|Ilustracion|Ilustración)', re.IGNORECASE),
+        [
+            WindowedPattern('cover illustration', r'\[(\s+)?Cover Illustration](\r\n){2}', r'\[(\s+)?Cover Illustration'),
+            WindowedPattern('illustration', r'\[(\s+)?Illustration](\r\n){2}', r'\[(\s+)?Illustration'),
+            WindowedPattern('illustration caption', r'\[(\s+)?Illustration.+?](\r\n){2}', r'\[(\s+)?Illustration'),
+            WindowedPattern('ilustracion caption', r'\[(\s+)?Ilustracion.+?](\r\n){2}', r'\[(\s+)?Ilustracion'),
+            WindowedPattern('ilustración caption', r'\[(\s+)?Ilustración.+?](\r\n){2}', r'\[(\s+)?Ilustración'),
+        ]
+    ),
+    # Proofread text removal
+    (
+        re.compile(r'produced|prepared', re.IGNORECASE),
+        [
+            WindowedPattern('pgdp credits', r'Produced(.+?)?(\s+)?at(\s+)?(https://|http://)?(www\.)?pgdp\.net(\s+)?(.+?)?(\r\n){3}', r'Produced'),
+            WindowedPattern('ebooksgratuits credits', r'Produced(.+?)?(\s+)?by(\s+)?(www\.)?ebooksgratuits\.com(\s+)?(.+?)?(\r\n){3}', r'Produced'),
+            WindowedPattern('etext credits', r'(this\s+)?E(-)?(text|book)(\s+)?(is|was)?(\s+)?(produced|prepared)(\s+)?(.+?)?(\r\n){3}', r'E-?(?:text|book)', lookback=64),
+        ]
+    ),
+]
+# Supporting text removal, looked for in the first 5% of the text only
+PRODUCED_BY_PATTERN = re.compile(r'Produced(\s+)?by(\s+)?(.+?)?(\s+)?(.+?)?(\r\n){2}', re.IGNORECASE | re.DOTALL)
+LATE_REMOVAL_PATTERN_GROUPS = [
+    # Transcriber notes removal
+    (
+        re.compile(r'Transcriber|Notes de transcription:|\[Sidenote|\[Note', re.IGNORECASE),
+        [
+            WindowedPattern('transcriber notes', r'(\[)?(\+)?(-{3,}(\+)?)?(\s+)?(\|)?Transcriber(\'s|’s)?(\s+)?Note(s)?(\s+)?(:)?(\+)?(\s+)?(.+?)?(\r\n){3}', r'Transcriber', lookback=256),
+            WindowedPattern('notes de transcription', r'Notes de transcription:(\s+)?(:)?(\+)?(\s+)?(.+?)?(\r\n){3}', r'Notes de transcription:'),
+            WindowedPattern('sidenotes', r'\[Sidenote(s)?(\s+)?:(\s+)?(.+?)?(\r\n){2}', r'\[Sidenote'),
+            WindowedPattern('notes', r'\[Note(s)?(\s+)?:(\s+)?(.+?)?(\r\n){2}', r'\[Note'),
+        ]
+    ),
+    # Removal of project guttenberg marks
+    (
+        re.compile(r'PROJECT(\s+)?GUTENBERG', re.IGNORECASE),
+        [
+            WindowedPattern('start mark', r'START(\s+)?OF(\s+)?(THE)?(\s+)?PROJECT(\s+)?GUTENBERG.+?(\r\n){2}', r'PROJECT(\s+)?GUTENBERG', lookback=256),
+            WindowedPattern('end mark', r'END(\s+)?OF(\s+)?(THE)?(\s+)?PROJECT(\s+)?GUTENBERG.+?(\r\n){2}', r'PROJECT(\s+)?GUTENBERG', lookback=256),
+        ]
+    ),
+]
+
+CONTENTS_PATTERN = re.compile(
+    r"\s+(_)?(table\s+des\s+matières|contenu|liste\s+des\s+matières|contenidos|Índice|Tabla\s+de\s+contenidos|capítulos|list\s+of\s+contents|table\s+of\s+contents|content|contents|contents of volume|contents of volume [IVX]{1,3}|contents of vol|contents of vol(\.)?(\s+[IVX]{1,3})?|chapters|file numbers)(:)?(\.)?(_)?(\n){2,}",
+    re.IGNORECASE | re.DOTALL
+)
+CONTENTS_OF_PATTERN = re.compile(r"(content|contents|chapters|file numbers)(:)?(\.)?(\n)+(\s)*of", re.IGNORECASE)
+PREFACE_PATTERN = re.compile(r'(preface|foreword|prefatory note|préface|vorwort|prólogo|prefacio|prefazione)(\.)?(\n){2}', re.IGNORECASE)
+# preface heading when sections are separated by 3 newlines
+PREFACE_ALT_PATTERN = re.compile(r'(_)?(preface|foreword|prefatory note)(\.)?(_)?(\n){2}', re.IGNORECASE)
+APPENDIX_PATTERN = re.compile(r'(_)?(Index)(\.)?(:)?(_)?(\n){2}', re.IGNORECASE)
+# bundles also cut "Index to Letters" appendixes
+APPENDIX_LETTERS_PATTERN = re.compile(r'(_)?(Index|Index\s+to\s+Letters)(\.)?(:)?(_)?(\n){2}', re.IGNORECASE)
+ILLUSTRATIONS_LIST_PATTERN = re.compile(
+    r'(LIST OF ILLUSTRATIONS|List [Oo]f [iI]llustrations|ILLUSTRATIONS OF VOLUME|Illustrations [Oo]f [Vv]olume|ILLUSTRATIONS TO VOLUME|Illustrations [Tt]o [Vv]olume|ILLUSTRATIONS OF VOL|Illustrations [Oo]f [Vv]ol|Illustrations [Tt]o [Vv]ol|ILLUSTRATIONS|Illustrations)(\.)?'
+)
+PLATES_LIST_PATTERN = re.compile(r'(LIST OF PLATES|List [Oo]f [pP]lates|PLATES OF VOLUME|Plates [Oo]f [Vv]olume)(\.)?')
+CONTENTS_HEADER_PATTERN = re.compile(
+    r"(_)?(table\s+des\s+matières|contenu|liste\s+des\s+matières|contenidos|Índice|Tabla\s+de\s+contenidos|capítulos|list\s+of\s+contents|table\s+of\s+contents|contents|content|contents of volume|contents of volume [IVX]{1,3}|contents of vol|contents of vol(\.)?(\s+[IVX]{1,3})?|chapters|file numbers)(:)?(\.)?(_)?(\n{1,})?",
+    re.DOTALL | re.IGNORECASE
+)
+CONTENTS_PAGE_PATTERN = re.compile(r'page(s)?(\n)?', re.IGNORECASE)
+CONTENTS_CHAPTER_PATTERN = re.compile(r'^((\s+)?chapter|part|volume)', re.IGNORECASE)
+CONTENTS_LINE_PATTERN = re.compile(r'([IVX]+|\d+)?(\.)?(\s+)?(.+?)(,)?\s+(\d+|[ivx]+(\.)?)$', re.IGNORECASE | re.DOTALL)
+# run of 2 or more newlines, underscores inside the run are dropped by the normalizer
+PARAGRAPH_BREAK_PATTERN = re.compile(r'(\n(?:_*\n)+)')
+# sections are separated by runs of 3 or 4 newlines
+NEWLINES_PATTERN = re.compile(r'\n+')
+SECTION_SEPARATOR_LENGTHS = (3, 4)
+
+
+def find_header_fields(text):
+    """Returns first raw value of each header field found in text, None for missing fields."""
+    fields = {}
+    for field, pattern in HEADER_FIELD_PATTERNS.items():
+        field_search = pattern.search(text)
+        fields[field] = field_search.group(1) if field_search else None
+    return fields
+
+
+def parse_book_header(text):
+    """Returns Title, Author, Language, Translator and Illustrator of a raw book text, empty for missing fields."""
+    fields = find_header_fields(text)
+    return {
+        "Title": (fields['Title'] or "").strip().replace('\\', '-').replace('/', '-').replace('&', ' and '),
+        "Author": (fields['Author'] or "").strip().replace('\\', '-').replace('/', '-').replace('&', ' and '),
+        "Language": fields['Language'] or "",
+        "Translator": fields['Translator'] or "",
+        "Illustrator": fields['Illustrator'] or "",
+    }
+
+
+def _apply_removal_groups(text, groups, stats=None):
+    for guard, patterns in groups:
+        if not guard.search(text):
+            continue
+        for _pattern in patterns:
+            text = _pattern.sub(text, stats)
+    return text
+
+
+def clean_book_text(text, stats=None):
+    """
+    Cuts the book body out of raw text and removes illustrations, proofreading and transcriber notes.
+
+    When `stats` is a dict, per pattern match counts and elapsed time are added to it.
+    """
+    started = time.perf_counter()
+    stats = {} if stats is None else stats
+    book_content_start_index = CONTENT_START_PATTERN.search(text)
+    book_content_start_index = book_content_start_index.end() if book_content_start_index else 0
+    book_content_end_index = CONTENT_END_PATTERN.search(text)
+    book_content_end_index = book_content_end_index.start() if book_content_end_index else -1
+    text = text[book_content_start_index:book_content_end_index]
+    text = _apply_removal_groups(text, REMOVAL_PATTERN_GROUPS, stats)
+    produced_by_started = time.perf_counter()
+    produced_by_search = PRODUCED_BY_PATTERN.search(text[:int(len(text) * 0.05)])
+    if produced_by_search:
+        text = text.replace(produced_by_search.group(0), '', )
+    record_pattern_stats(stats, 'produced by', int(bool(produced_by_search)), 1, time.perf_counter() - produced_by_started)
+    text = _apply_removal_groups(text, LATE_REMOVAL_PATTERN_GROUPS, stats)
+    elapsed = time.perf_counter() - started
+    if elapsed > SLOW_CLEANING_SECONDS:
+        logger.warning(f"Cleaning took {elapsed:.1f}s, slowest patterns: {format_pattern_stats(stats)}")
+    #
+    return text.replace('\r\n', '\n')
+
+
+def normalize_inline(text):
+    """Removes underscores and halves runs of spaces and dashes."""
+    return text.replace('_', '').replace('  ', ' ').replace('--', '-')
+
+
+@functools.lru_cache(maxsize=256)
+def _normalized_break(paragraph_break):
+    # runs of 4 newlines are halved first, then pairs of newlines are kept and an odd one becomes a space
+    newlines = sum(len(run) - 2 * (len(run) // 4) for run in paragraph_break.split('_'))
+    return '\n' * (newlines - newlines % 2) + ' ' * (newlines % 2)
+
+
+def normalize_section(text):
+    """
+    Normalizes whitespace and markup of a book section: paragraphs are separated by
+    a blank line, lines of a paragraph are joined with spaces, underscores are removed
+    and runs of spaces and dashes are halved.
+
+    The text is split once at paragraph breaks and joined once, intermediate copies
+    are paragraph sized.
+    """
+    parts = PARAGRAPH_BREAK_PATTERN.split(text)
+    parts[::2] = [normalize_inline(paragraph).replace('\n', ' ') for paragraph in parts[::2]]
+    parts[1::2] = [_normalized_break(paragraph_break) for paragraph_break in parts[1::2]]
+    return ''.join(parts)
+
+
+class BlankLineIndex:
+    """
+    Sorted offsets of the runs of newlines separating the sections of a text, built in one scan.
+
+    find() and rfind() return the same values as text[start:end].find('\n' * length) and
+    text[start:end].rfind('\n' * length), with a binary search instead of a copy and a scan of the slice.
+    """
+
+    def __init__(self, text):
+        self.text_length = len(text)
+        runs = []
+        # str.find is much faster than a regex scan over the whole text
+        start = text.find('\n\n\n')
+        while start != -1:
+            end = NEWLINES_PATTERN.match(text, start).end()
+            runs.append((start, end))
+            start = text.find('\n\n\n', end)
+        self.starts, self.ends = {}, {}
+        for length in SECTION_SEPARATOR_LENGTHS:
+            self.starts[length] = [start for start, end in runs if end - start >= length]
+            self.ends[length] = [end for start, end in runs if end - start >= length]
+
+    def find(self, length, start=0, end=None):
+        start, end, _ = slice(start, end).indices(self.text_length)
+        # first run with room for the separator after start
+        i = bisect.bisect_left(self.ends[length], start + length)
+        if i == len(self.ends[length]):
+            return -1
+        position = max(self.starts[length][i], start)
+        return position - start if position + length <= end else -1
+
+    def rfind(self, length, start=0, end=None):
+        start, end, _ = slice(start, end).indices(self.text_length)
+        # last run starting early enough for the separator to end before end
+        i = bisect.bisect_right(self.starts[length], end - length) - 1
+        if i < 0:
+            return -1
+        position = min(self.ends[length][i], end) - length
+        return position - start if position >= start else -1
+
+
+def _section_end(blank_lines, heading_end, skip, length):
+    # end of the section whose heading ends at heading_end: the next separator `skip` characters after the heading
+    return heading_end + skip + blank_lines.find(length, heading_end + skip)
+
+
+def split_book_sections(text, appendix_pattern=APPENDIX_PATTERN):
+    """
+    Splits cleaned book text into sections.
+
+    Section boundaries are looked up in a BlankLineIndex of the text and headings are
+    searched with pos/endpos bounds, only the sections themselves are copied.
+
+    Args:
+        text (str): book text returned by clean_book_text.
+        appendix_pattern (re.Pattern): heading of the trailing index cut from the body.
+
+    Returns:
+        dict: "Publisher Notes", "Contents" (raw, before any LLM formatting), "Preface" and "Text".
+    """
+    blank_lines = BlankLineIndex(text)
+    head_end = int(len(text) * 0.15)
+    # BOOK PUBLISHER NOTES
+    book_publisher_notes_start_index, book_publisher_notes_end_index = 0, blank_lines.find(4, 100, int(len(text) * 0.02))
+    if book_publisher_notes_end_index != -1:
+        book_publisher_notes_end_index += 100
+    else:
+        book_publisher_notes_end_index = 0
+    book_publisher_notes = text[book_publisher_notes_start_index:book_publisher_notes_end_index]
+    # BOOK CONTENTS
+    contents_search = CONTENTS_PATTERN.search(text, 0, head_end)
+    if contents_search and not CONTENTS_OF_PATTERN.search(text, 0, contents_search.start() + 100):
+        contents_start_index = contents_search.start()
+        contents_end_index = _section_end(blank_lines, contents_search.end(), 5, 4)
+    else:
+        contents_end_index = contents_start_index = 0
+    book_contents = text[contents_start_index:contents_end_index]
+    # Book preface
+    preface_search = PREFACE_PATTERN.search(text, 0, head_end)
+    if preface_search:
+        preface_start_index = preface_search.start()
+        preface_end_index = _section_end(blank_lines, preface_search.end(), 10, 4)
+        book_preface = text[preface_start_index:preface_end_index]
+    else:
+        preface_end_index = 0
+        book_preface = ""
+    # check if sections are separated by 3 newlines
+    if book_publisher_notes_end_index == contents_end_index == preface_end_index:
+        # BOOK PUBLISHER NOTES
+        book_publisher_notes_start_index, book_publisher_notes_end_index = 0, blank_lines.rfind(3, 100, int(len(text) * 0.02))
+        if book_publisher_notes_end_index != -1:
+            book_publisher_notes_end_index += 100
+        else:
+            book_publisher_notes_end_index = 0
+        book_publisher_notes = text[book_publisher_notes_start_index:book_publisher_notes_end_index]
+        # BOOK CONTENTS
+        if contents_search and not CONTENTS_OF_PATTERN.search(text, 0, contents_search.start() + 100):
+            contents_start_index = contents_search.start()
+            contents_end_index = _section_end(blank_lines, contents_search.end(), 5, 3)
+        else:
+            contents_end_index = contents_start_index = 0
+        book_contents = text[contents_start_index:contents_end_index]
+        preface_search = PREFACE_ALT_PATTERN.search(text, 0, head_end)
+        if preface_search:
+            preface_start_index = preface_search.start()
+            preface_end_index = _section_end(blank_lines, preface_search.end(), 10, 3)
+            book_preface = text[preface_start_index:preface_end_index]
+        else:
+            preface_end_index = 0
+            book_preface = ""
+    # BOOK INDEX
+    appendix_search = appendix_pattern.search(text, int(len(text) * 0.8))
+    if appendix_search:
+        appendix_start_index = appendix_search.start()
+    else:
+        appendix_start_index = len(text)
+    # Clean book body, kept as (body_start, body_end) offsets until the final copy
+    body_start, body_end, _ = slice(max(book_publisher_notes_end_index, contents_end_index, preface_end_index), appendix_start_index).indices(len(text))
+    body_end = max(body_start, body_end)
+    # Illustrations list, then plates list
+    for list_pattern in (ILLUSTRATIONS_LIST_PATTERN, PLATES_LIST_PATTERN):
+        list_search = list_pattern.search(text, body_start, body_start + int((body_end - body_start) * 0.15))
+        if list_search:
+            list_end_index = list_search.start() - body_start + blank_lines.find(4, list_search.start(), body_end)
+            # same start as body[list_end_index:], negative when no separator follows the list
+            body_start += slice(list_end_index, None).indices(body_end - body_start)[0]
+    text = text[body_start:body_end]
+    #
+    if book_contents and book_contents in book_publisher_notes:
+        book_publisher_notes = ""
+    book_publisher_notes = normalize_section(book_publisher_notes)
+    #
+    book_contents_header_search = CONTENTS_HEADER_PATTERN.search(book_contents)
+    book_contents_header = book_contents_header_search.group() if book_contents_header_search else ''
+    book_contents = CONTENTS_PAGE_PATTERN.sub('', book_contents)
+    book_contents = book_contents.replace(book_contents_header, '').replace('\n\n\n', '\n').replace('\n\n', '\n')
+    book_contents_lines = []
+    for book_contents_line in book_contents.split('\n'):
+        if book_contents_line and not CONTENTS_CHAPTER_PATTERN.search(book_contents_line):
+            book_contents_lines.append(CONTENTS_LINE_PATTERN.sub(r'\1\2\3 \4', book_contents_line) + '\n')
+        elif book_contents_line:
+            book_contents_lines.append(book_contents_line + '\n')
+    book_contents = book_contents_header + normalize_inline(''.join(book_contents_lines))
+    book_preface = normalize_section(book_preface)
+    text = normalize_section(text)
+    return {
+        "Publisher Notes": book_publisher_notes,
+        "Contents": book_contents,
+        "Preface": book_preface,
+        "Text": text
+    }
+
+
+def parse_raw_book(text, appendix_pattern=APPENDIX_PATTERN):
+    """Returns header fields and sections of a raw book text, contents are not LLM formatted."""
+    book = parse_book_header(text)
+    book.update(split_book_sections(clean_book_text(text), appendix_pattern))
+    return book
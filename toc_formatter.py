@@ -0,0 +1,146 @@
+"""Toc_formatter.py.
+
+Rule based formatting of book Contents sections.
+
+Most Gutenberg tables of contents are lists of Roman or Arabic numbered
+entries, often with trailing page numbers and dotted leaders. Those are
+formatted locally the way the OpenAI formatting prompt asks: numerals are
+kept, page numbers and leaders removed, lines aligned to the left with single
+spaces and a trailing Index entry dropped. Each result comes with a
+confidence score, the share of lines recognized as contents entries, and only
+sections scoring below the threshold are sent to the LLM.
+"""
+
+import os
+import re
+import logging
+import threading
+
+from text_cleaning import CONTENTS_HEADER_PATTERN
+
+
+logger = logging.getLogger("pg-toc")
+
+DEFAULT_THRESHOLD = float(os.environ.get('PG_TOC_MIN_CONFIDENCE', '0.8'))
+# unnumbered title lines only count half when they outnumber the numbered or paged lines
+UNNUMBERED_WEIGHT = 0.5
+TITLE_MAX_LENGTH = 100
+TITLE_MAX_WORDS = 16
+
+LABEL = r'(?i:chapter|chap\.|part|book|volume|vol\.|letter|canto|act|scene|section|stave|story)'
+NUMERAL = r'(?:[IVXLCDM]+|[ivxlcdm]+|\d+)'
+# "IV. Title", "12) Title", "CHAPTER IV: Title", "Part 2 — Title", "CHAPTER IV."
+NUMBERED_PATTERN = re.compile(rf'(?:{LABEL}\s+)?{NUMERAL}(?:[.:)\-—]\s*|\s+)(?=\S)|{LABEL}\s+{NUMERAL}[.:]?$|{LABEL}\s+(?i:the\s+)?[A-Za-z]+[.:]?$')
+# front and back matter entries, recognized without numbers
+MATTER_PATTERN = re.compile(r'(?i:preface|introduction|foreword|prologue|epilogue|conclusion|appendix|notes|glossary|afterword|postscript|bibliography)[.:]?')
+LABEL_ONLY_PATTERN = re.compile(rf'{LABEL}(?:\s+{NUMERAL})?[.:]?')
+# page number after a dotted leader, a wide gap or a comma: "Title ..... 12", "Title      xi", "Title, 12"
+LEADER_PAGE_PATTERN = re.compile(r'(?:\s*(?:\.\s?){2,}|\s*…+|\s*_{2,}|\s*-{3,}|\s*,|\s{2,}|\t)\s*(?:p\.\s*)?(?:\d{1,4}|[ivxlc]{1,7})\.?$')
+# page number after a single space, only stripped when most lines of the section end with one
+PAGE_PATTERN = re.compile(r'\s+\d{1,4}$')
+LEADER_PATTERN = re.compile(r'(?:\s*(?:\.\s?){3,}|\s*…+|\s*_{2,}|\s*-{3,})$')
+INDEX_PATTERN = re.compile(r'(?i:index)[.:]?')
+MARKUP_PATTERN = re.compile(r'\[(?:Illustration|Ilustración|Footnote)|\+--|\*\s*\*\s*\*', re.IGNORECASE)
+SPACES_PATTERN = re.compile(r'\s+')
+
+_toc_formatter = None
+
+
+def _strip_page(line, paged):
+    """Returns (line without trailing page number and leader, whether one was found)."""
+    search = LEADER_PAGE_PATTERN.search(line) or (PAGE_PATTERN.search(line) if paged else None)
+    if not search or not search.start() or LABEL_ONLY_PATTERN.fullmatch(line[:search.start()].strip()):
+        leader = LEADER_PATTERN.search(line)
+        return (line[:leader.start()], True) if leader and leader.start() else (line, False)
+    return line[:search.start()].rstrip(' ,'), True
+
+
+def _is_title(line):
+    return len(line) <= TITLE_MAX_LENGTH and len(line.split()) <= TITLE_MAX_WORDS and not MARKUP_PATTERN.search(line)
+
+
+def format_contents(book_contents):
+    """
+    Formats raw "Contents" section with rules.
+
+    Args:
+        book_contents (str): The unformatted "Contents" section, as returned by text_cleaning.parse_raw_book.
+
+    Returns:
+        tuple: (formatted contents, confidence between 0 and 1), ("", 1.0) for empty contents.
+    """
+    lines = [line.strip() for line in book_contents.split('\n')]
+    lines = [line for line in lines if line and line.strip('_')]
+    if not lines:
+        return "", 1.0
+    header = ''
+    if CONTENTS_HEADER_PATTERN.fullmatch(lines[0]):
+        header = lines.pop(0).strip('_').strip()
+    # sections ending lines mostly with numbers have page numbers even after a single space
+    paged = sum(bool(PAGE_PATTERN.search(line)) for line in lines) * 2 > len(lines)
+    entries = []
+    for line in lines:
+        line, had_page = _strip_page(line, paged)
+        line = SPACES_PATTERN.sub(' ', line).strip()
+        if line:
+            entries.append((line, had_page))
+    if entries and INDEX_PATTERN.fullmatch(entries[-1][0]):
+        entries.pop()
+    if not entries:
+        return (header + '\n' if header else ""), 1.0
+    recognized = [had_page or bool(NUMBERED_PATTERN.match(line) or MATTER_PATTERN.fullmatch(line)) for line, had_page in entries]
+    numbered = sum(recognized)
+    titles = sum(not known and _is_title(line) for (line, _), known in zip(entries, recognized))
+    confidence = (numbered + titles * (1 if numbered >= titles else UNNUMBERED_WEIGHT)) / len(entries)
+    formatted = '\n'.join(line for line, _ in entries)
+    if header:
+        formatted = f"{header}\n\n{formatted}"
+    return formatted + '\n', confidence
+
+
+class TocFormatter:
+    """Formats Contents sections with rules, falling back to the LLM for low confidence ones, and counts both."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.local = self.fallbacks = self.empty = 0
+        self._lock = threading.Lock()
+
+    def needs_llm(self, confidence):
+        return confidence < self.threshold
+
+    def format(self, book_contents, llm_format):
+        """Returns formatted contents, llm_format(book_contents) when the rules are not confident enough."""
+        formatted, confidence = format_contents(book_contents)
+        if not formatted:
+            with self._lock:
+                self.empty += 1
+            return book_contents
+        if not self.needs_llm(confidence):
+            with self._lock:
+                self.local += 1
+            return formatted
+        logger.debug(f"Contents formatting confidence {confidence:.2f}, falling back to the LLM")
+        with self._lock:
+            self.fallbacks += 1
+        return llm_format(book_contents)
+
+    def summary(self):
+        formatted = self.local + self.fallbacks
+        return (
+            f"Contents formatting: {self.local} local, {self.fallbacks} LLM fallbacks"
+            + (f" ({self.fallbacks / formatted:.0%})" if formatted else "") + f", {self.empty} empty"
+        )
+
+
+def get_toc_formatter():
+    global _toc_formatter
+    if _toc_formatter is None:
+        _toc_formatter = TocFormatter()
+    return _toc_formatter
+
+
+def configure_toc_formatter(threshold=None):
+    """Replaces process wide contents formatter, unset threshold keeps the default."""
+    global _toc_formatter
+    _toc_formatter = TocFormatter(threshold) if threshold is not None else TocFormatter()
@@ -0,0 +1,241 @@
+"""Wikidata_resolver.py.
+
+Batched resolution of author death years on Wikidata.
+
+Authors pending for a run are collected and resolved together in a background
+thread. Authors not yet known to the author store are searched once
+(wbsearchentities), then the claims of up to 50 entities are fetched per
+wbgetentities request (props=claims) instead of one full Special:EntityData
+document per author, and only the date of death claims (P570) are read.
+Lookups waited for by the caller are served before prefetched ones. The API
+URL can be changed with PG_WIKIDATA_API_URL, e.g. to a local fixture server.
+Callers with a deadline stop waiting at it, and the requests of a batch only
+waited for by such callers stop at the latest of their deadlines.
+"""
+
+import os
+import time
+import logging
+import threading
+import collections
+import concurrent.futures
+
+import http_client
+from circuit_breaker import CircuitOpenError
+from author_store import UNRESOLVED, display_author_name, get_author_store, normalize_author_name
+
+
+logger = logging.getLogger("pg-wikidata")
+
+WIKIDATA_API_URL = os.environ.get('PG_WIKIDATA_API_URL', 'https://www.wikidata.org/w/api.php')
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows; U; Windows NT 6.1; zh-CN) AppleWebKit/533+ (KHTML, like Gecko)'}
+ENTITIES_PER_REQUEST = 50
+SEARCH_CONCURRENCY = 4
+# seconds a lookup waits for others to share its wbgetentities request
+DEFAULT_LINGER = 0.2
+DATE_OF_DEATH = 'P570'
+RANKS = {'preferred': 0, 'normal': 1}
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def claims_death_year(claims):
+    """Returns the year of the best ranked date of death claim, or UNRESOLVED."""
+    statements = [statement for statement in claims.get(DATE_OF_DEATH, []) if statement.get('rank', 'normal') in RANKS]
+    for statement in sorted(statements, key=lambda statement: RANKS[statement.get('rank', 'normal')]):
+        time_value = (statement.get('mainsnak', {}).get('datavalue') or {}).get('value', {}).get('time')
+        if time_value:
+            # "+1870-06-09T00:00:00Z"
+            return time_value[1:5]
+    return UNRESOLVED
+
+
+class WikidataResolver:
+    def __init__(self, api_url=WIKIDATA_API_URL, batch_size=ENTITIES_PER_REQUEST, linger=DEFAULT_LINGER):
+        self.api_url = api_url
+        self.batch_size = batch_size
+        self.linger = linger
+        self.searches = self.entity_requests = self.failures = 0
+        # normalized name -> [author name, futures, due], lookups waited for first
+        self._waited = collections.OrderedDict()
+        self._prefetched = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def _get(self, params):
+        response = http_client.get(self.api_url, params={'format': 'json', **params}, headers=HEADERS)
+        if response.status_code != 200:
+            raise RuntimeError(f"Wikidata API returned {response.status_code}")
+        return response.json()
+
+    def search_id(self, author_name):
+        """Returns Wikidata ID of the best match of the author name, or None."""
+        data = self._get({'action': 'wbsearchentities', 'language': 'en', 'search': display_author_name(author_name), 'type': 'item'})
+        results = data.get('search') or []
+        return results[0]['id'] if results else None
+
+    def fetch_death_years(self, ids):
+        """Returns {id: death year} of the entities, claims of up to batch_size entities per request; failed batches are left out."""
+        ids = sorted(set(ids))
+        death_years = {}
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start + self.batch_size]
+            self.entity_requests += 1
+            try:
+                entities = self._get({'action': 'wbgetentities', 'ids': '|'.join(batch), 'props': 'claims'}).get('entities', {})
+            except (CircuitOpenError, http_client.DeadlineExceeded):
+                self.failures += 1
+                continue
+            except Exception as e:
+                logger.warning(f"Wikidata claims request of {len(batch)} entities failed: {e}")
+                self.failures += 1
+                continue
+            for author_id in batch:
+                death_years[author_id] = claims_death_year(entities.get(author_id, {}).get('claims') or {})
+        return death_years
+
+    def _search_id(self, author_name, due):
+        with http_client.deadline(due):
+            return self.search_id(author_name)
+
+    def resolve(self, author_names, due=None):
+        """
+        Returns {author name: death year}, resolved IDs and death years are saved to the author store.
+
+        With `due` (time.monotonic() value) the search and claims requests stop at that time, authors
+        left unresolved by then are not stored.
+        """
+        store = get_author_store()
+        ids, failed = {}, set()
+        # authors resolved before keep their ID, only their claims are fetched again
+        unknown = []
+        for author_name in author_names:
+            author_id = store.ref(author_name, 'wikidata') if store else None
+            if author_id:
+                ids[author_name] = author_id
+            else:
+                unknown.append(author_name)
+        self.searches += len(unknown)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY) as executor:
+            searches = [(author_name, executor.submit(self._search_id, author_name, due)) for author_name in unknown]
+            for author_name, search in searches:
+                try:
+                    author_id = search.result()
+                except (CircuitOpenError, http_client.DeadlineExceeded):
+                    # skipped while Wikidata is degraded (counted in the circuit breakers summary), or past the deadline
+                    self.failures += 1
+                    failed.add(author_name)
+                    continue
+                except Exception as e:
+                    logger.warning(f"Wikidata search of {author_name} failed: {e}")
+                    self.failures += 1
+                    failed.add(author_name)
+                    continue
+                if author_id:
+                    ids[author_name] = author_id
+                else:
+                    logger.info(f"No data found on Wikidata for {author_name}")
+        with http_client.deadline(due):
+            death_years = self.fetch_death_years(ids.values())
+        results = {}
+        for author_name in author_names:
+            author_id = ids.get(author_name)
+            if author_name in failed or (author_id and author_id not in death_years):
+                # request failures are not stored, the author is looked up again next time
+                results[author_name] = UNRESOLVED
+                continue
+            results[author_name] = death_years[author_id] if author_id else UNRESOLVED
+            if store:
+                store.put(author_name, 'wikidata', results[author_name], author_id)
+        return results
+
+    def submit(self, author_name, prefetch=False, due=None):
+        """
+        Returns future of the author death year, resolved in the next batch; prefetched lookups come after waited ones.
+
+        `due` is the time.monotonic() deadline of the caller, requests of a batch whose lookups all have one stop at the latest.
+        """
+        future = concurrent.futures.Future()
+        store = get_author_store()
+        stored = store.get(author_name, 'wikidata') if store else None
+        if stored:
+            future.set_result(stored[0])
+            return future
+        key = normalize_author_name(author_name)
+        with self._condition:
+            if not prefetch and key in self._prefetched:
+                self._waited[key] = self._prefetched.pop(key)
+            queue = self._waited if key in self._waited or not prefetch else self._prefetched
+            entry = queue.get(key)
+            if entry is None:
+                queue[key] = [author_name, [future], None if prefetch else due]
+            else:
+                entry[1].append(future)
+                # a lookup without deadline (prefetched or not) keeps the whole entry unbounded
+                entry[2] = None if prefetch or due is None or entry[2] is None else max(entry[2], due)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="wikidata-resolver", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def death_year(self, author_name, due=None):
+        """Returns the author death year, UNRESOLVED once `due` (time.monotonic() value) passes."""
+        future = self.submit(author_name, due=due)
+        try:
+            return future.result(timeout=None if due is None else max(0.0, due - time.monotonic()))
+        except concurrent.futures.TimeoutError:
+            return UNRESOLVED
+
+    def _next_batch(self):
+        with self._condition:
+            while not (self._waited or self._prefetched):
+                self._condition.wait()
+            linger_end = time.monotonic() + self.linger
+            while len(self._waited) + len(self._prefetched) < self.batch_size and time.monotonic() < linger_end:
+                self._condition.wait(linger_end - time.monotonic())
+            batch = []
+            for queue in (self._waited, self._prefetched):
+                while queue and len(batch) < self.batch_size:
+                    batch.append(queue.popitem(last=False)[1])
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            dues = [due for _, _, due in batch]
+            due = None if None in dues else max(dues)
+            try:
+                results = self.resolve([author_name for author_name, _, _ in batch], due)
+            except Exception as e:
+                for _, futures, _ in batch:
+                    for future in futures:
+                        future.set_exception(e)
+                continue
+            for author_name, futures, _ in batch:
+                for future in futures:
+                    future.set_result(results[author_name])
+
+    def summary(self):
+        return f"Wikidata: {self.searches} searches, {self.entity_requests} claims requests, {self.failures} failed"
+
+
+def get_wikidata_resolver():
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = WikidataResolver()
+        return _resolver
+
+
+def configure_wikidata_resolver(api_url=None, linger=None):
+    """Replaces process wide Wikidata resolver, unset options keep their defaults."""
+    global _resolver
+    kwargs = {}
+    if api_url:
+        kwargs['api_url'] = api_url
+    if linger is not None:
+        kwargs['linger'] = linger
+    with _resolver_lock:
+        _resolver = WikidataResolver(**kwargs)